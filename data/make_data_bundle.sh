@@ -53,7 +53,8 @@ sed 's/robert/esteele/g
 s/^CREATE EXTENSION/--CREATE EXTENSION/
 s/^COMMENT ON EXTENSION/--COMMENT ON EXTENSION/' $WALS_LOCATION > $lex_data_dir/$FINAL_WALS_NAME
 
-# Cached files from various scraped sources
+# Cached files from various scraped sources. Once packed (see
+#  docs/DataSources.md), just pages.pack and pages.idx
 mkdir $lex_data_dir/cache;
 cp $CACHE_LOCATION/* $lex_data_dir/cache 
 
@@ -0,0 +1,382 @@
+"""Timing harness for the persistence queries behind the slower pages.
+
+Most benchmarks run against synthetic data in an in-memory sqlite
+database, so need neither the source databases nor a loaded
+language_explorer database. web_modes, signatures and fuzzy use the
+configured deployment (LANGUAGE_EXPLORER_DEPLOYMENT) instead, and
+html_extraction its page cache. page_cache writes to a temporary
+directory.
+
+Usage: python -m language_explorer.benchmark <benchmark name>
+"""
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from language_explorer import constants
+from language_explorer.naming_helper import NamingHelper, SignatureEngine, \
+    BKTree, levenshtein
+from language_explorer.page_cache import DirectoryPageStore, \
+    PackedPageStore, migrate
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.snapshot import SnapshotLanguagePersistence
+
+__author__ = 'esteele'
+
+SCALING_ISO_COUNTS = [100, 200, 400, 800]
+WEB_REQUEST_REPEATS = 20
+# About the number and size of the pages the scraped sources cache
+PAGE_CACHE_PAGES = 3000
+PAGE_CACHE_PAGE_ROWS = 200
+
+
+def _synthetic_iso(n):
+    # Three lower case letters, like a real ISO 639-3 code
+    return "".join(chr(ord("a") + (n // 26 ** i) % 26) for i in (2, 1, 0))
+
+
+def build_synthetic_persistence(iso_count, alternates_per_iso=5):
+    """A LanguagePersistence holding iso_count languages, each with
+    a primary name from every primary source, some alternate names,
+    a dialect, a translation and a full language table row.
+    """
+    p = LanguagePersistence("sqlite:///:memory:")
+    with p.batch():
+        for n in range(iso_count):
+            iso = _synthetic_iso(n)
+            for source in (constants.JOSHUA_PROJECT_SOURCE_ABBREV,
+                           constants.AUSTLANG_SOURCE_ABBREV,
+                           constants.WALS_SOURCE_ABBREV):
+                p.persist_language(iso, "Lang %s %s" % (iso, source), source)
+            for a in range(alternates_per_iso):
+                p.persist_alternate(iso, "Alt %s %s" % (iso, a),
+                                    constants.WALS_SOURCE_ABBREV)
+            p.persist_dialect(iso, "Dialect %s" % (iso,),
+                              constants.JOSHUA_PROJECT_SOURCE_ABBREV)
+            p.persist_translation(
+                iso,
+                {constants.TRANSLATION_STATE_STATE_KEY: n % 6,
+                 constants.TRANSLATION_STATE_YEAR_KEY:
+                     constants.TRANSLATION_STATE_UNKNOWN_YEAR},
+                constants.JOSHUA_PROJECT_SOURCE_ABBREV)
+            p.persist_L1_speaker_count(
+                iso, n, constants.JOSHUA_PROJECT_SOURCE_ABBREV)
+            p.persist_L1_speaker_count(
+                iso, n, constants.AUS_CENSUS_2011_ABBREV)
+            p.persist_english_competency(iso, n % 100, n % 100)
+            p.persist_lat_lon(iso, -20.0, 130.0)
+            p.persist_tindale_lat_lon(iso, -21.0, 131.0)
+        p.persist_relationship(_synthetic_iso(0),
+                               [(constants.RELTYPE_RETIREMENT_CHANGE,
+                                 _synthetic_iso(1))],
+                               constants.SIL_RCEM_SOURCE_ABBREV)
+    return p
+
+
+def time_call(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+
+def benchmark_search_and_map():
+    """Shows that /search and /map data costs scale linearly with ISO count
+
+    The first call in each case includes building the alias index, which
+    is done once per page view after a reload.
+    """
+    print "%6s %12s %14s %12s %14s" % (
+        "isos", "search (s)", "search/iso (ms)", "map (s)", "map/iso (ms)")
+    for iso_count in SCALING_ISO_COUNTS:
+        p = build_synthetic_persistence(iso_count)
+        search_t = time_call(p.get_search_table_data)
+        map_t = time_call(p.get_map_data)
+        print "%6d %12.3f %14.3f %12.3f %14.3f" % (
+            iso_count,
+            search_t, 1000 * search_t / iso_count,
+            map_t, 1000 * map_t / iso_count)
+
+
+def _write_aliases(p, iso_count):
+    for n in range(iso_count):
+        iso = _synthetic_iso(n)
+        p.persist_language(iso, "Lang %s" % (iso,),
+                           constants.JOSHUA_PROJECT_SOURCE_ABBREV)
+        p.persist_classification(iso, ["Family", "Genus %s" % (n % 7,)],
+                                 constants.WALS_SOURCE_ABBREV)
+        p.persist_L1_speaker_count(
+            iso, n, constants.JOSHUA_PROJECT_SOURCE_ABBREV)
+
+
+def benchmark_batch_writes():
+    """Compares unbatched upserts with a single batch() flush"""
+    print "%6s %12s %12s" % ("isos", "direct (s)", "batch (s)")
+    for iso_count in SCALING_ISO_COUNTS:
+        direct_p = LanguagePersistence("sqlite:///:memory:")
+        direct_t = time_call(_write_aliases, direct_p, iso_count)
+        batch_p = LanguagePersistence("sqlite:///:memory:")
+        start = time.time()
+        with batch_p.batch():
+            _write_aliases(batch_p, iso_count)
+        batch_t = time.time() - start
+        print "%6d %12.3f %12.3f" % (iso_count, direct_t, batch_t)
+
+
+def benchmark_web_modes():
+    """Compares page latency when reading from the db, from a snapshot and
+    from the response cache
+
+    Uses the configured language_explorer and WALS databases.
+    """
+    from language_explorer import app, settings, views
+    from language_explorer.response_cache import MemoryPageStore
+    db_url = settings.LANGUAGE_EXPLORER_DB_URL
+    start = time.time()
+    snapshot_p = SnapshotLanguagePersistence(db_url)
+    print "Snapshot load: %.3fs" % (time.time() - start,)
+    db_p = LanguagePersistence(db_url)
+    # Persistence and page stores
+    modes = [("db", db_p, []), ("snapshot", snapshot_p, []),
+             ("cached", db_p, [MemoryPageStore(10)])]
+    paths = ["/language/iso/%s" % (snapshot_p.get_all_iso_codes()[0],),
+             "/table",
+             "/map"]
+    client = app.test_client()
+    print "%-20s %14s %14s %14s" % ("path", "db (ms)", "snapshot (ms)",
+                                    "cached (ms)")
+    for path in paths:
+        timings = []
+        for _, p, stores in modes:
+            views.lp = p
+            views.response_cache.stores = stores
+            # Discard the first request, which fills any caches
+            client.get(path)
+            start = time.time()
+            for _ in range(WEB_REQUEST_REPEATS):
+                client.get(path)
+            timings.append(1000 * (time.time() - start) / WEB_REQUEST_REPEATS)
+        print "%-20s %14.2f %14.2f %14.2f" % tuple([path] + timings)
+
+
+def benchmark_signatures():
+    """Compares signature engines over every name in the alias table"""
+    from language_explorer import settings
+    names = [row.name for row in LanguagePersistence(
+        settings.LANGUAGE_EXPLORER_DB_URL).get_alias_table_contents()]
+    engine = SignatureEngine()
+    reference_t = time_call(
+        lambda: [NamingHelper.reference_signature(n) for n in names])
+    cold_t = time_call(engine.signatures, names)
+    warm_t = time_call(engine.signatures, names)
+    print "%s names (%s distinct)" % (len(names), len(set(names)))
+    print "%-20s %10s %10s" % ("", "total (s)", "speedup")
+    for label, t in [("reference", reference_t),
+                     ("compiled, uncached", cold_t),
+                     ("compiled, cached", warm_t)]:
+        print "%-20s %10.3f %9.1fx" % (label, t, reference_t / t)
+
+
+def benchmark_fuzzy(max_distance=2):
+    """Compares BK-tree fuzzy signature search with comparing against
+    every signature, querying with every alias name"""
+    from language_explorer import settings
+    names = sorted(set(row.name for row in LanguagePersistence(
+        settings.LANGUAGE_EXPLORER_DB_URL).get_alias_table_contents()))
+    signatures = sorted(set(NamingHelper.signatures(names)))
+    distance_calls = [0]
+
+    def counting_levenshtein(a, b):
+        distance_calls[0] += 1
+        return levenshtein(a, b)
+
+    start = time.time()
+    tree = BKTree(signatures, distance=counting_levenshtein)
+    build_t = time.time() - start
+    build_calls = distance_calls[0]
+
+    distance_calls[0] = 0
+    start = time.time()
+    tree_results = [tree.search(NamingHelper.signature(name), max_distance)
+                    for name in names]
+    tree_t = time.time() - start
+    tree_calls = distance_calls[0]
+
+    start = time.time()
+    brute_results = []
+    for name in names:
+        sig = NamingHelper.signature(name)
+        brute_results.append(sorted(
+            (d, s) for d, s in ((levenshtein(sig, s), s) for s in signatures)
+            if d <= max_distance))
+    brute_t = time.time() - start
+
+    print "%s names, %s signatures, max distance %s" % (
+        len(names), len(signatures), max_distance)
+    print "BK-tree build: %.3fs, %s comparisons" % (build_t, build_calls)
+    print "%-12s %12s %16s" % ("", "per name (ms)", "comparisons/name")
+    print "%-12s %12.3f %16.1f" % ("bk-tree", 1000 * tree_t / len(names),
+                                   float(tree_calls) / len(names))
+    print "%-12s %12.3f %16.1f" % ("brute force", 1000 * brute_t / len(names),
+                                   float(len(signatures)))
+    print "Results identical: %s" % (tree_results == brute_results,)
+
+
+def _cached_texts(source):
+    prefix = source.generate_filename_from_url(source.CACHE_URL_PREFIX)
+    # Every url with the prefix is decoded in the same way
+    return [source.decode_page(source.CACHE_URL_PREFIX,
+                               source.page_store.read(key))
+            for key in source.page_store.keys(prefix)]
+
+
+def _extraction_outcome(extract, text):
+    # Pages lacking the element fail alike, e.g. the FALSE_IDS
+    try:
+        return extract(text)
+    except AttributeError as e:
+        return e.__class__
+
+
+def benchmark_html_extraction():
+    """Compares parsing whole cached pages with parsing only the elements
+    used, in this process and in a pool, and checks that every page gives
+    the same result either way
+
+    Uses the configured page cache.
+    """
+    from language_explorer import settings
+    from language_explorer.language_sources import extraction
+    from language_explorer.language_sources.findabible import \
+        FindABibleAdapter
+    from language_explorer.language_sources.tindale import TindaleAdapter
+    tindale_texts = _cached_texts(TindaleAdapter(settings.CACHE_ROOT, None))
+    fab_texts = _cached_texts(FindABibleAdapter(settings.CACHE_ROOT))
+    print "Parser: %s, %s Tindale pages, %s Find a Bible pages" % (
+        extraction.PARSER, len(tindale_texts), len(fab_texts))
+    print "%-24s %6s %10s %11s %10s %10s" % (
+        "", "pages", "full (s)", "partial (s)", "pooled (s)", "identical")
+    for name, marker, texts in [
+            ("tindale_coordinates", "Co-ordinates", tindale_texts),
+            ("tindale_index_hrefs", "TribeIndex", tindale_texts),
+            ("find_a_bible_translation", None, fab_texts)]:
+        extract = getattr(extraction, "extract_" + name)
+        reference = getattr(extraction, "reference_" + name)
+        if marker is not None:
+            texts = [text for text in texts if marker in text]
+        start = time.time()
+        expected = [_extraction_outcome(reference, t) for t in texts]
+        full_t = time.time() - start
+        start = time.time()
+        actual = [_extraction_outcome(extract, t) for t in texts]
+        partial_t = time.time() - start
+        # Only pages that extract cleanly can go to the pool
+        pooled_texts = [t for t, e in zip(texts, expected)
+                        if e is not AttributeError]
+        start = time.time()
+        extraction.extract_all(extract, pooled_texts)
+        pooled_t = time.time() - start
+        print "%-24s %6d %10.3f %11.3f %10.3f %10s" % (
+            name, len(texts), full_t, partial_t, pooled_t,
+            actual == expected)
+        for text, e, a in zip(texts, expected, actual):
+            if e != a:
+                print "  Differs: %r != %r" % (a, e)
+
+
+def _synthetic_page(n):
+    words = ["Arrernte", "Co-ordinates", "Language", "133", "24", "E", "S",
+             "Dialect", "AIATSIS", "speakers", "Tribe", "River"]
+    rows = "".join("<tr><td>%s</td><td>%s %s</td></tr>\n" % (
+        random.choice(words), random.choice(words), random.randint(0, 9999))
+        for _ in range(PAGE_CACHE_PAGE_ROWS))
+    return "<html><body><h1>Page %s</h1><table>\n%s</table></body></html>" \
+        % (n, rows)
+
+
+def _disk_usage(root):
+    names = os.listdir(root)
+    return len(names), sum(os.path.getsize(os.path.join(root, name))
+                           for name in names)
+
+
+def _drop_os_page_cache():
+    """Whether the OS's cached file contents could be dropped. Needs root,
+    on Linux"""
+    os.system("sync")
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+    except IOError:
+        return False
+    return True
+
+
+def benchmark_page_cache():
+    """Compares reading every page of a cache laid out as a file per page
+    with reading it from a pack, each through a newly opened store and,
+    where possible, with nothing in the OS's file cache
+    """
+    random.seed(0)
+    root = tempfile.mkdtemp()
+    try:
+        flat_root = os.path.join(root, "flat")
+        os.mkdir(flat_root)
+        flat = DirectoryPageStore(flat_root)
+        for n in range(PAGE_CACHE_PAGES):
+            flat.write("http~##example_org#page%05d_htm" % (n,),
+                       _synthetic_page(n))
+        flat_files, flat_bytes = _disk_usage(flat_root)
+        packed_root = os.path.join(root, "packed")
+        shutil.copytree(flat_root, packed_root)
+        start = time.time()
+        migrate(packed_root, remove=True)
+        migrate_t = time.time() - start
+        packed_files, packed_bytes = _disk_usage(packed_root)
+        print "%s pages, %.1f MB, migrated in %.3fs" % (
+            PAGE_CACHE_PAGES, flat_bytes / 1e6, migrate_t)
+        print "%-8s %6s %10s %10s %12s %8s %6s" % (
+            "", "files", "disk (MB)", "open (s)", "read all (s)", "MB/s",
+            "cold")
+        for label, store_type, store_root, files, disk_bytes in [
+                ("flat", DirectoryPageStore, flat_root, flat_files,
+                 flat_bytes),
+                ("packed", PackedPageStore, packed_root, packed_files,
+                 packed_bytes)]:
+            cold = _drop_os_page_cache()
+            start = time.time()
+            store = store_type(store_root)
+            keys = store.keys()
+            open_t = time.time() - start
+            start = time.time()
+            read_bytes = sum(len(store.read(key)) for key in keys)
+            read_t = time.time() - start
+            print "%-8s %6d %10.1f %10.3f %12.3f %8.1f %6s" % (
+                label, files, disk_bytes / 1e6, open_t, read_t,
+                read_bytes / 1e6 / read_t, cold)
+            if label == "packed":
+                store.close()
+    finally:
+        shutil.rmtree(root)
+
+
+BENCHMARKS = {
+    "batch_writes": benchmark_batch_writes,
+    "fuzzy": benchmark_fuzzy,
+    "html_extraction": benchmark_html_extraction,
+    "page_cache": benchmark_page_cache,
+    "search_map": benchmark_search_and_map,
+    "signatures": benchmark_signatures,
+    "web_modes": benchmark_web_modes,
+}
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    if len(sys.argv) != 2 or sys.argv[1] not in BENCHMARKS:
+        print "Usage: %s <%s>" % (sys.argv[0], "|".join(sorted(BENCHMARKS)))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]]()
@@ -13,6 +13,9 @@ CACHE_ROOT = os.path.join(DATA_BASEDIR, ".cache")
 TEST_CACHE_ROOT = CACHE_ROOT  # For the moment
 
 TOOLBAR = DebugToolbarExtension
+# The toolbar rewrites each page, and should time its rendering
+RESPONSE_CACHE_SIZE = 0
+RESPONSE_CACHE_CHECK_INTERVAL = 0
 # SECRET_KEY is required for toolbar (and only for toolbar)
 SECRET_KEY = "yourmum"
 SERVER_NAME = "localhost:8765"
@@ -0,0 +1,132 @@
+import collections
+from language_explorer.persistence import LanguagePersistence
+
+__author__ = 'esteele'
+
+# Tables written by the loader's sources. The language summary is derived
+#  from these, so differs only if they do
+DIFF_TABLES = [
+    LanguagePersistence.ALIAS_TABLE,
+    LanguagePersistence.LANGUAGE_TABLE,
+    LanguagePersistence.CLASSIFICATION_TABLE,
+    LanguagePersistence.TRANSLATION_TABLE,
+    LanguagePersistence.RELATIONSHIP_TABLE,
+    LanguagePersistence.REFERENCE_TABLE,
+]
+# Where a table's source column is named differently. Rows of tables
+#  without a source column count against NO_SOURCE
+SOURCE_COLUMNS = {
+    LanguagePersistence.REFERENCE_TABLE: "ext_ref_source",
+}
+NO_SOURCE = "-"
+CHANGES = ["inserted", "updated", "deleted", "unchanged"]
+
+
+class LoadDiff(object):
+    """How the rows of a load differ from those already in a db, counted
+    per table and source, and listed per ISO"""
+    def __init__(self):
+        self.tables = collections.OrderedDict()
+        self.sources = collections.defaultdict(collections.Counter)
+        # Changed rows, per ISO
+        self.isos = collections.defaultdict(list)
+
+    def compare(self, table_name, current, loaded):
+        """Compare all of a table's rows at once
+
+        :param current: rows in the db, keyed as by get_rows_by_key
+        :param loaded: rows the load would leave in the db, keyed likewise
+        """
+        keys = LanguagePersistence.UPSERT_KEYS[table_name]
+        iso_column = LanguagePersistence.ISO_COLUMNS.get(table_name, "iso")
+        source_column = SOURCE_COLUMNS.get(table_name, "source")
+        counts = self.tables[table_name] = collections.Counter()
+        for key in sorted(set(current).union(loaded)):
+            old, new = current.get(key), loaded.get(key)
+            row = old if new is None else new
+            if old is None:
+                change, columns = "inserted", None
+            elif new is None:
+                change, columns = "deleted", None
+            else:
+                columns = collections.OrderedDict(
+                    (c, [old.get(c), new.get(c)])
+                    for c in sorted(set(old).union(new))
+                    if c != "id" and old.get(c) != new.get(c))
+                change = "updated" if columns else "unchanged"
+            counts[change] += 1
+            self.sources[row.get(source_column) or NO_SOURCE][change] += 1
+            if change != "unchanged":
+                self.isos[row[iso_column]].append(collections.OrderedDict(
+                    [("table", table_name), ("change", change),
+                     ("key", collections.OrderedDict(zip(keys, key)))] +
+                    ([("columns", columns)] if columns else [])))
+
+    def changed_isos(self):
+        """ISOs with rows that differ, per table and then kind of change,
+        as LanguagePersistence.take_changed_isos gives them"""
+        changed = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+        for iso, changes in self.isos.iteritems():
+            for change in changes:
+                changed[change["table"]][change["change"]].add(iso)
+        return dict(
+            (table_name, dict((change, sorted(isos))
+                              for change, isos in changes.iteritems()))
+            for table_name, changes in changed.iteritems())
+
+    def is_empty(self):
+        """Whether the load would change nothing"""
+        return not self.isos
+
+    def as_dict(self):
+        def ordered(counts):
+            return collections.OrderedDict(
+                (change, counts[change]) for change in CHANGES)
+        return collections.OrderedDict([
+            ("tables", collections.OrderedDict(
+                (name, ordered(c)) for name, c in self.tables.iteritems())),
+            ("sources", collections.OrderedDict(
+                (name, ordered(self.sources[name]))
+                for name in sorted(self.sources))),
+            ("isos", collections.OrderedDict(
+                (iso, self.isos[iso]) for iso in sorted(self.isos))),
+        ])
+
+    def format(self):
+        """The diff as text: counts per table and source, then each
+        changed row per ISO"""
+        report = self.as_dict()
+        rows = [("%s %s" % (kind[:-1], name), counts)
+                for kind in ["tables", "sources"]
+                for name, counts in report[kind].iteritems()]
+        label_width = max(len(label) for label, _ in rows)
+        lines = [" " * label_width +
+                 "".join(" %10s" % (change,) for change in CHANGES)]
+        for label, counts in rows:
+            lines.append(label.ljust(label_width) + "".join(
+                " %10s" % (counts[change],) for change in CHANGES))
+        for iso, changes in report["isos"].iteritems():
+            for change in changes:
+                lines.append("%s %s %s %s%s" % (
+                    iso, change["table"], change["change"],
+                    ", ".join("%s=%s" % item
+                              for item in change["key"].iteritems()),
+                    "".join("; %s: %r -> %r" % (c, old, new)
+                            for c, (old, new) in
+                            change.get("columns", {}).iteritems())))
+        return "\n".join(lines)
+
+
+def diff_load(current, loaded):
+    """Diff the rows of each of DIFF_TABLES, a query per table
+
+    :param current: the LanguagePersistence a load would replace
+    :param loaded: a LanguagePersistence holding the load's rows
+    :rtype: LoadDiff
+    """
+    diff = LoadDiff()
+    for table_name in DIFF_TABLES:
+        diff.compare(table_name, current.get_rows_by_key(table_name),
+                     loaded.get_rows_by_key(table_name))
+    return diff
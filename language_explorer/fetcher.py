@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+import requests
+from requests.adapters import HTTPAdapter
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class FetchError(Exception):
+    """A url that couldn't be fetched, even after retrying"""
+
+
+class PooledFetcher(object):
+    """Fetches urls into files, several at a time, over a shared pool of
+    connections
+
+    Requests to any one host are limited in number and rate, and those
+    that fail with a connection error or a server error are retried with
+    exponential backoff. Safe to use from several threads.
+    """
+    # Responses worth retrying. Anything else is kept, as it always was
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, workers=8, per_host=4, min_interval=0.1, retries=3,
+                 backoff=1.0, timeout=30):
+        """
+        :param workers: most urls fetched at once
+        :param per_host: most urls fetched at once from any one host
+        :param min_interval: least time in seconds between the starts of
+         requests to the same host
+        :param retries: times to retry a url before giving up
+        :param backoff: seconds to wait before the first retry, doubling
+         for each one after
+        :param timeout: seconds to wait for a connection or a response
+        """
+        self.workers = workers
+        self.per_host = per_host
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._hosts_lock = threading.Lock()
+        # (semaphore, time the next request may start) per host
+        self._hosts = {}
+
+    def _host_slot(self, url):
+        """Wait until a request to url's host may start
+
+        :return: the host's semaphore, acquired
+        """
+        host = urlparse.urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = [
+                    threading.BoundedSemaphore(self.per_host), 0]
+            limit = self._hosts[host]
+        limit[0].acquire()
+        with self._hosts_lock:
+            now = time.time()
+            start = max(now, limit[1])
+            limit[1] = start + self.min_interval
+        time.sleep(start - now)
+        return limit[0]
+
+    def fetch(self, url):
+        """The body of the response to a GET of url
+
+        :raises FetchError: if every attempt fails
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                logging.warning("Retrying %s in %.1fs (%s)", url, delay,
+                                problem)
+                time.sleep(delay)
+            semaphore = self._host_slot(url)
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                problem = e
+                continue
+            finally:
+                semaphore.release()
+            if r.status_code in self.RETRY_STATUSES:
+                problem = "HTTP %s" % (r.status_code,)
+                continue
+            return r.content
+        raise FetchError("Unable to fetch %s: %s" % (url, problem))
+
+    def fetch_to(self, url, page_store, key):
+        """Fetch url into a page_cache store, under key"""
+        page_store.write(key, self.fetch(url))
+
+    def fetch_all(self, page_store, url_keys):
+        """Fetch each url into a page_cache store under its key, workers at
+        a time
+
+        :param url_keys: (url, key) pairs
+        :raises FetchError: once the others are done, if any url couldn't
+         be fetched
+        """
+        url_keys = list(url_keys)
+        if not url_keys:
+            return
+        pool = ThreadPool(min(self.workers, len(url_keys)))
+        try:
+            results = [pool.apply_async(self.fetch_to,
+                                        (url, page_store, key))
+                       for url, key in url_keys]
+            errors = []
+            for r in results:
+                try:
+                    r.get()
+                except FetchError as e:
+                    errors.append(e)
+        finally:
+            pool.terminate()
+        if errors:
+            raise FetchError("Unable to fetch %s of %s urls, e.g. %s" %
+                             (len(errors), len(url_keys), errors[0]))
+
+
+# Shared by all sources, so that the limits on each host apply to them all
+default_fetcher = PooledFetcher()
@@ -0,0 +1,218 @@
+import collections
+import contextlib
+import datetime
+import functools
+import resource
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__author__ = 'esteele'
+
+# Counted per stage and per source, in report order. rows_written counts
+#  rows inserted or updated in the language db, persisted counts persist_*
+#  calls on a persister
+COUNTERS = ["wall_time", "cpu_time", "statements", "rows_written",
+            "persisted", "cache_hits", "cache_misses", "max_rss_kb"]
+
+_local = threading.local()
+_lock = threading.Lock()
+# The report being recorded, if any. See recording
+_report = None
+
+
+class RunReport(object):
+    """Counters for each stage and source of a load"""
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.stages = collections.OrderedDict()
+        self.sources = collections.OrderedDict()
+        self.skipped = []
+
+    def counters(self, kind, name):
+        scopes = getattr(self, kind)
+        with _lock:
+            if name not in scopes:
+                scopes[name] = collections.Counter()
+            return scopes[name]
+
+    def as_dict(self):
+        def ordered(counters):
+            return collections.OrderedDict(
+                (name, round(counters[name], 3)) for name in COUNTERS)
+        return collections.OrderedDict([
+            ("started", datetime.datetime.utcfromtimestamp(
+                self.started).isoformat()),
+            ("wall_time", round((self.finished or time.time()) -
+                                self.started, 3)),
+            ("max_rss_kb", peak_rss_kb()),
+            ("stages", collections.OrderedDict(
+                (name, ordered(c)) for name, c in self.stages.iteritems())),
+            ("skipped", list(self.skipped)),
+            ("sources", collections.OrderedDict(
+                (name, ordered(c)) for name, c in self.sources.iteritems())),
+        ])
+
+
+@contextlib.contextmanager
+def recording(report):
+    """Measure the stages and sources run within the block into report"""
+    global _report
+    _report = report
+    try:
+        yield report
+    finally:
+        report.finished = time.time()
+        _report = None
+
+
+def _scopes():
+    if not hasattr(_local, "scopes"):
+        _local.scopes = []
+    return _local.scopes
+
+
+def count(name, n=1, kind=None):
+    """Add n to a counter of each stage and source being measured on this
+    thread
+
+    :param kind: "stages" or "sources" to only count against those
+    """
+    scopes = _scopes()
+    if scopes:
+        with _lock:
+            for scope_kind, counters in scopes:
+                if kind is None or kind == scope_kind:
+                    counters[name] += n
+
+
+def thread_cpu_time():
+    """CPU time used by this thread, or by the process where per-thread
+    usage isn't available"""
+    try:
+        # RUSAGE_THREAD, which the resource module doesn't name
+        usage = resource.getrusage(getattr(resource, "RUSAGE_THREAD", 1))
+    except (ValueError, resource.error):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_kb():
+    """High water mark of the process's resident memory"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextlib.contextmanager
+def _measure(kind, name):
+    report = _report
+    scopes = _scopes()
+    if report is None:
+        yield
+        return
+    counters = report.counters(kind, name)
+    if any(c is counters for _, c in scopes):
+        # e.g. one of a source's persist_* methods calling another
+        yield
+        return
+    scopes.append((kind, counters))
+    start, cpu_start = time.time(), thread_cpu_time()
+    try:
+        yield
+    finally:
+        scopes.pop()
+        with _lock:
+            counters["wall_time"] += time.time() - start
+            counters["cpu_time"] += thread_cpu_time() - cpu_start
+            # Memory is shared with whatever else is running, so this is
+            #  the process's peak as of the end of the work
+            counters["max_rss_kb"] = peak_rss_kb()
+
+
+def measure_stage(name):
+    """Measure the work done on this thread within the block against the
+    named stage"""
+    return _measure("stages", name)
+
+
+def measure_source(name):
+    """Measure the work done on this thread within the block against the
+    named source"""
+    return _measure("sources", name)
+
+
+def stage_skipped(name):
+    if _report is not None:
+        _report.skipped.append(name)
+
+
+def measured_source_method(method):
+    """Measure a source's method against the source's SOURCE_NAME"""
+    @functools.wraps(method)
+    def measured(self, *args, **kwargs):
+        with measure_source(self.SOURCE_NAME or type(self).__name__):
+            return method(self, *args, **kwargs)
+    return measured
+
+
+class MeasuredSourceType(type):
+    """Metaclass measuring each persist_* method of a source class"""
+    def __new__(mcs, name, bases, attrs):
+        for attr, value in attrs.items():
+            if attr.startswith("persist_") and callable(value):
+                attrs[attr] = measured_source_method(value)
+        return super(MeasuredSourceType, mcs).__new__(mcs, name, bases,
+                                                      attrs)
+
+
+def format_history(reports):
+    """Wall times of past loads as text, with a row for each stage and
+    source and a column for each load
+
+    :param reports: as returned by RunReport.as_dict, most recent first
+    """
+    reports = list(reversed(reports))
+    rows = [("total", [r["wall_time"] for r in reports])]
+    for kind in ["stages", "sources"]:
+        names = []
+        for r in reports:
+            names.extend(name for name in r[kind] if name not in names)
+        rows.extend(
+            ("%s %s" % (kind[:-1], name),
+             [r[kind][name]["wall_time"] if name in r[kind] else None
+              for r in reports])
+            for name in names)
+    label_width = max(len(label) for label, _ in rows)
+    lines = [" " * label_width + "".join(
+        " %16s" % (r["started"][:16],) for r in reports)]
+    for label, times in rows:
+        lines.append(label.ljust(label_width) + "".join(
+            " %16s" % ("-" if t is None else "%.1f" % (t,),)
+            for t in times))
+    return "\n".join(lines)
+
+
+def counted_persist_method(method):
+    """Count calls of a persister's method"""
+    @functools.wraps(method)
+    def counted(self, *args, **kwargs):
+        count("persisted")
+        return method(self, *args, **kwargs)
+    return counted
+
+
+class CountedPersisterType(type):
+    """Metaclass counting calls of each persist_* method of a persister"""
+    def __new__(mcs, name, bases, attrs):
+        for attr, value in attrs.items():
+            if attr.startswith("persist_") and callable(value):
+                attrs[attr] = counted_persist_method(value)
+        return super(CountedPersisterType, mcs).__new__(mcs, name, bases,
+                                                        attrs)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    count("statements")
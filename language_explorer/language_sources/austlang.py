@@ -1,9 +1,12 @@
+import collections
+import json
+import os
 import re
 import logging
 
 from bs4 import BeautifulSoup
 from language_explorer import constants
-from language_explorer.utils import memoized
+from language_explorer.utils import memoized, atomic_write
 
 from language_explorer.language_sources.base import CachingWebLanguageSource
 
@@ -12,9 +15,16 @@ __author__ = 'esteele'
 
 logging.basicConfig(level=logging.DEBUG)
 
+# What we use of an Austlang language page. iso_text is as the page gives
+#  it, e.g. "Nji" or "aer, are"
+AustlangRecord = collections.namedtuple(
+    "AustlangRecord", ["iso_text", "abs_name", "aiatsis_code",
+                       "aiatsis_name"])
+
 
 class AustlangAdapter(CachingWebLanguageSource):
     SOURCE_NAME = constants.AUSTLANG_SOURCE_ABBREV
+    CACHE_URL_PREFIX = 'http://austlang.aiatsis.gov.au/php/public/'
     ABS_SOURCE_NAME = constants.AUSTLANG_ABS_SOURCE_ABBREV
     # XXX - These changed during 2019 - will need reworking
     ALL_LANGUAGES_URL = 'http://austlang.aiatsis.gov.au/php/' \
@@ -22,15 +32,59 @@ class AustlangAdapter(CachingWebLanguageSource):
                         'stateFields=^TAS^VIC^NSW^ACT^SA^NT^WA^QLD^TSI'
     ONE_LANGUAGE_URL_TEMPLATE = 'http://austlang.aiatsis.gov.au/php/public/' \
                                 'language_profile_all.php?id=%s'
+    # Extracted records, in cache_root. Bump the version when
+    #  _extract_record changes, so that pages are parsed again
+    RECORD_DIRNAME = "austlang_records"
+    RECORD_VERSION = 1
+
+    @memoized
+    def get_language_record(self, austlang_id):
+        """What we use of an Austlang language's page, as an AustlangRecord
+
+        Records are kept next to the cached pages, keyed on the hash of the
+        page they were extracted from, so a page is parsed only once.
+        """
+        url = self.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)
+        key = self.get_cached_key(url)
+        record_dir = os.path.join(self.cache_root, self.RECORD_DIRNAME)
+        record_path = os.path.join(record_dir, "%s.v%s.json" % (
+            self.page_store.page_fingerprint(key), self.RECORD_VERSION))
+        if os.path.exists(record_path):
+            with open(record_path) as f:
+                return AustlangRecord(**json.load(f))
+        record = self._extract_record(
+            BeautifulSoup(self.decode_page(url, self.page_store.read(key))))
+        if not os.path.isdir(record_dir):
+            try:
+                os.makedirs(record_dir)
+            except OSError:
+                # Made by another thread
+                pass
+        atomic_write(record_path, json.dumps(record._asdict()))
+        return record
+
+    @staticmethod
+    def _extract_record(langsoup):
+        def labelled_text(label_re):
+            return langsoup.find("a", onmouseover=re.compile(label_re)) \
+                .parent.text.rpartition(":")[2].strip()
+
+        def text_after_label(label_re):
+            return langsoup.find("a", onmouseover=re.compile(label_re)) \
+                .next_sibling.strip()
+
+        return AustlangRecord(
+            iso_text=labelled_text(
+                "International Organization for Standardization"),
+            abs_name=labelled_text("Australian Bureau of Statistics"),
+            aiatsis_code=text_after_label(
+                "Language identification code used at AIATSIS"),
+            aiatsis_name=text_after_label("name used in AUSTLANG"))
 
     @memoized
     def get_iso_list_from_austlang_id(self, austlang_id):
         iso_list = []
-        langsoup = BeautifulSoup(self.get_text_from_url(
-            self.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)))
-        iso_text = langsoup.find("a", onmouseover=re.compile(
-            "International Organization for Standardization")).parent \
-            .text.rpartition(":")[2].strip()
+        iso_text = self.get_language_record(austlang_id).iso_text
         if iso_text:
             # Austlang id 977 incorrectly states the iso is xmg when it
             #  should be xmh. Externalise this check, and the Nji one below
@@ -49,28 +103,13 @@ class AustlangAdapter(CachingWebLanguageSource):
         return iso_list
 
     def get_ABS_name_from_austlang_id(self, austlang_id):
-        langsoup = BeautifulSoup(self.get_text_from_url(
-            self.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)))
-        abn_text = langsoup.find("a", onmouseover=re.compile(
-            "Australian Bureau of Statistics")).parent \
-            .text.rpartition(":")[2].strip()
-        return abn_text
+        return self.get_language_record(austlang_id).abs_name
 
     def get_aiatsis_code_from_austlang_id(self, austlang_id):
-        langsoup = BeautifulSoup(self.get_text_from_url(
-            self.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)))
-        aiatsis_name = langsoup.find("a", onmouseover=re.compile(
-            "Language identification code used at AIATSIS")) \
-            .next_sibling.strip()
-        return aiatsis_name
+        return self.get_language_record(austlang_id).aiatsis_code
 
     def get_aiatsis_name_from_austlang_id(self, austlang_id):
-        langsoup = BeautifulSoup(self.get_text_from_url(
-            self.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)))
-        aiatsis_name = langsoup.find("a", onmouseover=re.compile(
-            "name used in AUSTLANG")) \
-            .next_sibling.strip()
-        return aiatsis_name
+        return self.get_language_record(austlang_id).aiatsis_name
 
     @memoized
     def get_all_austlang_keys(self):
@@ -86,6 +125,9 @@ class AustlangAdapter(CachingWebLanguageSource):
                 logging.error("Unable to find austlang id in link: %s",
                               language_link)
 
+        # Every language's page is read, one after another
+        self.prefetch([self.ONE_LANGUAGE_URL_TEMPLATE % (key,)
+                       for key in keys])
         return keys
 
     @memoized
@@ -1,12 +1,14 @@
-import codecs
 import logging
-import os
-import requests
+from language_explorer import instrumentation
+from language_explorer.fetcher import default_fetcher
+from language_explorer.page_cache import open_page_store
 
 __author__ = 'esteele'
 
 
 class AbstractLanguageSource(object):
+    # Loads are reported per source. See instrumentation
+    __metaclass__ = instrumentation.MeasuredSourceType
     SOURCE_NAME = None
     # Non indigenous - out of scope
     EXCLUDED_AU_LANGUAGES = set([
@@ -94,9 +96,19 @@ class AbstractLanguageSource(object):
 
 
 class CachingWebLanguageSource(AbstractLanguageSource):
-    def __init__(self, cache_root):
+    # Start of every url this source fetches, so that its pages can be told
+    #  apart in a shared cache
+    CACHE_URL_PREFIX = ""
+
+    def __init__(self, cache_root, fetcher=None):
+        """
+        :param fetcher: a fetcher.PooledFetcher for pages that aren't
+         cached. Defaults to one shared by all sources
+        """
         self.cache_root = cache_root
+        self.fetcher = fetcher or default_fetcher
         # TODO: make sure it exists
+        self.page_store = open_page_store(cache_root)
 
     def generate_filename_from_url(self, url):
         # Convert slashes to hashes
@@ -106,14 +118,43 @@ class CachingWebLanguageSource(AbstractLanguageSource):
                   .replace(".", "_") \
                   .replace(":", "~")
 
-    def get_text_from_url(self, url):
-        cached_location = os.path.join(self.cache_root,
-                                       self.generate_filename_from_url(url))
-        if not os.path.exists(cached_location):
+    def get_fingerprint(self):
+        """Changes whenever one of this source's cached pages is added or
+        replaced"""
+        return self.page_store.fingerprint(
+            self.generate_filename_from_url(self.CACHE_URL_PREFIX))
+
+    def prefetch(self, urls):
+        """Fetch those of urls that aren't cached into the cache, several at
+        a time, so that reading them doesn't wait on the web one by one"""
+        missing = []
+        for url in urls:
+            key = self.generate_filename_from_url(url)
+            if key not in self.page_store and (url, key) not in missing:
+                missing.append((url, key))
+        if missing:
+            instrumentation.count("cache_misses", len(missing))
+            logging.info("Prefetching %s uncached urls for %s",
+                         len(missing), self.SOURCE_NAME)
+            self.fetcher.fetch_all(self.page_store, missing)
+
+    def get_cached_key(self, url):
+        """The page store key of url's cached copy, fetching it if there
+        isn't one"""
+        key = self.generate_filename_from_url(url)
+        if key in self.page_store:
+            instrumentation.count("cache_hits")
+        else:
+            instrumentation.count("cache_misses")
             print "retrieving url from the web: %s" % (url,)
-            r = requests.get(url)
-            with open(cached_location, "wb") as f:
-                f.write(r.content)
+            self.fetcher.fetch_to(url, self.page_store, key)
+        return key
+
+    def get_text_from_url(self, url):
+        return self.decode_page(url,
+                                self.page_store.read(self.get_cached_key(url)))
+
+    def decode_page(self, url, data):
         # Yeah, we're writing then reading if we don't have a cached copy
         #  but it simplifies the unicode handling
         # I'm not sure what's changed with some sources, so we can't download
@@ -122,9 +163,5 @@ class CachingWebLanguageSource(AbstractLanguageSource):
         #  saved files. I'm probably doing something wrong here, but this
         #  gets me moving forward.
         if "tindaletribes" in url:
-            with open(cached_location, "r") as f:
-                text = f.read()
-        else:
-            with codecs.open(cached_location, "r", encoding="utf-8") as f:
-                text = f.read()
-        return text
+            return data
+        return data.decode("utf-8")
@@ -3,6 +3,7 @@ import csv
 import logging
 from language_explorer import constants
 from language_explorer.language_sources.base import AbstractLanguageSource
+from language_explorer.utils import file_fingerprint
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -58,6 +59,9 @@ class Census2011Adapter(AbstractLanguageSource):
         self._lang_to_count_cache = {}
         self._lang_to_pse_cache = {}
 
+    def get_fingerprint(self):
+        return file_fingerprint(self.csv_source)
+
     def get_lang_to_iso_dict(self):
         """Returns a dictionary keyed on ABS Language name, with the value as
         a list of ISOs that correspond to the ABS language.
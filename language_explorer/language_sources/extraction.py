@@ -0,0 +1,85 @@
+"""Pulls the few elements we use out of cached pages, parsing only those
+elements rather than building a tree of the whole page.
+
+Each extract_* function has a reference_* counterpart that parses the
+whole page as the sources used to. The two must agree on every cached
+page; benchmark html_extraction checks that they do.
+"""
+import multiprocessing
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+
+__author__ = 'esteele'
+
+# html5lib, BeautifulSoup's default when lxml is missing, builds the whole
+#  tree whatever it's asked to keep
+PARSER = "lxml" if builder_registry.lookup("lxml") else "html.parser"
+# Fewer pages than this aren't worth starting processes for
+MIN_POOLED_PAGES = 50
+
+TINDALE_COORDINATES_LABEL = "Co-ordinates"
+TINDALE_INDEX_ID = "TribeIndex"
+FIND_A_BIBLE_TRANSLATION_ID_RE = re.compile("TranslationDescription")
+
+
+def _parse_only(text, *args, **kwargs):
+    return BeautifulSoup(text, PARSER,
+                         parse_only=SoupStrainer(*args, **kwargs))
+
+
+def extract_tindale_coordinates(text):
+    """The text of a Tindale tribe page's co-ordinates cell"""
+    return _parse_only(text, "td").find(
+        "td", text=TINDALE_COORDINATES_LABEL).next_sibling.text
+
+
+def reference_tindale_coordinates(text):
+    return BeautifulSoup(text).find(
+        "td", text=TINDALE_COORDINATES_LABEL).next_sibling.text
+
+
+def extract_tindale_index_hrefs(text):
+    """The hrefs of the links in a Tindale index page's tribe index"""
+    return [a["href"] for a in _parse_only(text, id=TINDALE_INDEX_ID)
+            .find(id=TINDALE_INDEX_ID).find_all("a")]
+
+
+def reference_tindale_index_hrefs(text):
+    return [a["href"] for a in BeautifulSoup(text)
+            .find(id=TINDALE_INDEX_ID).find_all("a")]
+
+
+def extract_find_a_bible_translation(text):
+    """The text of a Find a Bible page's translation description, or None
+    if it has none"""
+    span = _parse_only(text, id=FIND_A_BIBLE_TRANSLATION_ID_RE) \
+        .find(id=FIND_A_BIBLE_TRANSLATION_ID_RE)
+    return span.text if span else None
+
+
+def reference_find_a_bible_translation(text):
+    span = BeautifulSoup(text).find(id=FIND_A_BIBLE_TRANSLATION_ID_RE)
+    return span.text if span else None
+
+
+def extract_all(extract, texts, processes=None):
+    """extract applied to each of texts, spread over a pool of processes
+
+    :param extract: one of the extract_* functions, or any other
+     module level function, so that it can be sent to the pool
+    :param processes: pool size, defaulting to the number of cpus. 1
+     extracts in this process
+    :rtype: list
+    """
+    texts = list(texts)
+    if processes == 1 or len(texts) < MIN_POOLED_PAGES:
+        return [extract(text) for text in texts]
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(extract, texts,
+                        chunksize=max(1, len(texts) // (4 * processes)))
+    finally:
+        pool.terminate()
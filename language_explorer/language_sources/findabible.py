@@ -1,10 +1,10 @@
 import logging
 import re
 
-from bs4 import BeautifulSoup
-
 from language_explorer import constants
 from language_explorer.language_sources.base import CachingWebLanguageSource
+from language_explorer.language_sources.extraction import \
+    extract_find_a_bible_translation
 
 
 __author__ = 'esteele'
@@ -14,6 +14,7 @@ logging.basicConfig(level=logging.DEBUG)
 
 class FindABibleAdapter(CachingWebLanguageSource):
     SOURCE_NAME = constants.FIND_A_BIBLE_SOURCE_ABBREV
+    CACHE_URL_PREFIX = "http://208.72.3.146/find_a_bible/"
     # XXX Findabible redid their site post-2014, so this needs reworking
     ONE_LANGUAGE_URL_TEMPLATE = "http://208.72.3.146/find_a_bible/" \
                                 "default.aspx?Language=%s"
@@ -22,6 +23,11 @@ class FindABibleAdapter(CachingWebLanguageSource):
     NT_TEXT = "The New Testament"
     WB_TEXT = "The Bible"
 
+    def prefetch_isos(self, isos):
+        """Fetch the pages of isos that aren't cached"""
+        self.prefetch([self.ONE_LANGUAGE_URL_TEMPLATE % (iso,)
+                       for iso in isos])
+
     def _extract_translation_state(self, translation_str):
         """Return translation state & date"""
         d = {}
@@ -51,11 +57,10 @@ class FindABibleAdapter(CachingWebLanguageSource):
         return d
 
     def get_translation_info_for_iso(self, iso):
-        soup = BeautifulSoup(
+        translation_str = extract_find_a_bible_translation(
             self.get_text_from_url(self.ONE_LANGUAGE_URL_TEMPLATE % (iso,)))
-        translation_span = soup.find(id=re.compile("TranslationDescription"))
-        if translation_span:
-            return self._extract_translation_state(translation_span.text)
+        if translation_str is not None:
+            return self._extract_translation_state(translation_str)
         else:
             return {constants.TRANSLATION_STATE_STATE_KEY:
                     constants.TRANSLATION_STATE_NO_RECORD,
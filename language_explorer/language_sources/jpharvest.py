@@ -1,17 +1,43 @@
+import collections
 import logging
 import sqlsoup
+import threading
 
 from language_explorer import constants
 from language_explorer.language_sources.base import AbstractLanguageSource
 
 logging.basicConfig(level=logging.DEBUG)
 
+# The columns of a tblLNG3Languages row that we use, and the names from
+#  its tblLNG6LanguageAlternateNames rows
+JPLanguage = collections.namedtuple(
+    "JPLanguage", ["iso", "name", "world_speakers", "bible_year", "nt_year",
+                   "portions_year", "alternate_names"])
+
 
 class JPHarvestAdapter(AbstractLanguageSource):
     SOURCE_NAME = constants.JOSHUA_PROJECT_SOURCE_ABBREV
+    # Tables that the adapter reads
+    TABLES = ["tblLNG3Languages", "tblLNG6LanguageAlternateNames",
+              "tblPEO3PeopleGroups", "tbllnkLNGtoPEOGEO"]
 
-    def __init__(self, db_url):
+    def __init__(self, db_url, prefetch=False):
+        """
+        :param prefetch: read the records of all Australian languages in
+         bulk on first use, rather than a language at a time
+        """
         self.db = sqlsoup.SQLSoup(db_url)
+        self.prefetch = prefetch
+        # JPLanguage per ISO read so far, or None where JP has no language
+        self._records = {}
+        self._prefetch_lock = threading.Lock()
+        self._prefetched = False
+
+    def get_fingerprint(self):
+        """Row counts of the tables we read. Cheap, but doesn't notice a
+        row being changed in place"""
+        return ",".join("%s=%s" % (table, self.db.entity(table).count())
+                        for table in self.TABLES)
 
     def get_language_iso_keys(self):
         """get a list of languages, with the most common key available in the db
@@ -41,17 +67,60 @@ class JPHarvestAdapter(AbstractLanguageSource):
             .difference(self.EXCLUDED_AU_LANGUAGES)
         return sorted(list(all_iso))
 
+    @staticmethod
+    def _make_record(language, alternate_names):
+        return JPLanguage(language.ROL3, language.Language,
+                          language.WorldSpeakers, language.BibleYear,
+                          language.NTYear, language.PortionsYear,
+                          alternate_names)
+
+    def _prefetch_records(self):
+        """Read the languages of get_language_iso_keys and their alternate
+        names, a query for each"""
+        isos = self.get_language_iso_keys()
+        alternates = self.db.tblLNG6LanguageAlternateNames
+        alternate_names = collections.defaultdict(list)
+        for alternate in alternates.filter(alternates.ROL3.in_(isos)).all():
+            alternate_names[alternate.ROL3].append(alternate.LangAltName)
+        languages = self.db.tblLNG3Languages
+        for language in languages.filter(languages.ROL3.in_(isos)).all():
+            self._records[language.ROL3] = self._make_record(
+                language, alternate_names[language.ROL3])
+        logging.info("Prefetched %s JP languages", len(self._records))
+
+    def _get_record(self, iso):
+        """The JPLanguage for an ISO, or None if JP doesn't have it"""
+        if self.prefetch and not self._prefetched:
+            # Loader stages ask from several threads at once
+            with self._prefetch_lock:
+                if not self._prefetched:
+                    self._prefetch_records()
+                    self._prefetched = True
+        if iso not in self._records:
+            # Not prefetching, or not one of the Australian languages
+            language = self.db.tblLNG3Languages.get(iso)
+            self._records[iso] = language and self._make_record(
+                language, self._query_alternate_names(iso))
+        return self._records[iso]
+
+    def _query_alternate_names(self, iso):
+        return [l.LangAltName for l in
+                self.db.tblLNG6LanguageAlternateNames.filter(
+                    self.db.tblLNG6LanguageAlternateNames.ROL3 == iso).all()]
+
     def get_primary_name_for_iso(self, iso):
-        language = self.db.tblLNG3Languages.get(iso)
+        language = self._get_record(iso)
         if language:
-            return language.Language
+            return language.name
         else:
             return None
 
     def get_alternate_names_for_iso(self, iso):
-        return [l.LangAltName for l in
-                self.db.tblLNG6LanguageAlternateNames.filter(
-                    self.db.tblLNG6LanguageAlternateNames.ROL3 == iso).all()]
+        language = self._get_record(iso)
+        if language:
+            return list(language.alternate_names)
+        else:
+            return []
 
     def get_dialects_for_iso(self, iso):
         """Language ISO also appears in tblLNG4Dialects. Not sure whether we
@@ -73,10 +142,10 @@ class JPHarvestAdapter(AbstractLanguageSource):
         # i.e. extinct, dormant or nearly extinct
         # So will infer that there aren't any remaining L1 speakers and
         #  record that they have SPEAKER_COUNT_NONE_EXPECTED speakers
-        language = self.db.tblLNG3Languages.get(iso)
+        language = self._get_record(iso)
         if language:
-            if language.WorldSpeakers:
-                return language.WorldSpeakers
+            if language.world_speakers:
+                return language.world_speakers
             else:
                 return constants.SPEAKER_COUNT_NONE_EXPECTED
         else:
@@ -96,25 +165,22 @@ class JPHarvestAdapter(AbstractLanguageSource):
         d = {}
         STATE = constants.TRANSLATION_STATE_STATE_KEY
         YEAR = constants.TRANSLATION_STATE_YEAR_KEY
-        language = self.db.tblLNG3Languages.filter(
-            self.db.tblLNG3Languages.ROL3 == iso).first()
+        language = self._get_record(iso)
         # If we don't know about this iso
         if not language:
             return {}
 
-        bible_year = language.BibleYear
+        bible_year = language.bible_year
         if bible_year:
             d[STATE] = constants.TRANSLATION_STATE_WHOLE_BIBLE
             d[YEAR] = int(bible_year.rpartition("-")[2])
             return d
-        nt_year = self.db.tblLNG3Languages.filter(
-            self.db.tblLNG3Languages.ROL3 == iso).first().NTYear
+        nt_year = language.nt_year
         if nt_year:
             d[STATE] = constants.TRANSLATION_STATE_NEW_TESTAMENT
             d[YEAR] = int(nt_year.rpartition("-")[2])
             return d
-        portions_year = self.db.tblLNG3Languages.filter(
-            self.db.tblLNG3Languages.ROL3 == iso).first().PortionsYear
+        portions_year = language.portions_year
         if portions_year:
             d[STATE] = constants.TRANSLATION_STATE_PORTIONS
             if portions_year == "Yes":  # bdy
@@ -1,12 +1,15 @@
 import logging
 import re
 from austlang import constants
+from language_explorer import instrumentation
+from language_explorer.utils import file_fingerprint
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 class SilRcemAdapter(object):
     """SIL Retired Core Element Mappings"""
+    __metaclass__ = instrumentation.MeasuredSourceType
     SOURCE_NAME = constants.SIL_RCEM_SOURCE_ABBREV
     # Mappings defined the in schema
     RETIREMENT_TYPE_CHANGE = "C"
@@ -19,6 +22,9 @@ class SilRcemAdapter(object):
         self.source = tsv_file_location
         self.tsv_cache = []
 
+    def get_fingerprint(self):
+        return file_fingerprint(self.source)
+
     def _read_tsv(self):
         with open(self.source, 'r') as f:
             # Ignore Header row
@@ -3,9 +3,10 @@ import logging
 import math
 import string
 
-from bs4 import BeautifulSoup
 from language_explorer import constants
 from language_explorer.language_sources.base import CachingWebLanguageSource
+from language_explorer.language_sources.extraction import extract_all, \
+    extract_tindale_coordinates, extract_tindale_index_hrefs
 from language_explorer.utils import memoized
 
 logging.basicConfig(level=logging.DEBUG)
@@ -13,6 +14,7 @@ logging.basicConfig(level=logging.DEBUG)
 
 class TindaleAdapter(CachingWebLanguageSource):
     SOURCE_NAME = constants.TINDALE_SOURCE_ABBREV
+    CACHE_URL_PREFIX = "http://archives.samuseum.sa.gov.au/tindaletribes/"
     ONE_LANGUAGE_URL_TEMPLATE = "http://archives.samuseum.sa.gov.au/" \
                                 "tindaletribes/%s.htm"
     INDEX_URL_TEMPLATE = "http://archives.samuseum.sa.gov.au/" \
@@ -88,9 +90,9 @@ class TindaleAdapter(CachingWebLanguageSource):
         "zmc",  # Pref Tindale: Agree with AIATSIS.
     ]
 
-    def __init__(self, cache_root, persister):
+    def __init__(self, cache_root, persister, fetcher=None):
         self.persister = persister
-        super(TindaleAdapter, self).__init__(cache_root)
+        super(TindaleAdapter, self).__init__(cache_root, fetcher)
 
     @staticmethod
     def extract_lat_lon_from_coordinate_str(utf8_coord_str):
@@ -149,16 +151,33 @@ class TindaleAdapter(CachingWebLanguageSource):
         return -lat_as_decimal, lon_as_decimal
 
     def get_lat_lon_from_tindale_id(self, tindale_id):
+        return self.get_lat_lons_from_tindale_ids([tindale_id], 1)[0]
+
+    def get_lat_lons_from_tindale_ids(self, tindale_ids, processes=None):
+        """get_lat_lon_from_tindale_id for each of tindale_ids, with the
+        pages parsed in a pool of processes. See extraction.extract_all"""
         # Some lat lon are hard-coded
-        if tindale_id in self.MANUALLY_ADJUSTED_LAT_LON_DICT:
-            return self.MANUALLY_ADJUSTED_LAT_LON_DICT[tindale_id]
-        langsoup = BeautifulSoup(self.get_text_from_url(
-            self.ONE_LANGUAGE_URL_TEMPLATE % (tindale_id,)))
-        coord_str = langsoup.find("td", text="Co-ordinates")\
-            .next_sibling.text
-        utf8_coord_str = coord_str.encode('utf8', 'replace')
-        return TindaleAdapter.extract_lat_lon_from_coordinate_str(
-            utf8_coord_str)
+        parsed_ids = [tindale_id for tindale_id in tindale_ids
+                      if tindale_id not in
+                      self.MANUALLY_ADJUSTED_LAT_LON_DICT]
+        coord_strs = dict(zip(parsed_ids, extract_all(
+            extract_tindale_coordinates,
+            [self.get_text_from_url(
+                self.ONE_LANGUAGE_URL_TEMPLATE % (tindale_id,))
+             for tindale_id in parsed_ids],
+            processes)))
+        lat_lons = []
+        for tindale_id in tindale_ids:
+            if tindale_id in self.MANUALLY_ADJUSTED_LAT_LON_DICT:
+                lat_lons.append(
+                    self.MANUALLY_ADJUSTED_LAT_LON_DICT[tindale_id])
+            else:
+                utf8_coord_str = coord_strs[tindale_id].encode('utf8',
+                                                               'replace')
+                lat_lons.append(
+                    TindaleAdapter.extract_lat_lon_from_coordinate_str(
+                        utf8_coord_str))
+        return lat_lons
 
     def get_iso_from_tindale_id(self, tindale_id):
         # tindale_ids are all lower case, but matching routines are
@@ -192,14 +211,14 @@ class TindaleAdapter(CachingWebLanguageSource):
     @memoized
     def get_all_tindale_ids(self):
         tindale_ids = set()
+        self.prefetch([self.INDEX_URL_TEMPLATE % (index_page,)
+                       for index_page in self.INDEX_PAGES])
         for index_page in self.INDEX_PAGES:
-            soup = BeautifulSoup(self.get_text_from_url(
+            hrefs = extract_tindale_index_hrefs(self.get_text_from_url(
                 self.INDEX_URL_TEMPLATE % (index_page,)))
-            tribeIndexTable = soup.find(id="TribeIndex")
             tindale_ids.update(
-                [id_anchor["href"].split(".")[0]
-                 for id_anchor in tribeIndexTable.find_all("a")
-                 if id_anchor["href"].split(".")[0] not in self.FALSE_IDS])
+                [href.split(".")[0] for href in hrefs
+                 if href.split(".")[0] not in self.FALSE_IDS])
 
         return sorted(list(tindale_ids))
 
@@ -210,8 +229,18 @@ class TindaleAdapter(CachingWebLanguageSource):
         multi_match_count = 0
         no_match_count = 0
         attempted_overwrite_count = 0
-        for tindale_id in self.get_all_tindale_ids():
-            iso = self.get_iso_from_tindale_id(tindale_id)
+        tindale_id_isos = [
+            (tindale_id, self.get_iso_from_tindale_id(tindale_id))
+            for tindale_id in self.get_all_tindale_ids()]
+        # Only the pages of matched ids are read
+        matched_ids = [tindale_id for tindale_id, iso in tindale_id_isos
+                       if iso not in (constants.ISO_NO_MATCH,
+                                      constants.ISO_MULTI_MATCH)]
+        self.prefetch([self.ONE_LANGUAGE_URL_TEMPLATE % (tindale_id,)
+                       for tindale_id in matched_ids])
+        lat_lons = dict(zip(matched_ids,
+                            self.get_lat_lons_from_tindale_ids(matched_ids)))
+        for tindale_id, iso in tindale_id_isos:
             if iso == constants.ISO_NO_MATCH:
                 no_match_count += 1
             elif iso == constants.ISO_MULTI_MATCH:
@@ -219,8 +248,7 @@ class TindaleAdapter(CachingWebLanguageSource):
             else:
                 existing_tindale_lat, existing_tindale_lon = \
                     self.persister.get_tindale_lat_lon_from_iso(iso)
-                tindale_lat, tindale_lon = \
-                    self.get_lat_lon_from_tindale_id(tindale_id)
+                tindale_lat, tindale_lon = lat_lons[tindale_id]
                 if not approx_equal(tindale_lat, existing_tindale_lat) and \
                         not approx_equal(tindale_lon, existing_tindale_lon) and \
                         existing_tindale_lat != constants.LATITUDE_UNKNOWN and \
@@ -1,10 +1,12 @@
+import collections
 import logging
 import re
 import itertools
+import threading
 
 import wals3.models
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import scoped_session, sessionmaker, subqueryload_all
 
 from language_explorer import constants
 from language_explorer.language_sources.base import AbstractLanguageSource
@@ -13,14 +15,37 @@ logging.basicConfig(level=logging.DEBUG)
 
 __author__ = 'esteele'
 
+# What we use of a WALS language, read once for all lookups by ISO
+WalsRecord = collections.namedtuple(
+    "WalsRecord", ["pk", "id", "name", "iso_codes", "latitude", "longitude",
+                   "alternate_names"])
+
+
+def split_iso_codes(iso_codes):
+    """The ISOs of a WALS language's iso_codes field, e.g. 'aer, are'"""
+    return filter(None, re.split(",\s", iso_codes or ""))
+
 
 class WalsAdapter(AbstractLanguageSource):
     SOURCE_NAME = constants.WALS_SOURCE_ABBREV
 
     def __init__(self, db_url):
         engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+        # A session per thread, as the loader queries from several
+        self.session = scoped_session(sessionmaker(bind=engine))
+        # WalsRecords per ISO, most specific first. See _get_records
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def get_fingerprint(self):
+        """Row count and latest update time of each model we read"""
+        return ",".join(
+            "%s=%s/%s" % ((model.__name__,) + tuple(
+                self.session.query(func.count(), func.max(model.updated))
+                .one()))
+            for model in (wals3.models.Language,
+                          wals3.models.CountryLanguage,
+                          wals3.models.WalsLanguage))
 
     def get_language_iso_keys(self):
         """WALS3 can make a single WALS language to more than iso code and
@@ -40,7 +65,7 @@ class WalsAdapter(AbstractLanguageSource):
             .filter(wals3.models.CountryLanguage.country_pk == 8)
             .all()]
         # we still have entries like 'aer, are' that we need to split and strip
-        all_iso_codes_with_nested_lists = [re.split(",\s", x)
+        all_iso_codes_with_nested_lists = [split_iso_codes(x)
                                            for x in all_iso_code_fields]
         # flatten and remove empty codes, and remove duplicates, and remove
         #  those that we want to explicitly exclude
@@ -48,58 +73,68 @@ class WalsAdapter(AbstractLanguageSource):
             None, itertools.chain(*all_iso_codes_with_nested_lists)))
             .difference(self.EXCLUDED_AU_LANGUAGES)))
 
+    def _build_index(self):
+        """WalsRecords per ISO, from a query for the languages and one for
+        their identifiers"""
+        index = collections.defaultdict(list)
+        languages = self.session.query(wals3.models.WalsLanguage) \
+            .options(subqueryload_all("languageidentifier.identifier")) \
+            .all()
+        for lang in languages:
+            # WALS includes alternative names from other sources. We will
+            #  treat them as WALS alternatives, even though they're
+            #  aggregating
+            record = WalsRecord(
+                lang.pk, lang.id, lang.name, lang.iso_codes, lang.latitude,
+                lang.longitude,
+                [i.name for i in lang.identifiers if i.type == 'name'])
+            for iso in set(split_iso_codes(lang.iso_codes)):
+                index[iso].append(record)
+        for records in index.itervalues():
+            # The best match for an ISO is the WALS language with the
+            #  shortest iso_codes field i.e. the most specific one
+            records.sort(key=lambda r: (len(r.iso_codes), r.pk))
+        logging.info("Indexed %s WALS languages by %s ISOs",
+                     len(languages), len(index))
+        return dict(index)
+
+    def _get_records(self, iso):
+        """WalsRecords of the WALS languages with the ISO among their
+        iso_codes, most specific first"""
+        if self._index is None:
+            # The loader asks from several threads at once
+            with self._index_lock:
+                if self._index is None:
+                    self._index = self._build_index()
+        return self._index.get(iso, [])
+
     def get_primary_name_for_iso(self, iso):
-        # We use like %iso% because we want to include those that have several
-        #  iso_codes, but we make sure we get the best match by returning the
-        #  one with the shortest iso_codes field i.e. the most specific one.
-        lang = self.session.query(wals3.models.WalsLanguage) \
-            .filter(wals3.models.WalsLanguage.pk ==
-                    wals3.models.Language.pk) \
-            .filter(wals3.models.WalsLanguage.iso_codes.
-                    like('%%%s%%' % (iso,))).order_by("length(iso_codes)")\
-            .first()
-        if lang:
-            return lang.name
+        records = self._get_records(iso)
+        if records:
+            return records[0].name
         else:
             return None
 
     def get_alternate_names_for_iso(self, iso):
-        # WALS includes alternative names from other sources. We will treat
-        #  them as WALS alternatives, even though they're aggregating
-        lang = self.session.query(wals3.models.WalsLanguage) \
-            .filter(wals3.models.WalsLanguage.pk ==
-                    wals3.models.Language.pk) \
-            .filter(wals3.models.WalsLanguage.iso_codes.
-                    like('%%%s%%' % (iso,))).order_by("length(iso_codes)") \
-            .first()
-        if lang:
-            alt_name_strings = [i.name for i in lang.identifiers
-                                if i.type == 'name']
+        records = self._get_records(iso)
+        if records:
             # Previously though alternate name strings might be a
             #  comma separated list of names, but this is actually untrue
             #  so there's no need to split and strip. Given we have several
             #  alternate sources with duplicate names, we remove dupes
-            return list(set([s.strip() for s in alt_name_strings]))
+            return list(set([s.strip()
+                             for s in records[0].alternate_names]))
         else:
             return []
 
     def get_wals_keys_for_iso(self, iso):
-        return [l.id for l in
-                self.session.query(wals3.models.WalsLanguage)
-                .filter(wals3.models.WalsLanguage.pk ==
-                        wals3.models.Language.pk)
-                .filter(wals3.models.WalsLanguage.iso_codes
-                .like('%%%s%%' % (iso,))).all()]
+        return [r.id for r in
+                sorted(self._get_records(iso), key=lambda r: r.pk)]
 
     def get_lat_lon_for_iso(self, iso):
-        lang = self.session.query(wals3.models.WalsLanguage) \
-            .filter(wals3.models.WalsLanguage.pk ==
-                    wals3.models.Language.pk) \
-            .filter(wals3.models.WalsLanguage.iso_codes.
-                    like('%%%s%%' % (iso,))).order_by("length(iso_codes)") \
-            .first()
-        if lang:
-            return lang.latitude, lang.longitude
+        records = self._get_records(iso)
+        if records:
+            return records[0].latitude, records[0].longitude
         else:
             return constants.LATITUDE_UNKNOWN, constants.LONGITUDE_UNKNOWN
 
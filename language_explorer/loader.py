@@ -1,6 +1,14 @@
+import argparse
+import collections
+import json
 import logging
+import os
+import shutil
 import sys
+import tempfile
 from language_explorer import settings
+from language_explorer.instrumentation import RunReport, recording, \
+    format_history
 from language_explorer.language_sources.jpharvest import JPHarvestAdapter
 from language_explorer.language_sources.wals import WalsAdapter
 from language_explorer.language_sources.findabible import FindABibleAdapter
@@ -8,14 +16,18 @@ from language_explorer.language_sources.sil_rcem import SilRcemAdapter
 from language_explorer.language_sources.austlang import AustlangAdapter
 from language_explorer.language_sources.census_2011 import Census2011Adapter
 from language_explorer.language_sources.tindale import TindaleAdapter
+from diff import diff_load
 from persistence import LanguagePersistence
+from pipeline import Stage, run_stages, chunked
+from snapshot import write_snapshot_file
+from staging import StagingLanguagePersistence, ScratchLanguagePersistence
 
 
 logging.basicConfig(level=logging.DEBUG)
 
 # Put these at module level so that we can more easily test by importing
 p = LanguagePersistence(settings.LANGUAGE_EXPLORER_DB_URL)
-joshuaproject = JPHarvestAdapter(settings.JPHARVEST_DB_URL)
+joshuaproject = JPHarvestAdapter(settings.JPHARVEST_DB_URL, prefetch=True)
 fab = FindABibleAdapter(settings.CACHE_ROOT)
 austlang = AustlangAdapter(settings.CACHE_ROOT)
 wals = WalsAdapter(settings.WALS_DB_URL)
@@ -24,80 +36,345 @@ census = Census2011Adapter(settings.CENSUS_CSV_SOURCE, p)
 tindale = TindaleAdapter(settings.CACHE_ROOT, p)
 
 
-def load_data_from_db_driven_sources(iso_list):
-    """To be run whenever new isos are added to our db"""
+ISO_CHUNK_SIZE = 25
+# Loads shown by --history
+HISTORY_RUNS = 10
+
+
+def persist_jp_speaker_counts(persister, iso_list):
     for lang in iso_list:
         if lang in joshuaproject.EXCLUDED_AU_LANGUAGES:
             logging.info("Skipping ISO %s while persisting L1 speaker count"
                          "as it is in the EXCLUDED_AU_LANGUAGES list", lang)
         else:
-            joshuaproject.persist_L1_speaker_count(p, lang)
-            # joshuaproject.persist_dialects(p, lang)
+            joshuaproject.persist_L1_speaker_count(persister, lang)
+            # joshuaproject.persist_dialects(persister, lang)
+
+
+def persist_source_languages(persister, source, iso_list):
+    for lang in iso_list:
+        if lang in source.EXCLUDED_AU_LANGUAGES:
+            logging.info("Skipping ISO %s while processing %s data"
+                         "as it is in the EXCLUDED_AU_LANGUAGES list",
+                         lang, source)
+        else:
+            source.persist_language(persister, lang)
+            source.persist_alternate_names(persister, lang)
+            source.persist_classification(persister, lang)
+            source.persist_translation(persister, lang)
+
 
+def load_data_from_db_driven_sources(persister, iso_list):
+    """To be run whenever new isos are added to our db"""
+    persist_jp_speaker_counts(persister, iso_list)
     for source in (joshuaproject, wals):
-        for lang in iso_list:
-            if lang in source.EXCLUDED_AU_LANGUAGES:
-                logging.info("Skipping ISO %s while processing %s data"
-                             "as it is in the EXCLUDED_AU_LANGUAGES list",
-                             lang, source)
-            else:
-                source.persist_language(p, lang)
-                source.persist_alternate_names(p, lang)
-                source.persist_classification(p, lang)
-                source.persist_translation(p, lang)
-
-    wals.persist_latitude_longitudes(p)
-
-
-def load_data_for_new_isos(last_complete_iso_list):
-    current_complete_iso_list = p.get_all_iso_codes()
+        persist_source_languages(persister, source, iso_list)
+    wals.persist_latitude_longitudes(persister)
+
+
+def load_data_for_new_isos(persister, last_complete_iso_list):
+    current_complete_iso_list = persister.get_all_iso_codes()
     newly_added_isos = set(current_complete_iso_list) \
         .difference(set(last_complete_iso_list))
     logging.info("Processing newly added ISOs: %s", newly_added_isos)
-    load_data_from_db_driven_sources(newly_added_isos)
+    load_data_from_db_driven_sources(persister, newly_added_isos)
     # And return what we know as the complete list
     return current_complete_iso_list
 
 
-def main():
+def split_isos(stage_name):
+    """Chunks of the iso list returned by the named stage"""
+    return lambda results: chunked(results[stage_name], ISO_CHUNK_SIZE)
+
+
+def get_db_driven_isos(persister, results):
     # jpharvest and wals have their own databases with iso keys
     #  and do not need to attempt matching on names, so together
     #  they form our definitive list, and we can load them ignoring
     #  the state of the database (which is not true for subsequent
     #  sources
-    all_known_isos = sorted(
+    return sorted(
         set(wals.get_language_iso_keys()).union(
             set(joshuaproject.get_language_iso_keys()))
         )
 
-    load_data_from_db_driven_sources(all_known_isos)
 
-    sil_rcem.persist_retirement_relationships(p)
-    p.insert_reverse_relationships()
-    # Census relies on population of ABS names from Austlang, so this must
-    #  be run before any census stuff.
-    # Austlang can create new ISOs, so from this point we need to ask the
-    #  db for all it's ISO codes instead of using "all_known_isos"
-    austlang.persist_languages(p)
-    austlang.persist_ABS_names(p)
-    austlang.persist_external_references(p)
-    all_known_isos = load_data_for_new_isos(all_known_isos)
+def insert_reverse_relationships(persister, results):
+    # Reverse relationships are persisted under an implied source, so
+    #  the check for an existing forward relationship is unaffected by
+    #  buffering
+    with persister.batch():
+        persister.insert_reverse_relationships()
+
 
+def persist_austlang(persister, results):
+    # Only reads the db to log whether an ISO is new, so doesn't need to
+    #  wait for the db driven sources
+    austlang.persist_languages(persister)
+    austlang.persist_ABS_names(persister)
+    austlang.persist_external_references(persister)
+
+
+def persist_tindale(persister, results):
     # Tindale can also create new ISOs, based on an override dictionary
+    # Not recorded, as it checks each location against those it has
+    #  already written
     tindale.persist_latitude_longitudes()
     # tindale.compare_tindale_wals_lat_lons()
-    all_known_isos = load_data_for_new_isos(all_known_isos)
 
-    for lang in all_known_isos:
-        census.persist_L1_speaker_count(p, lang)
-        census.persist_english_competency(p, lang)
 
-    all_known_isos = load_data_for_new_isos(all_known_isos)
+def persist_census(persister, results):
+    for lang in results["new_isos_after_tindale"]:
+        census.persist_L1_speaker_count(persister, lang)
+        census.persist_english_competency(persister, lang)
+
+
+def persist_findabible(persister, results, iso_list):
+    fab.prefetch_isos(iso_list)
+    for lang in iso_list:
+        fab.persist_translation(persister, lang)
+
 
+def finish_load(persister, results):
+    # Materialise what the table and map pages show, now that all
+    #  sources are loaded
+    persister.refresh_language_summary()
+    persister.ensure_indexes()
+    if settings.LANGUAGE_EXPLORER_SNAPSHOT_FILE:
+        # A staging copy's snapshot only replaces the live one once the
+        #  copy itself has been swapped in
+        write_snapshot_file(persister, persister.get_snapshot_write_path(
+            settings.LANGUAGE_EXPLORER_SNAPSHOT_FILE))
+
+
+# In the order that the loader originally ran them, which is also the order
+#  their writes reach the db
+STAGES = [
+    Stage("iso_list", get_db_driven_isos,
+          inputs=["jpharvest", "wals"]),
+    Stage("jp_speaker_counts",
+          lambda persister, results, isos:
+          persist_jp_speaker_counts(persister, isos),
+          requires=["iso_list"], split=split_isos("iso_list"),
+          incremental=True,
+          inputs=["jpharvest"],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE]),
+    Stage("jp_languages",
+          lambda persister, results, isos:
+          persist_source_languages(persister, joshuaproject, isos),
+          requires=["iso_list"], split=split_isos("iso_list"),
+          incremental=True,
+          inputs=["jpharvest"],
+          outputs=[LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.CLASSIFICATION_TABLE,
+                   LanguagePersistence.TRANSLATION_TABLE]),
+    Stage("wals_languages",
+          lambda persister, results, isos:
+          persist_source_languages(persister, wals, isos),
+          requires=["iso_list"], split=split_isos("iso_list"),
+          incremental=True,
+          inputs=["wals"],
+          outputs=[LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.CLASSIFICATION_TABLE,
+                   LanguagePersistence.TRANSLATION_TABLE]),
+    Stage("wals_lat_lons",
+          lambda persister, results:
+          wals.persist_latitude_longitudes(persister),
+          inputs=["wals"],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE]),
+    Stage("sil_retirements",
+          lambda persister, results:
+          sil_rcem.persist_retirement_relationships(persister),
+          inputs=["sil_rcem"],
+          outputs=[LanguagePersistence.RELATIONSHIP_TABLE]),
+    Stage("reverse_relationships", insert_reverse_relationships,
+          requires=["sil_retirements"], direct=True,
+          inputs=[LanguagePersistence.RELATIONSHIP_TABLE],
+          outputs=[LanguagePersistence.RELATIONSHIP_TABLE]),
+    # Census relies on population of ABS names from Austlang, so this must
+    #  be run before any census stuff.
+    Stage("austlang", persist_austlang,
+          inputs=["austlang", LanguagePersistence.ALIAS_TABLE],
+          outputs=[LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.REFERENCE_TABLE]),
+    # Austlang can create new ISOs, so from this point we need to ask the
+    #  db for all it's ISO codes instead of using the db driven isos
+    Stage("new_isos_after_austlang",
+          lambda persister, results:
+          load_data_for_new_isos(persister, results["iso_list"]),
+          requires=["iso_list", "jp_speaker_counts", "jp_languages",
+                    "wals_languages", "wals_lat_lons", "austlang"],
+          inputs=["jpharvest", "wals", LanguagePersistence.ALIAS_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE,
+                   LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.CLASSIFICATION_TABLE,
+                   LanguagePersistence.TRANSLATION_TABLE]),
+    Stage("tindale", persist_tindale,
+          requires=["new_isos_after_austlang"], direct=True,
+          inputs=["tindale", LanguagePersistence.ALIAS_TABLE,
+                  LanguagePersistence.LANGUAGE_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE]),
+    Stage("new_isos_after_tindale",
+          lambda persister, results:
+          load_data_for_new_isos(persister,
+                                 results["new_isos_after_austlang"]),
+          requires=["new_isos_after_austlang", "tindale"],
+          inputs=["jpharvest", "wals", LanguagePersistence.ALIAS_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE,
+                   LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.CLASSIFICATION_TABLE,
+                   LanguagePersistence.TRANSLATION_TABLE]),
+    Stage("census", persist_census,
+          requires=["new_isos_after_tindale"],
+          inputs=["census", LanguagePersistence.ALIAS_TABLE,
+                  LanguagePersistence.LANGUAGE_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE]),
+    Stage("new_isos_after_census",
+          lambda persister, results:
+          load_data_for_new_isos(persister,
+                                 results["new_isos_after_tindale"]),
+          requires=["new_isos_after_tindale", "census"],
+          inputs=["jpharvest", "wals", LanguagePersistence.ALIAS_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_TABLE,
+                   LanguagePersistence.ALIAS_TABLE,
+                   LanguagePersistence.CLASSIFICATION_TABLE,
+                   LanguagePersistence.TRANSLATION_TABLE]),
     # FAB can't provide an ISO list, so ask the database! For this
     #  reason, this must run after the db is populated with ISO codes
-    for lang in all_known_isos:
-        fab.persist_translation(p, lang)
+    Stage("findabible", persist_findabible,
+          requires=["new_isos_after_census"],
+          split=split_isos("new_isos_after_census"), incremental=True,
+          inputs=["findabible"],
+          outputs=[LanguagePersistence.TRANSLATION_TABLE]),
+    Stage("finish", finish_load,
+          requires=["findabible", "reverse_relationships"], direct=True,
+          inputs=[LanguagePersistence.ALIAS_TABLE,
+                  LanguagePersistence.LANGUAGE_TABLE,
+                  LanguagePersistence.TRANSLATION_TABLE,
+                  LanguagePersistence.RELATIONSHIP_TABLE],
+          outputs=[LanguagePersistence.LANGUAGE_SUMMARY_TABLE]),
+]
+
+
+# Inputs that can change between loads. Stages reading only unchanged
+#  inputs are skipped on a rerun
+SOURCE_FINGERPRINTS = {
+    "jpharvest": joshuaproject.get_fingerprint,
+    "wals": wals.get_fingerprint,
+    "sil_rcem": sil_rcem.get_fingerprint,
+    "austlang": austlang.get_fingerprint,
+    "tindale": tindale.get_fingerprint,
+    "census": census.get_fingerprint,
+    "findabible": fab.get_fingerprint,
+}
+
+
+def use_persister(persister):
+    """Load into persister, including from adapters that read back what
+    has been loaded"""
+    global p
+    p = persister
+    census.persister = persister
+    tindale.persister = persister
+
+
+def main(force=False, report_path=None, resume=False):
+    report = RunReport()
+    with recording(report):
+        changes = load(force, resume)
+    report = report.as_dict()
+    report["changes"] = changes
+    p.persist_load_run(report)
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    logging.info("Load took %.1fs. See --history for earlier loads",
+                 report["wall_time"])
+
+
+def load(force=False, resume=False):
+    """Run a load
+
+    :return: the ISOs whose rows the load inserted, updated or deleted, per
+     table and then kind of change, and the data generations it took the
+     db from and to. See static_build.changes_since
+    :rtype: dict
+    """
+    # Stages run concurrently where their requirements allow, but their
+    #  writes are applied in STAGES order, a batch per chunk of ISOs. Each
+    #  stage and chunk is checkpointed as it's written, so a failed load
+    #  can continue from where it stopped. See pipeline.run_stages
+    db_url = settings.LANGUAGE_EXPLORER_DB_URL
+    p.check_for_updates()
+    from_generation = p.get_data_generation()
+    # Every load goes into a copy of the db, which is swapped in once
+    #  complete, so the site keeps serving the last complete load until
+    #  then, and never one part way through. A full load starts from an
+    #  empty copy. Otherwise only stages with something new to do run,
+    #  updating a copy of the live db. Resuming continues in the copy
+    #  left by a failed load
+    full = force or not p.get_load_state()
+    live = p
+    staging = StagingLanguagePersistence(
+        db_url, resume=resume,
+        snapshot_path=settings.LANGUAGE_EXPLORER_SNAPSHOT_FILE,
+        copy_live=not full)
+    use_persister(staging)
+    try:
+        run_stages(STAGES, staging, fingerprints=SOURCE_FINGERPRINTS)
+        if full or staging.resumed:
+            # Every row of an empty copy was inserted, and those written
+            #  before resuming weren't tracked, so what changed is only
+            #  known by comparing the copy with the live db
+            changed_isos = diff_load(live, staging).changed_isos()
+        else:
+            changed_isos = staging.take_changed_isos()
+        staging.swap_in()
+    finally:
+        use_persister(live)
+    p.check_for_updates()
+    return collections.OrderedDict([
+        ("from_generation", from_generation),
+        ("to_generation", p.get_data_generation()),
+        ("isos", changed_isos),
+    ])
+
+
+def dry_run(report_path=None):
+    """Load every source into a scratch db and show how the load would
+    change the live db, which is left untouched
+
+    The stages read back what earlier stages wrote, by name matching and
+    ISO lookups and in the SQL deriving reverse relationships, so they're
+    run against a real, if throwaway, db rather than an in memory copy of
+    their writes. See staging.ScratchLanguagePersistence
+
+    :return: 1 if the load would change anything, as diff does, else 0
+    """
+    scratch_dir = tempfile.mkdtemp(prefix="language_explorer_dry_run")
+    scratch = ScratchLanguagePersistence(
+        "sqlite:///" + os.path.join(scratch_dir, "load.db"))
+    live = p
+    use_persister(scratch)
+    try:
+        # finish only derives the summary and snapshot from the tables
+        #  being compared, and would overwrite the live snapshot
+        run_stages([stage for stage in STAGES if stage.name != "finish"],
+                   scratch)
+        diff = diff_load(live, scratch)
+    finally:
+        use_persister(live)
+        scratch.lang_db.engine.dispose()
+        shutil.rmtree(scratch_dir)
+    print diff.format()
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(diff.as_dict(), f, indent=2)
+    if diff.is_empty():
+        logging.info("A load would change nothing")
+        return 0
+    logging.info("A load would change rows of %s ISOs", len(diff.isos))
+    return 1
 
 
 def test():
@@ -111,10 +388,51 @@ def test():
     austlang.persist_languages(p)
 
 
+def backfill_signatures():
+    p.backfill_signatures()
+
+
+def print_history():
+    print format_history(p.get_load_runs(HISTORY_RUNS))
+
+
 if __name__ == '__main__':
-    if len(sys.argv) > 1 and sys.argv[1] == "-t":
+    parser = argparse.ArgumentParser(description="Load language data")
+    parser.add_argument("-t", dest="command", action="store_const",
+                        const=test, default=main,
+                        help="run the test function instead of a load")
+    parser.add_argument("--backfill-signatures", dest="command",
+                        action="store_const", const=backfill_signatures,
+                        help="fill in name signatures of existing aliases")
+    parser.add_argument("--dry-run", dest="command", action="store_const",
+                        const=dry_run,
+                        help="show what a load would insert, update and "
+                             "delete, per table, source and ISO, without "
+                             "changing the db. Exits with 1 if it would "
+                             "change anything")
+    parser.add_argument("--history", dest="command", action="store_const",
+                        const=print_history,
+                        help="show how long recent loads took, per stage "
+                             "and source")
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage of a load, even those whose "
+                             "inputs haven't changed since the last load")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue a full load that failed, from the "
+                             "last stage or chunk of ISOs it completed, "
+                             "rather than starting it again")
+    parser.add_argument("--report", metavar="PATH",
+                        help="write a JSON report of the load's time, "
+                             "db statements, rows written, web cache use "
+                             "and memory, per stage and source, or of the "
+                             "differences found by --dry-run")
+    args = parser.parse_args()
+    if args.command is test:
         logger = logging.getLogger()
         logger.setLevel(logging.DEBUG)
-        sys.exit(test())
-    else:
-        sys.exit(main())
+    if args.command is main:
+        sys.exit(main(force=args.force, report_path=args.report,
+                      resume=args.resume))
+    if args.command is dry_run:
+        sys.exit(dry_run(report_path=args.report))
+    sys.exit(args.command())
@@ -5,7 +5,7 @@ import itertools
 import re
 import sys
 import logging
-from language_explorer.utils import memoized
+from language_explorer.utils import LRUCache
 from language_explorer import data_massaging
 
 __author__ = 'esteele'
@@ -14,7 +14,68 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+class SignatureEngine(object):
+    """Computes NamingHelper signatures
+
+    Applies NamingHelper.mappings with the patterns compiled up front,
+    literal substitutions done by str.replace and the terminal vowel rules
+    fused into one pass. Recently seen names are cached.
+    """
+    # Equivalent to NamingHelper.mappings, in the same order. Strings are
+    #  literal substitutions, everything else is a compiled pattern
+    passes = [
+        ('n\'a', 'nya'),
+        (re.compile(r'\W', re.UNICODE), ''),
+        (re.compile('[ij]a', re.UNICODE), 'ya'),
+        ('yau', 'yaw'),
+        ('ie', 'y'),
+        (re.compile('^u', re.UNICODE), 'w'),
+        (re.compile(r'([aei])n[dt]y?i$', re.UNICODE), r'\g<1>ndji'),
+        # Only one of the terminal vowel rules can apply, as they leave an
+        #  upper case letter at the end
+        (re.compile(r'([aeiouy])\1*$', re.UNICODE),
+         lambda m: m.group(1).upper()),
+        (re.compile(r'(.)[aeiou]\1', re.UNICODE), r'\g<1>#\g<1>'),
+        (re.compile(r'(.)[aeiou]\1', re.UNICODE), r'\g<1>#\g<1>'),
+        (re.compile('[aeiou]+', re.UNICODE), ''),
+        ('d', 't'),
+        ('th', 't'),
+        ('nh', 'n'),
+        ('tyn', 'tn'),
+        ('rmb', 'mb'),
+        ('p', 'b'),
+        (re.compile('^gn', re.UNICODE), 'ng'),
+        ('k', 'g'),
+        (re.compile(r'(.)\1', re.UNICODE), r'\g<1>'),
+    ]
+
+    def __init__(self, cache_size=65536):
+        self._cache = LRUCache(cache_size)
+
+    def signature(self, word):
+        sig = self._cache.get(word)
+        if sig is None:
+            sig = self._compute(word)
+            self._cache.put(word, sig)
+        return sig
+
+    def signatures(self, names):
+        """Signatures for each of names, in the same order"""
+        return [self.signature(name) for name in names]
+
+    def _compute(self, word):
+        word = word.lower()
+        for patt, repl in self.passes:
+            if isinstance(patt, basestring):
+                word = word.replace(patt, repl)
+            else:
+                word = patt.sub(repl, word)
+        return word
+
+
 class NamingHelper(object):
+    # The signature rules, applied in order. SignatureEngine.passes
+    #  must be kept equivalent
     mappings = [
         # (unichr(8217), unichr(39)),  # e.g. the stop in adt
         ('n\'a', 'nya'),
@@ -46,8 +107,19 @@ class NamingHelper(object):
         (r'(.)\1', r'\g<1>'),  # conflate repeating letters
     ]
 
+    engine = SignatureEngine()
+
     @staticmethod
     def signature(word):
+        return NamingHelper.engine.signature(word)
+
+    @staticmethod
+    def signatures(names):
+        return NamingHelper.engine.signatures(names)
+
+    @staticmethod
+    def reference_signature(word):
+        """Applies mappings directly. Much slower than signature()"""
         #logger.debug(">>> %s", word.encode('utf-8'))
         word = word.lower()
         for patt, repl in NamingHelper.mappings:
@@ -63,8 +135,9 @@ class NamingHelper(object):
         return type dictionary key: signature <str> value: list of isos <str>
         """
         mappings = collections.defaultdict(list)
-        for iso, name in iso_name_list:
-            sig = NamingHelper.signature(name)
+        sig_list = NamingHelper.signatures(
+            [name for _, name in iso_name_list])
+        for (iso, name), sig in zip(iso_name_list, sig_list):
             mappings[sig].append((iso, name))
 
         return mappings
@@ -114,22 +187,145 @@ class NamingHelper(object):
                 nsl.append((iso, name))
         return nsl
 
-    @memoized
     def summarise_list_as_dict(self, l):
-        sigs = collections.defaultdict(set)
-        for d in l:
-            override_iso = data_massaging.signature_overrides.get(d.name)
-            if override_iso == data_massaging.NO_ISO:
-                continue
-            elif override_iso:
-                sigs[NamingHelper.signature(d.name)].add(override_iso)
-            else:
-                sigs[NamingHelper.signature(d.name)].add(d.iso)
-        return sigs
+        """dict of signature -> set of isos for a list of alias rows"""
+        return SignatureIndex(l).isos_by_signature
+
+
+def levenshtein(a, b):
+    """Edit distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b) + 1)
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree(object):
+    """Finds all words within an edit distance of a word, without
+    comparing it to every word
+
+    Each node's children are keyed on their distance from it, so by the
+    triangle inequality a search only descends into children whose key is
+    within max_distance of the query's distance to the node.
+    """
+    def __init__(self, words=(), distance=levenshtein):
+        self.distance = distance
+        # (word, {distance: child node})
+        self._root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node_word, children = self._root
+        while True:
+            d = self.distance(word, node_word)
+            if d == 0:
+                return
+            if d not in children:
+                children[d] = (word, {})
+                return
+            node_word, children = children[d]
+
+    def search(self, word, max_distance):
+        """
+        :return: (distance, word) for each word within max_distance
+        :rtype: list
+        """
+        results = []
+        if self._root is None:
+            return results
+        nodes = [self._root]
+        while nodes:
+            node_word, children = nodes.pop()
+            d = self.distance(word, node_word)
+            if d <= max_distance:
+                results.append((d, node_word))
+            nodes.extend(child for child_d, child in children.iteritems()
+                         if d - max_distance <= child_d <= d + max_distance)
+        return sorted(results)
 
-    def get_matching_iso_list_from_name(self, name_to_match, t):
-        sigs = self.summarise_list_as_dict(t)
-        return sigs[NamingHelper.signature(name_to_match)]
+
+class SignatureIndex(object):
+    """Isos indexed by exact name and by name signature
+
+    Rows can be added one at a time, so the index can be kept up to date
+    as aliases are written rather than rebuilt.
+    """
+    def __init__(self, alias_rows=()):
+        self.isos_by_name = collections.defaultdict(set)
+        self.isos_by_signature = collections.defaultdict(set)
+        # Built on the first fuzzy search
+        self._signature_tree = None
+        alias_rows = list(alias_rows)
+        for row, sig in zip(alias_rows, NamingHelper.signatures(
+                [row.name for row in alias_rows])):
+            self._add(row.iso, row.name, sig)
+
+    @classmethod
+    def from_signatures(cls, iso_name_signatures):
+        """Index built from (iso, name, signature) tuples, only computing
+        signatures that are None"""
+        index = cls()
+        for iso, name, sig in iso_name_signatures:
+            index.add(iso, name, sig)
+        return index
+
+    def add(self, iso, name, sig=None):
+        if sig is None:
+            sig = NamingHelper.signature(name)
+        self._add(iso, name, sig)
+
+    def _add(self, iso, name, sig):
+        self.isos_by_name[name].add(iso)
+        override_iso = data_massaging.signature_overrides.get(name)
+        if override_iso == data_massaging.NO_ISO:
+            return
+        if self._signature_tree is not None and \
+                sig not in self.isos_by_signature:
+            self._signature_tree.add(sig)
+        if override_iso:
+            self.isos_by_signature[sig].add(override_iso)
+        else:
+            self.isos_by_signature[sig].add(iso)
+
+    def get_isos_for_name(self, name):
+        """Isos with an alias of exactly this name"""
+        return set(self.isos_by_name.get(name, ()))
+
+    def get_isos_for_signature_of(self, name):
+        """Isos with an alias sharing this name's signature"""
+        return set(self.isos_by_signature.get(
+            NamingHelper.signature(name), ()))
+
+    def find_isos_fuzzy(self, name, max_distance):
+        """Isos with an alias whose signature is within max_distance edits
+        of this name's signature
+
+        :return: (iso, distance) tuples, closest first
+        :rtype: list
+        """
+        if self._signature_tree is None:
+            self._signature_tree = BKTree(
+                sig for sig, isos in self.isos_by_signature.iteritems()
+                if isos)
+        best_distances = {}
+        for distance, sig in self._signature_tree.search(
+                NamingHelper.signature(name), max_distance):
+            for iso in self.isos_by_signature[sig]:
+                best_distances.setdefault(iso, distance)
+        return sorted(best_distances.iteritems(),
+                      key=lambda iso_distance: (iso_distance[1],
+                                                iso_distance[0]))
 
 if __name__ == "__main__":
     test_name = sys.argv[1]
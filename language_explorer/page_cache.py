@@ -0,0 +1,295 @@
+"""Where scraped sources keep the pages they fetch.
+
+Pages are keyed on a filename made from their url. They are kept either
+as a file per page, or all in a single pack file once the cache has been
+migrated:
+
+    python -m language_explorer.page_cache migrate <cache root> [--remove]
+
+open_page_store picks whichever layout a cache root holds.
+"""
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import threading
+import zlib
+from language_explorer.utils import atomic_write, file_fingerprint, \
+    directory_fingerprint
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class DirectoryPageStore(object):
+    """A file per page, named by its key"""
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def read(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def write(self, key, data):
+        """Store data under key, replacing any page already there. Pages
+        appear complete or not at all"""
+        atomic_write(self._path(key), data)
+
+    def keys(self, prefix=""):
+        # Skipping atomic_write's temporary files, and anything else that
+        #  isn't a page
+        return sorted(name for name in os.listdir(self.root)
+                      if name.startswith(prefix) and
+                      not name.startswith(".") and
+                      os.path.isfile(self._path(name)))
+
+    def page_fingerprint(self, key):
+        """sha1 of a page's contents"""
+        return file_fingerprint(self._path(key))
+
+    def fingerprint(self, prefix=""):
+        """Changes whenever a page whose key starts with prefix is added or
+        replaced"""
+        return directory_fingerprint(self.root, prefix)
+
+
+class PackedPageStore(object):
+    """Every page in one pack file, each zlib compressed, with an index of
+    where each is so that it can be read directly
+
+    Both files are only ever appended to. A page that is written again is
+    appended again, and the index's later entry for it wins. The pack is
+    self describing, so pages written after the last index entry, or the
+    whole index, can be recovered from it.
+
+    Safe to use from several threads and processes. Opening, recovery
+    and writes hold an exclusive lock on the pack, so no process sees
+    another's page part way through being written. A store only reads the
+    pages that were in the pack when it was opened, and those it writes.
+    """
+    PACK_FILENAME = "pages.pack"
+    INDEX_FILENAME = "pages.idx"
+    # Magic, key length, sha1 of the page and compressed length, followed
+    #  by the key and then the compressed page
+    RECORD_HEADER = struct.Struct(">4sH20sI")
+    RECORD_MAGIC = "LXP1"
+
+    def __init__(self, root):
+        """Keys must be byte strings, as the filenames made from urls are"""
+        self.root = root
+        self.pack_path = os.path.join(root, self.PACK_FILENAME)
+        self.index_path = os.path.join(root, self.INDEX_FILENAME)
+        self._lock = threading.Lock()
+        # (offset of compressed page, compressed length, sha1) per key
+        self._index = {}
+        self._pack = open(self.pack_path, "ab")
+        with self._process_lock():
+            self._load_index()
+            self._index_writer = open(self.index_path, "ab")
+        self._pack_reader = open(self.pack_path, "rb")
+
+    @contextlib.contextmanager
+    def _process_lock(self):
+        """Held by one store on the pack at a time, in any process"""
+        fcntl.flock(self._pack.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._pack.fileno(), fcntl.LOCK_UN)
+
+    @classmethod
+    def exists(cls, root):
+        return os.path.exists(os.path.join(root, cls.PACK_FILENAME))
+
+    def _load_index(self):
+        pack_size = os.path.getsize(self.pack_path) \
+            if os.path.exists(self.pack_path) else 0
+        indexed_end = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # Cut off part way through. Recovered from the pack
+                        break
+                    key, offset, length, sha1 = line[:-1].split("\t")
+                    offset, length = int(offset), int(length)
+                    self._index[key] = (offset, length, sha1)
+                    indexed_end = max(indexed_end, offset + length)
+        if indexed_end > pack_size:
+            logging.warning("Index of %s is ahead of the pack. Rebuilding "
+                            "it from the pack", self.root)
+            self._index.clear()
+            indexed_end = 0
+        recovered, good_end = self._scan(indexed_end)
+        if good_end < pack_size:
+            logging.warning("Discarding %s bytes of a page cut off part "
+                            "way through writing to %s",
+                            pack_size - good_end, self.pack_path)
+            with open(self.pack_path, "r+b") as f:
+                f.truncate(good_end)
+        if recovered or indexed_end == 0:
+            # Rewritten whole rather than appended to, as it may end part
+            #  way through a line
+            logging.info("Recovered %s pages from %s", len(recovered),
+                         self.pack_path)
+            self._index.update(recovered)
+            atomic_write(self.index_path, "".join(
+                self._index_line(key, entry)
+                for key, entry in sorted(self._index.iteritems())))
+
+    def _scan(self, start):
+        """Index entries of the complete records in the pack from start,
+        and where the last of them ends"""
+        recovered = {}
+        if not os.path.exists(self.pack_path):
+            return recovered, 0
+        with open(self.pack_path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(self.RECORD_HEADER.size)
+                if len(header) < self.RECORD_HEADER.size:
+                    break
+                magic, key_length, digest, length = \
+                    self.RECORD_HEADER.unpack(header)
+                if magic != self.RECORD_MAGIC:
+                    break
+                key = f.read(key_length)
+                offset = f.tell()
+                f.seek(length, os.SEEK_CUR)
+                if len(key) < key_length or f.tell() > \
+                        os.fstat(f.fileno()).st_size:
+                    break
+                recovered[key] = (offset, length, digest.encode("hex"))
+                start = f.tell()
+        return recovered, start
+
+    @staticmethod
+    def _index_line(key, entry):
+        offset, length, sha1 = entry
+        return "%s\t%s\t%s\t%s\n" % (key, offset, length, sha1)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def read(self, key):
+        offset, length, _ = self._index[key]
+        with self._lock:
+            self._pack_reader.seek(offset)
+            compressed = self._pack_reader.read(length)
+        return zlib.decompress(compressed)
+
+    def write(self, key, data):
+        """Store data under key, replacing any page already there"""
+        digest = hashlib.sha1(data)
+        compressed = zlib.compress(data)
+        with self._lock, self._process_lock():
+            if os.fstat(self._index_writer.fileno()).st_ino != \
+                    os.stat(self.index_path).st_ino:
+                # Rewritten by another process's recovery
+                self._index_writer.close()
+                self._index_writer = open(self.index_path, "ab")
+            self._pack.seek(0, os.SEEK_END)
+            offset = self._pack.tell() + self.RECORD_HEADER.size + len(key)
+            self._pack.write(self.RECORD_HEADER.pack(
+                self.RECORD_MAGIC, len(key), digest.digest(),
+                len(compressed)) + key + compressed)
+            self._pack.flush()
+            entry = (offset, len(compressed), digest.hexdigest())
+            self._index[key] = entry
+            self._index_writer.write(self._index_line(key, entry))
+            self._index_writer.flush()
+
+    def keys(self, prefix=""):
+        return sorted(key for key in self._index if key.startswith(prefix))
+
+    def page_fingerprint(self, key):
+        """sha1 of a page's contents, without reading it"""
+        return self._index[key][2]
+
+    def fingerprint(self, prefix=""):
+        """Changes whenever a page whose key starts with prefix is added or
+        replaced"""
+        digest = hashlib.sha1()
+        for key in self.keys(prefix):
+            digest.update("%s %s\n" % (key, self._index[key][2]))
+        return digest.hexdigest()
+
+    def close(self):
+        for f in (self._pack, self._pack_reader, self._index_writer):
+            f.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_page_store(root):
+    """The store for the pages in root, shared by everything that opens it,
+    so that there is only ever one writer"""
+    root = os.path.abspath(root)
+    with _stores_lock:
+        if root not in _stores:
+            if PackedPageStore.exists(root):
+                _stores[root] = PackedPageStore(root)
+            else:
+                _stores[root] = DirectoryPageStore(root)
+        return _stores[root]
+
+
+def migrate(root, remove=False):
+    """Copy the pages of a directory of page files into a pack in the same
+    directory, checking each against its file. Pages already in the pack
+    are skipped, so an interrupted migration can be run again
+
+    Stores opened on root from then on read the pack.
+
+    :param remove: delete each page file once it has been packed
+    :return: number of pages packed
+    """
+    root = os.path.abspath(root)
+    directory = DirectoryPageStore(root)
+    keys = [key for key in directory.keys()
+            if key not in (PackedPageStore.PACK_FILENAME,
+                           PackedPageStore.INDEX_FILENAME)]
+    with _stores_lock:
+        pack = _stores.get(root)
+        if not isinstance(pack, PackedPageStore):
+            pack = _stores[root] = PackedPageStore(root)
+    packed = 0
+    for key in keys:
+        data = directory.read(key)
+        if key not in pack or \
+                pack.page_fingerprint(key) != hashlib.sha1(data).hexdigest():
+            pack.write(key, data)
+            packed += 1
+        if pack.read(key) != data:
+            raise IOError("Page %s differs once packed" % (key,))
+        if remove:
+            os.remove(os.path.join(root, key))
+    logging.info("Packed %s of %s pages from %s into %s", packed, len(keys),
+                 root, pack.pack_path)
+    return packed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage a page cache")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="pack a directory of cached pages into one file, "
+                        "which the sources then read instead")
+    migrate_parser.add_argument("root", help="the cache directory")
+    migrate_parser.add_argument("--remove", action="store_true",
+                                help="delete each page's file once packed")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(args.root, remove=args.remove)
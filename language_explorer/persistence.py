@@ -1,10 +1,16 @@
+import contextlib
+import hashlib
 import itertools
 import collections
+import json
 import logging
+import os
 import dataset
+import sqlalchemy
+from dataset.persistence.util import guess_type
 from language_explorer import constants
+from language_explorer import instrumentation
 from language_explorer import naming_helper
-from language_explorer.utils import memoized
 
 __author__ = 'esteele'
 
@@ -13,34 +19,138 @@ logging.basicConfig(level=logging.DEBUG)
 CacheableAliasRow = collections.namedtuple(
     "CacheableAliasRow", ["iso", "name", "alias_type", "source"])
 
+LanguageSummaryRow = collections.namedtuple(
+    "LanguageSummaryRow", ["iso", "display_name", "best_translation_state",
+                           "is_retired", "css_class", "has_alias",
+                           "has_language_row", "latitude", "longitude",
+                           "speaker_count", "jp_speaker_count",
+                           "census_speaker_count", "english_competency_pess",
+                           "cannot_read_english_count",
+                           "translated_relations"])
+
 
 class LanguagePersistence(object):
+    __metaclass__ = instrumentation.CountedPersisterType
     ALIAS_TABLE = "language_alias"
     LANGUAGE_TABLE = "language"
     CLASSIFICATION_TABLE = "classification"
     TRANSLATION_TABLE = "translation"
     RELATIONSHIP_TABLE = "relationship"
     REFERENCE_TABLE = "reference"
+    # Derived from the tables above. See refresh_language_summary
+    LANGUAGE_SUMMARY_TABLE = "language_summary"
+    # What each loader stage last ran on. See pipeline.run_stages
+    LOAD_STATE_TABLE = "load_state"
+    # A report of each load. See instrumentation.RunReport
+    LOAD_RUN_TABLE = "load_run"
+    # Bookkeeping of loads, rather than language data. Nothing served is
+    #  read from them
+    LOAD_TABLES = [LOAD_STATE_TABLE, LOAD_RUN_TABLE]
+    LANGUAGE_SUMMARY_COLUMN_TYPES = [
+        ("iso", sqlalchemy.UnicodeText),
+        ("display_name", sqlalchemy.UnicodeText),
+        ("best_translation_state", sqlalchemy.Integer),
+        ("is_retired", sqlalchemy.Boolean),
+        ("css_class", sqlalchemy.UnicodeText),
+        ("has_alias", sqlalchemy.Boolean),
+        ("has_language_row", sqlalchemy.Boolean),
+        ("latitude", sqlalchemy.Float),
+        ("longitude", sqlalchemy.Float),
+        ("speaker_count", sqlalchemy.Integer),
+        ("jp_speaker_count", sqlalchemy.Integer),
+        ("census_speaker_count", sqlalchemy.Integer),
+        ("english_competency_pess", sqlalchemy.Integer),
+        ("cannot_read_english_count", sqlalchemy.Integer),
+        ("translated_relations", sqlalchemy.UnicodeText),
+    ]
     PRIMARY_NAME_TYPE = "p"
     ALTERNATE_NAME_TYPE = "a"
     DIALECT_TYPE = "d"
+    # Columns identifying a row for upserts, per table
+    UPSERT_KEYS = {
+        ALIAS_TABLE: ["iso", "alias_type", "name", "source"],
+        LANGUAGE_TABLE: ["iso"],
+        CLASSIFICATION_TABLE: ["iso", "source", "level"],
+        TRANSLATION_TABLE: ["iso", "source"],
+        RELATIONSHIP_TABLE: ["subject_iso", "source", "rel_verb",
+                             "object_iso"],
+        REFERENCE_TABLE: ["iso", "ext_ref_id", "ext_ref_source"],
+        LOAD_STATE_TABLE: ["stage"],
+        LOAD_RUN_TABLE: ["started"],
+    }
+    # Where a table's ISO column isn't named iso
+    ISO_COLUMNS = {
+        RELATIONSHIP_TABLE: "subject_iso",
+    }
+    # Indexes beyond those on UPSERT_KEYS, per table
+    EXTRA_INDEXES = {
+        ALIAS_TABLE: [["signature"]],
+    }
+    # One row per table, counting the writes that changed it. Lets any
+    #  process find out cheaply whether its cached data is stale
+    GENERATION_TABLE = "table_generation"
+    # Tables each in-process cache is derived from
+    CACHE_TABLES = {
+        "alias_contents": [ALIAS_TABLE],
+        "alias_index": [ALIAS_TABLE],
+        # Kept up to date by our own alias writes. See _update_signature_index
+        "signature_index": [ALIAS_TABLE],
+        "translation_state": [TRANSLATION_TABLE],
+        "l1_speaker_count": [LANGUAGE_TABLE],
+        "retirement_state": [RELATIONSHIP_TABLE],
+        # Can fall back to being computed from the other tables
+        "language_summary": [LANGUAGE_SUMMARY_TABLE, ALIAS_TABLE,
+                             LANGUAGE_TABLE, TRANSLATION_TABLE,
+                             RELATIONSHIP_TABLE],
+    }
+    MAP_EXCLUDED_ISOS = [
+        "dze",  # was split - no map or bible data
+    ]
     REVERSIBLE_RELATIONSHIPS = [
         constants.RELTYPE_RETIREMENT_SPLIT_INTO,
         constants.RELTYPE_RETIREMENT_MERGED_INTO]
+    # Create each table's indexes as soon as it's written. See
+    #  ensure_indexes
+    INDEX_ON_WRITE = True
 
     def __init__(self, db_url):
-        self.lang_db = dataset.connect(db_url)
-        self.translation_state_cache = {}
-        self.l1_speaker_count_cache = {}
-        self.retirement_state_cache = {}
-        self.wals_primary_name_cache = {}
-        # Serves to invalidate cache on potential writes
-        # See note on _do_get_alias_table_contents
-        # Doesn't need to be particulary efficient given this
-        #  is only relevant in the already-slow loader run
-        self._alias_table_write_id = 0
+        self.db_url = db_url
+        self.lang_db = None
+        self._connect()
+        # Keyed on CACHE_TABLES names. Dropped when the generation of
+        #  any table they're derived from changes
+        self._caches = {}
+        # Table generations that the caches reflect
+        self._seen_generations = self._read_generations()
+        # Per-table buffered writes while inside batch()
+        self._batch = None
+        # ISOs of rows our own writes have changed, per table and then kind
+        #  of change. See take_changed_isos
+        self._changed_isos = collections.defaultdict(
+            lambda: collections.defaultdict(set))
         self.naming_helper = naming_helper.NamingHelper()
 
+    def _connect(self):
+        """(Re)connect to the db, which may have been replaced by a newly
+        loaded one. See staging.StagingLanguagePersistence"""
+        if self.lang_db is not None:
+            self.lang_db.engine.dispose()
+        self.lang_db = dataset.connect(self.db_url)
+        self._seen_db_file_id = self._db_file_id()
+
+    def _db_file_id(self):
+        """Identity of a sqlite db's file, which changes when a new file is
+        moved into place. None for other dbs"""
+        url = sqlalchemy.engine.url.make_url(self.db_url)
+        if not url.drivername.startswith("sqlite") or \
+                url.database in (None, "", ":memory:"):
+            return None
+        try:
+            st = os.stat(url.database)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
     def persist_language(self, iso, primary_name, source):
         self._persist_alias(iso, self.PRIMARY_NAME_TYPE,
                             primary_name, source)
@@ -54,41 +164,39 @@ class LanguagePersistence(object):
                             alternate_name, source)
 
     def _persist_alias(self, iso, alternate_type, alternate_name, source):
-        self.lang_db[self.ALIAS_TABLE].upsert(dict(
+        self._upsert(self.ALIAS_TABLE, dict(
             iso=iso,
             alias_type=alternate_type,
             name=alternate_name,
             source=source,
-            ),
-            ["iso", "alias_type", "name", "source"]
-        )
-        self._alias_table_write_id += 1
+            signature=naming_helper.NamingHelper.signature(alternate_name),
+        ))
 
     def persist_classification(self, iso, c_list, source):
         for c_idx, c_name in enumerate(c_list):
-            self.lang_db[self.CLASSIFICATION_TABLE].upsert(dict(
+            self._upsert(self.CLASSIFICATION_TABLE, dict(
                 iso=iso,
                 source=source,
                 level=c_idx,
                 name=c_name,
-            ), ["iso", "source", "level"])
+            ))
 
     def persist_relationship(self, iso, relationships, source):
         for rel_type, other_iso in relationships:
-            self.lang_db[self.RELATIONSHIP_TABLE].upsert(dict(
+            self._upsert(self.RELATIONSHIP_TABLE, dict(
                 subject_iso=iso,
                 source=source,
                 rel_verb=rel_type,
                 object_iso=other_iso,
-            ), ["subject_iso", "source", "rel_verb", "object_iso"])
+            ))
 
     def persist_translation(self, iso, tr_dict, source):
-        self.lang_db[self.TRANSLATION_TABLE].upsert(dict(
+        self._upsert(self.TRANSLATION_TABLE, dict(
             iso=iso,
             source=source,
             status=tr_dict[constants.TRANSLATION_STATE_STATE_KEY],
             year=tr_dict[constants.TRANSLATION_STATE_YEAR_KEY],
-        ), ["iso", "source"])
+        ))
 
     def persist_L1_speaker_count(self, iso, c, source):
         """Persists L1 speaker count
@@ -98,49 +206,403 @@ class LanguagePersistence(object):
         :param c: L1 speaker count
         :type c: int
         """
-        self.lang_db[self.LANGUAGE_TABLE].upsert(
-            {"iso": iso,
-             "L1_speaker_count_%s" % (source,): c,
-             },
-            ["iso"]
-        )
+        self._upsert(self.LANGUAGE_TABLE,
+                     {"iso": iso,
+                      "L1_speaker_count_%s" % (source,): c,
+                      })
 
     def persist_english_competency(self, iso, pessimistic, optimistic):
-        self.lang_db[self.LANGUAGE_TABLE].upsert(
-            {"iso": iso,
-             "english_competency_pess": pessimistic,
-             "english_competency_optim": optimistic,
-             },
-            ["iso"]
-        )
+        self._upsert(self.LANGUAGE_TABLE,
+                     {"iso": iso,
+                      "english_competency_pess": pessimistic,
+                      "english_competency_optim": optimistic,
+                      })
 
     def persist_lat_lon(self, iso, lat, lon):
-        self.lang_db[self.LANGUAGE_TABLE].upsert(
-            {"iso": iso,
-             "latitude": lat,
-             "longitude": lon,
-             },
-            ["iso"]
-        )
+        self._upsert(self.LANGUAGE_TABLE,
+                     {"iso": iso,
+                      "latitude": lat,
+                      "longitude": lon,
+                      })
 
     def persist_tindale_lat_lon(self, iso, lat, lon):
-        self.lang_db[self.LANGUAGE_TABLE].upsert(
-            {"iso": iso,
-             "tindale_latitude": lat,
-             "tindale_longitude": lon,
-             },
-            ["iso"]
-        )
+        self._upsert(self.LANGUAGE_TABLE,
+                     {"iso": iso,
+                      "tindale_latitude": lat,
+                      "tindale_longitude": lon,
+                      })
 
     def persist_external_reference(self, iso, ext_ref_id, label, source):
-        self.lang_db[self.REFERENCE_TABLE].upsert(
-            {"iso": iso,
-             "ext_ref_id": ext_ref_id,
-             "ext_ref_label": label,
-             "ext_ref_source": source,
-             },
-            ["iso", "ext_ref_id", "ext_ref_source"]
-        )
+        self._upsert(self.REFERENCE_TABLE,
+                     {"iso": iso,
+                      "ext_ref_id": ext_ref_id,
+                      "ext_ref_label": label,
+                      "ext_ref_source": source,
+                      })
+
+    def persist_load_state(self, stage, state):
+        """Record what a loader stage last ran on
+
+        :param state: JSON serialisable
+        """
+        self._upsert(self.LOAD_STATE_TABLE,
+                     {"stage": stage,
+                      "state": json.dumps(state, sort_keys=True),
+                      })
+
+    def persist_load_run(self, report):
+        """Record the report of a load
+
+        :param report: as returned by RunReport.as_dict
+        """
+        self._upsert(self.LOAD_RUN_TABLE,
+                     {"started": report["started"],
+                      "wall_time": report["wall_time"],
+                      "report": json.dumps(report),
+                      })
+
+    def _upsert(self, table_name, row):
+        """Upsert row on the table's UPSERT_KEYS, or buffer it in a batch"""
+        keys = self.UPSERT_KEYS[table_name]
+        if self._batch is not None:
+            key = tuple(row[k] for k in keys)
+            # Rows sharing a key are merged so that e.g. several language
+            #  table columns written for one iso become a single row
+            self._batch[table_name].setdefault(key, {}).update(row)
+        else:
+            table = self.lang_db[table_name]
+            current = table.find_one(**dict((k, row[k]) for k in keys))
+            if current is not None and \
+                    all(current.get(c) == v for c, v in row.iteritems()):
+                # Unchanged, so leave the table's generation alone
+                return
+            signature_index = self._caches.get("signature_index")
+            table.upsert(row, keys)
+            instrumentation.count("rows_written")
+            self._record_changed_isos(
+                table_name, "inserted" if current is None else "updated",
+                [row])
+            self._bump_generations([table_name])
+            if table_name == self.ALIAS_TABLE:
+                self._update_signature_index(signature_index, [row])
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Buffer persist_* writes and flush them in a single transaction
+
+        Writes are deduplicated on their upsert keys and flushed when the
+        outermost batch exits, so get_* calls made inside a batch do not
+        see the buffered writes. Nothing is written if the block raises.
+        """
+        if self._batch is not None:
+            # Nested batches join the outermost one
+            yield
+            return
+        self._batch = collections.defaultdict(collections.OrderedDict)
+        try:
+            yield
+            batch = self._batch
+        finally:
+            self._batch = None
+        self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        # Schema changes can't take part in a transaction, so make sure all
+        #  tables, columns and key indexes exist before we start one
+        for table_name, rows in batch.iteritems():
+            self._ensure_columns(table_name, rows.values())
+        self._get_generation_table()
+        signature_index = self._caches.get("signature_index")
+        self.lang_db.begin()
+        try:
+            changed = []
+            for table_name, rows in batch.iteritems():
+                inserted, updated = self._bulk_upsert(table_name,
+                                                      rows.values())
+                logging.info("Flushed %s rows to %s: %s inserted, "
+                             "%s updated", len(rows), table_name,
+                             inserted, updated)
+                if inserted or updated:
+                    changed.append(table_name)
+            generations = self._increment_generations(changed)
+            self.lang_db.commit()
+        except:
+            self.lang_db.rollback()
+            raise
+        self._record_own_generations(generations)
+        if self.ALIAS_TABLE in batch:
+            self._update_signature_index(
+                signature_index, batch[self.ALIAS_TABLE].values())
+
+    def _ensure_columns(self, table_name, rows):
+        table = self.lang_db[table_name]
+        column_types = {}
+        for row in rows:
+            for column, value in row.iteritems():
+                if column_types.get(column) is None:
+                    column_types[column] = value
+        for column, value in column_types.iteritems():
+            if column not in table.columns:
+                table.create_column(column, guess_type(value))
+        if self.INDEX_ON_WRITE:
+            self._ensure_indexes(table_name)
+
+    def _ensure_indexes(self, table_name):
+        table = self.lang_db[table_name]
+        for columns in [self.UPSERT_KEYS[table_name]] + \
+                self.EXTRA_INDEXES.get(table_name, []):
+            if set(columns).issubset(table.columns):
+                table.create_index(columns)
+
+    def ensure_indexes(self):
+        """Create any missing indexes on existing tables"""
+        for table_name in self.UPSERT_KEYS:
+            if table_name in self.lang_db.tables:
+                self._ensure_indexes(table_name)
+
+    def backfill_signatures(self):
+        """Fill in the signature of any alias row that lacks one, or whose
+        signature is out of date after a change to the naming rules
+
+        :return: the number of rows updated
+        :rtype: int
+        """
+        table = self.lang_db[self.ALIAS_TABLE]
+        if "signature" not in table.columns:
+            table.create_column("signature", sqlalchemy.UnicodeText)
+        self._ensure_indexes(self.ALIAS_TABLE)
+        self._get_generation_table()
+        rows = list(table.all())
+        updates = [
+            {"key_id": row["id"], "value_signature": signature}
+            for row, signature in zip(rows, naming_helper.NamingHelper
+                                      .signatures([r["name"] for r in rows]))
+            if row["signature"] != signature]
+        if updates:
+            stmt = table.table.update() \
+                .where(table.table.c.id == sqlalchemy.bindparam("key_id")) \
+                .values(signature=sqlalchemy.bindparam("value_signature"))
+            self.lang_db.begin()
+            try:
+                self.lang_db.executable.execute(stmt, updates)
+                generations = self._increment_generations(
+                    [self.ALIAS_TABLE])
+                self.lang_db.commit()
+            except:
+                self.lang_db.rollback()
+                raise
+            self._record_own_generations(generations)
+        logging.info("Backfilled signatures for %s of %s aliases",
+                     len(updates), len(rows))
+        return len(updates)
+
+    def _bulk_upsert(self, table_name, rows):
+        """Insert or update rows with one statement per kind of write
+
+        Existing rows are read in a single query and only rows whose
+        values differ are updated.
+
+        :return: (inserted count, updated count)
+        """
+        keys = self.UPSERT_KEYS[table_name]
+        table = self.lang_db[table_name].table
+        existing = self._existing_rows(table_name)
+        inserts = []
+        updates = collections.defaultdict(list)
+        for row in rows:
+            key = tuple(row[k] for k in keys)
+            current = existing.get(key)
+            if current is None:
+                inserts.append(row)
+                existing[key] = dict(row)
+            elif any(current.get(c) != v for c, v in row.iteritems()):
+                updates[tuple(sorted(row.keys()))].append(row)
+                current.update(row)
+
+        if inserts:
+            columns = sorted(set(itertools.chain(*inserts)))
+            # Stay under sqlite's limit of 999 bound parameters
+            chunk_size = max(1, 900 // len(columns))
+            for i in range(0, len(inserts), chunk_size):
+                self.lang_db.executable.execute(table.insert().values(
+                    [dict((c, row.get(c)) for c in columns)
+                     for row in inserts[i:i + chunk_size]]))
+
+        for columns, update_rows in updates.iteritems():
+            value_columns = [c for c in columns if c not in keys]
+            stmt = table.update() \
+                .where(sqlalchemy.and_(
+                    *[table.c[k] == sqlalchemy.bindparam("key_" + k)
+                      for k in keys])) \
+                .values(dict((c, sqlalchemy.bindparam("value_" + c))
+                             for c in value_columns))
+            self.lang_db.executable.execute(stmt, [
+                dict([("key_" + k, row[k]) for k in keys] +
+                     [("value_" + c, row[c]) for c in value_columns])
+                for row in update_rows])
+
+        updated = sum(len(u) for u in updates.itervalues())
+        instrumentation.count("rows_written", len(inserts) + updated)
+        self._record_changed_isos(table_name, "inserted", inserts)
+        self._record_changed_isos(table_name, "updated",
+                                  itertools.chain(*updates.itervalues()))
+        return len(inserts), updated
+
+    def _record_changed_isos(self, table_name, change, rows):
+        iso_column = self.ISO_COLUMNS.get(table_name, "iso")
+        # Rows without an ISO, such as load state, aren't of a language
+        isos = set(row[iso_column] for row in rows if iso_column in row)
+        if isos:
+            self._changed_isos[table_name][change].update(isos)
+
+    def take_changed_isos(self):
+        """ISOs of the rows our own writes have inserted or updated since
+        this was last called, per table and then kind of change
+
+        :rtype: dict
+        """
+        changed = dict(
+            (table_name, dict((change, sorted(isos))
+                              for change, isos in changes.iteritems()))
+            for table_name, changes in self._changed_isos.iteritems())
+        self._changed_isos.clear()
+        return changed
+
+    def _existing_rows(self, table_name):
+        """Every row of a table, keyed on its UPSERT_KEYS. Kept up to date
+        by _bulk_upsert's writes"""
+        keys = self.UPSERT_KEYS[table_name]
+        return dict((tuple(row[k] for k in keys), row) for row in
+                    self.lang_db[table_name].all())
+
+    def _get_generation_table(self):
+        table = self.lang_db[self.GENERATION_TABLE]
+        if "table_name" not in table.columns:
+            table.create_column("table_name", sqlalchemy.UnicodeText)
+            table.create_column("generation", sqlalchemy.Integer)
+        return table
+
+    def _read_generations(self):
+        """All table generations, in a single query"""
+        if self.GENERATION_TABLE not in self.lang_db.tables:
+            return {}
+        return dict((row["table_name"], row["generation"]) for row in
+                    self.lang_db[self.GENERATION_TABLE].all())
+
+    def _increment_generations(self, table_names):
+        """Increment the persisted generation of each table
+
+        Runs on the current connection, so takes part in any transaction.
+
+        :return: the new generation of each table
+        :rtype: dict
+        """
+        table = self._get_generation_table().table
+        generations = {}
+        for table_name in table_names:
+            rp = self.lang_db.executable.execute(
+                table.update()
+                .where(table.c.table_name == table_name)
+                .values(generation=table.c.generation + 1))
+            if rp.rowcount == 0:
+                self.lang_db.executable.execute(
+                    table.insert().values(table_name=table_name,
+                                          generation=1))
+            generations[table_name] = self.lang_db.executable.execute(
+                sqlalchemy.select([table.c.generation])
+                .where(table.c.table_name == table_name)).scalar()
+        return generations
+
+    def get_table_generations(self):
+        """The generation of each table, keyed on table name. A table's
+        generation only changes when a write changes its contents"""
+        return self._read_generations()
+
+    def _record_own_generations(self, generations):
+        """Our own writes make the caches for those tables stale, but
+        shouldn't be mistaken for writes from another process"""
+        self._invalidate_caches(generations.keys())
+        self._seen_generations.update(generations)
+
+    def _bump_generations(self, table_names):
+        self._record_own_generations(
+            self._increment_generations(table_names))
+
+    def _invalidate_caches(self, table_names):
+        for cache_name, cache_tables in self.CACHE_TABLES.iteritems():
+            if set(cache_tables).intersection(table_names):
+                self._caches.pop(cache_name, None)
+
+    def _update_signature_index(self, signature_index, alias_rows):
+        """Extend the signature index with our own alias writes, rather
+        than have them invalidate it"""
+        if signature_index is not None:
+            for row in alias_rows:
+                signature_index.add(row["iso"], row["name"],
+                                    row.get("signature"))
+            self._caches["signature_index"] = signature_index
+
+    def _get_cached(self, cache_name, builder):
+        if cache_name not in self._caches:
+            self._caches[cache_name] = builder()
+        return self._caches[cache_name]
+
+    def _changed_tables(self):
+        """Names of tables written by another process since last checked,
+        reconnecting first if the db has been replaced"""
+        replaced = self._db_file_id() != self._seen_db_file_id
+        if replaced:
+            # An open sqlite connection keeps reading the file it opened
+            logging.info("Reconnecting to replaced db file")
+            self._connect()
+        generations = self._read_generations()
+        if not replaced and \
+                generations.get(self.GENERATION_TABLE) != \
+                self._seen_generations.get(self.GENERATION_TABLE):
+            # Replaced in place, e.g. by renaming postgres schemas, so
+            #  reflect its tables afresh
+            logging.info("Reconnecting to replaced db")
+            self._connect()
+        changed = [table_name for table_name, generation
+                   in generations.iteritems()
+                   if self._seen_generations.get(table_name) != generation]
+        self._seen_generations.update(generations)
+        return changed
+
+    def get_snapshot_write_path(self, path):
+        """Where to write a snapshot of this db, for readers of the
+        snapshot at path. See snapshot.write_snapshot_file"""
+        return path
+
+    def get_data_generation(self):
+        """Identifies the data as of the last check_for_updates, changing
+        whenever a load changes it. Doesn't query the db"""
+        digest = hashlib.sha1()
+        for table_name, generation in sorted(
+                self._seen_generations.iteritems()):
+            # The generation table's own generation only counts swaps
+            if table_name not in self.LOAD_TABLES and \
+                    table_name != self.GENERATION_TABLE:
+                digest.update("%s %s\n" % (table_name, generation))
+        return digest.hexdigest()
+
+    def check_for_updates(self):
+        """Drop caches derived from tables written by another process
+
+        Costs one small query, so is cheap enough to run per request.
+
+        :return: names of tables that have changed since last checked
+        :rtype: list
+        """
+        changed = self._changed_tables()
+        if changed:
+            logging.info("Tables changed by another process: %s", changed)
+            self._invalidate_caches(changed)
+        return changed
+
+    def _all_rows(self, table_name):
+        """Every row of a table, in table order"""
+        return self.lang_db[table_name].all()
 
     def get_external_references_by_iso(self, iso, source):
         """list of external reference tuples by source"""
@@ -153,52 +615,61 @@ class LanguagePersistence(object):
             [row["iso"] for row in
              self.lang_db[self.ALIAS_TABLE].distinct("iso")])))
 
-    @memoized
-    def _do_get_alias_table_contents(self, highest_id):
-        """highest_id will cause cache to be invalid if new rows
-        have been added"""
-        logging.info("Hitting get_alias_table_contents with id: %s",
-                     highest_id)
+    def _build_alias_table_contents(self):
+        logging.info("Hitting get_alias_table_contents with generation: %s",
+                     self._seen_generations.get(self.ALIAS_TABLE))
         return tuple([CacheableAliasRow(
                       row["iso"],
                       row["name"],
                       row["alias_type"],
                       row["source"])
-                      for row in self.lang_db[self.ALIAS_TABLE].all()])
+                      for row in self._all_rows(self.ALIAS_TABLE)])
 
     def get_alias_table_contents(self):
-        return self._do_get_alias_table_contents(self._alias_table_write_id)
+        return self._get_cached("alias_contents",
+                                self._build_alias_table_contents)
 
-    def get_primary_names_by_iso(self, iso):
-        """Return list of primary names from each data source"""
+    def _build_alias_index(self):
+        """Alias rows indexed by iso, then alias type, then source.
+
+        Names keep their alias table order.
+        """
+        index = {}
+        for row in self.get_alias_table_contents():
+            index.setdefault(row.iso, {}) \
+                .setdefault(row.alias_type, {}) \
+                .setdefault(row.source, []) \
+                .append(row.name)
+        return index
+
+    def get_alias_index(self):
+        return self._get_cached("alias_index", self._build_alias_index)
+
+    def _get_names_by_iso(self, iso, alias_type):
+        """Return a copy of the source -> names dict for one alias type"""
         d = collections.defaultdict(list)
-        [d[row.source].append(row.name) for
-         row in self.get_alias_table_contents() if
-         row.iso == iso and
-         row.alias_type == self.PRIMARY_NAME_TYPE
-         ]
+        for source, names in \
+                self.get_alias_index().get(iso, {}).get(alias_type, {}) \
+                .iteritems():
+            d[source] = list(names)
         return d
 
+    def get_primary_names_by_iso(self, iso):
+        """Return list of primary names from each data source"""
+        return self._get_names_by_iso(iso, self.PRIMARY_NAME_TYPE)
+
     def get_alternate_names_by_iso(self, iso):
         """Return list of alternate names from each data source"""
-        alternate_list = [row for row in self.get_alias_table_contents() if
-                          row.iso == iso and
-                          row.alias_type == self.ALTERNATE_NAME_TYPE]
-        d = collections.defaultdict(list)
-        for row in alternate_list:
-            d[row.source].append(row.name)
-            d[row.source].sort()
+        d = self._get_names_by_iso(iso, self.ALTERNATE_NAME_TYPE)
+        for names in d.itervalues():
+            names.sort()
         return d
 
     def get_dialect_names_by_iso(self, iso):
         """Return list of dialect names from each data source"""
-        dialect_list = [row for row in self.get_alias_table_contents() if
-                        row.iso == iso and
-                        row.alias_type == self.DIALECT_TYPE]
-        d = collections.defaultdict(list)
-        for row in dialect_list:
-            d[row.source].append(row.name)
-            d[row.source].sort()
+        d = self._get_names_by_iso(iso, self.DIALECT_TYPE)
+        for names in d.itervalues():
+            names.sort()
         return d
 
     def get_classifications_by_iso(self, iso):
@@ -223,7 +694,11 @@ class LanguagePersistence(object):
              self.lang_db[self.RELATIONSHIP_TABLE].find(subject_iso=iso)])
 
     def get_english_competency_by_iso(self, iso):
-        iso_row = self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso)
+        return self._english_competency_from_row(
+            self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso))
+
+    @staticmethod
+    def _english_competency_from_row(iso_row):
         if iso_row \
                 and "english_competency_pess" in iso_row \
                 and "english_competency_optim" in iso_row:
@@ -234,11 +709,12 @@ class LanguagePersistence(object):
                 constants.ENGLISH_COMPETENCY_UNKNOWN_OPTIMISTIC
 
     def get_primary_name_for_display(self, iso):
+        # Last name wins where a source has several, as per the table scan
+        #  this replaced
         primary_names = dict(
-            [(row.source, row.name) for
-             row in self.get_alias_table_contents() if
-             row.iso == iso and
-             row.alias_type == self.PRIMARY_NAME_TYPE
+            [(source, names[-1]) for source, names in
+             self.get_alias_index().get(iso, {})
+             .get(self.PRIMARY_NAME_TYPE, {}).iteritems()
              ])
         # Try Joshua Project, then AUSTLANG, then WALS, then Tindale
         return primary_names.get(
@@ -260,17 +736,17 @@ class LanguagePersistence(object):
             yield [iso for iso, lang_name in grouper]
 
     def get_L1_speaker_count_by_iso(self, iso, source):
-        if source not in self.l1_speaker_count_cache:
-            self.l1_speaker_count_cache[source] = {}
-            all_rows = self.lang_db[self.LANGUAGE_TABLE].all()
-            for row in all_rows:
+        l1_speaker_count_cache = self._get_cached("l1_speaker_count", dict)
+        if source not in l1_speaker_count_cache:
+            l1_speaker_count_cache[source] = {}
+            for row in self._all_rows(self.LANGUAGE_TABLE):
                 if row['L1_speaker_count_%s' % (source,)] is None:
                     c = constants.SPEAKER_COUNT_UNKNOWN
                 else:
                     c = int(row['L1_speaker_count_%s' % (source,)])
-                self.l1_speaker_count_cache[source][row["iso"]] = c
+                l1_speaker_count_cache[source][row["iso"]] = c
 
-        return self.l1_speaker_count_cache[source].get(
+        return l1_speaker_count_cache[source].get(
             iso, constants.SPEAKER_COUNT_UNKNOWN)
 
     def get_common_names_for_iso_list(self, iso_list):
@@ -312,15 +788,29 @@ class LanguagePersistence(object):
             iso_group_set.add(tuple(sorted(unsorted_group_list)))
         return list(iso_group_set)
 
+    def _build_signature_index(self):
+        table = self.lang_db[self.ALIAS_TABLE]
+        if "signature" not in table.columns:
+            # Not backfilled yet
+            return naming_helper.SignatureIndex(
+                self.get_alias_table_contents())
+        # Read, rather than compute, signatures
+        return naming_helper.SignatureIndex.from_signatures(
+            self.lang_db.executable.execute(sqlalchemy.select(
+                [table.table.c.iso, table.table.c.name,
+                 table.table.c.signature]).distinct()))
+
+    def get_signature_index(self):
+        return self._get_cached("signature_index",
+                                self._build_signature_index)
+
     def get_iso_list_from_name(self, name):
+        signature_index = self.get_signature_index()
         # exact match on name only
-        db_exact_match_list = list(set([row.iso for row in
-                                       self.get_alias_table_contents()
-                                       if row.name == name]))
+        db_exact_match_list = list(signature_index.get_isos_for_name(name))
         # Compare signatures
-        sig_match_list = \
-            list(self.naming_helper.get_matching_iso_list_from_name(
-                 name, self.get_alias_table_contents()))
+        sig_match_list = list(
+            signature_index.get_isos_for_signature_of(name))
         if db_exact_match_list != sig_match_list:
             if db_exact_match_list:
                 logging.info("%s matches differ: %s (exact db) %s (sig) "
@@ -340,6 +830,26 @@ class LanguagePersistence(object):
             # sig and exact are identical... just pick one
             return sig_match_list
 
+    def find_isos_fuzzy(self, name, max_distance=2):
+        """Isos with a name whose signature is within max_distance edits of
+        the signature of name
+
+        :return: (iso, distance) tuples, closest first
+        :rtype: list
+        """
+        return self.get_signature_index().find_isos_fuzzy(name, max_distance)
+
+    def is_known_iso(self, iso):
+        """Whether any language, alias or relationship row is of iso"""
+        return any(
+            self.lang_db[table_name].find_one(**{column: iso}) is not None
+            for table_name, column in [
+                (self.ALIAS_TABLE, "iso"),
+                (self.LANGUAGE_TABLE, "iso"),
+                (self.RELATIONSHIP_TABLE, "subject_iso"),
+                (self.RELATIONSHIP_TABLE, "object_iso")]
+            if table_name in self.lang_db.tables)
+
     def get_iso_list_from_iso(self, iso):
         # probably redundant, but just in case we want to search on partial iso
         # partial match is ok
@@ -348,7 +858,11 @@ class LanguagePersistence(object):
                 distinct("iso", iso=iso)]
 
     def get_lat_lon_from_iso(self, iso):
-        iso_row = self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso)
+        return self._lat_lon_from_row(
+            self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso))
+
+    @staticmethod
+    def _lat_lon_from_row(iso_row):
         if iso_row:
             if iso_row["latitude"] is None or iso_row["longitude"] is None:
                 return constants.LATITUDE_UNKNOWN, constants.LONGITUDE_UNKNOWN
@@ -358,7 +872,11 @@ class LanguagePersistence(object):
             return constants.LATITUDE_UNKNOWN, constants.LONGITUDE_UNKNOWN
 
     def get_tindale_lat_lon_from_iso(self, iso):
-        iso_row = self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso)
+        return self._tindale_lat_lon_from_row(
+            self.lang_db[self.LANGUAGE_TABLE].find_one(iso=iso))
+
+    @staticmethod
+    def _tindale_lat_lon_from_row(iso_row):
         if iso_row and \
                 "tindale_latitude" in iso_row and \
                 "tindale_longitude" in iso_row:
@@ -388,18 +906,18 @@ class LanguagePersistence(object):
         return: best translation state associated with the iso in all sources
         :rtype: int
         """
-        # If we have any cached state, assume it's complete. Populate if not
-        if not self.translation_state_cache:
-            sql = """
-            SELECT "iso", max("status") ms from "%s"
-            GROUP BY "iso"
-             """ % (self.TRANSLATION_TABLE,)
-            for row in self.lang_db.query(sql):
-                self.translation_state_cache[row['iso']] = int(row['ms'])
-
-        return self.translation_state_cache.get(
+        return self._get_cached(
+            "translation_state", self._build_translation_state_cache).get(
             iso, constants.TRANSLATION_STATE_NO_RECORD)
 
+    def _build_translation_state_cache(self):
+        sql = """
+        SELECT "iso", max("status") ms from "%s"
+        GROUP BY "iso"
+         """ % (self.TRANSLATION_TABLE,)
+        return dict((row['iso'], int(row['ms']))
+                    for row in self.lang_db.query(sql))
+
     def get_reversible_relationships(self):
         """Relationships expressed in terms of a -> b that also infer b -> a
         only interested in relationships from primary source i.e. those that
@@ -472,24 +990,25 @@ class LanguagePersistence(object):
             cnc == constants.SPEAKER_COUNT_UNKNOWN
 
     def iso_is_retired(self, iso):
-        if not self.retirement_state_cache:
-            # dataset.Table.distinct can't handle filters with lists
-            #  i.e. "in" even though dataset.Table.filter can
-            sql = """
-            select distinct "subject_iso" from "%s" where
-            "rel_verb" in %s
-            """ % (self.RELATIONSHIP_TABLE, tuple([
-                constants.RELTYPE_RETIREMENT_CHANGE,
-                constants.RELTYPE_RETIREMENT_DUPLICATE,
-                constants.RELTYPE_RETIREMENT_NON_EXISTENT,
-                constants.RELTYPE_RETIREMENT_SPLIT_INTO,
-                constants.RELTYPE_RETIREMENT_MERGED_INTO])
-            )
-            all_retirements = self.lang_db.query(sql)
-            for row in all_retirements:
-                self.retirement_state_cache[row['subject_iso']] = True
-
-        return self.retirement_state_cache.get(iso, False)
+        return self._get_cached(
+            "retirement_state", self._build_retirement_state_cache).get(
+            iso, False)
+
+    def _build_retirement_state_cache(self):
+        # dataset.Table.distinct can't handle filters with lists
+        #  i.e. "in" even though dataset.Table.filter can
+        sql = """
+        select distinct "subject_iso" from "%s" where
+        "rel_verb" in %s
+        """ % (self.RELATIONSHIP_TABLE, tuple([
+            constants.RELTYPE_RETIREMENT_CHANGE,
+            constants.RELTYPE_RETIREMENT_DUPLICATE,
+            constants.RELTYPE_RETIREMENT_NON_EXISTENT,
+            constants.RELTYPE_RETIREMENT_SPLIT_INTO,
+            constants.RELTYPE_RETIREMENT_MERGED_INTO])
+        )
+        return dict((row['subject_iso'], True)
+                    for row in self.lang_db.query(sql))
 
     def get_css_class_for_iso(self, iso):
         scripture_css_class = constants.translation_abbrev_css_class_dict[
@@ -543,6 +1062,10 @@ class LanguagePersistence(object):
         ecp, _ = self.get_english_competency_by_iso(iso)
         census_speaker_count = self.get_L1_speaker_count_by_iso(
             iso, constants.AUS_CENSUS_2011_ABBREV)
+        return self._cannot_read_english_count(ecp, census_speaker_count)
+
+    @staticmethod
+    def _cannot_read_english_count(ecp, census_speaker_count):
         # We can only construct the cannot_read_english_count value if we have
         #  values for speaker count and english language competency.
         #  All constants that signify non-values are negative
@@ -555,85 +1078,176 @@ class LanguagePersistence(object):
         else:
             return int(round((1 - (ecp / 100.0)) * census_speaker_count))
 
-    def get_map_data(self):
-        """All the data required to plot and label a point on the map
-        but only for isos that have lat-lon data
+    @staticmethod
+    def _map_lat_lon(row):
+        # Take Tindale, then fall back to WALS
+        # Just check lon - we update in pairs so if it's null
+        #  then latitude will be too
+        if row.get("tindale_longitude"):
+            return row["tindale_latitude"], row["tindale_longitude"]
+        elif row.get("longitude"):
+            return row["latitude"], row["longitude"]
+        else:
+            return None, None
 
-        returns a lists of tuples, each is (iso, lat, lon)
-        """
-        EXCLUDED_ISOS = [
-            "dze",  # was split - no map or bible data
-        ]
-        map_data = []
-        rows = [r for r in self.lang_db[self.LANGUAGE_TABLE].all()
-                if r["iso"] not in EXCLUDED_ISOS]
-        for row in rows:
-            # Take Tindale, then fall back to WALS
-            # Just check lon - we update in pairs so if it's null
-            #  then latitude will be too
-            if row["tindale_longitude"]:
-                lat = row["tindale_latitude"]
-                lon = row["tindale_longitude"]
-            elif row["longitude"]:
-                lat = row["latitude"]
-                lon = row["longitude"]
+    @staticmethod
+    def _map_speaker_count(row):
+        # Take Census, then fall back to JP
+        census_sc = row.get("L1_speaker_count_CN")
+        jp_sc = row.get("L1_speaker_count_JP")
+        if census_sc:
+            if census_sc >= 0:
+                speaker_count = census_sc
+            if jp_sc:
+                speaker_count = jp_sc
             else:
-                # For the sake of the javascript consumer i.e. don't use None
-                lat = "null"
-                lon = "null"
-
-            # Take Census, then fall back to JP
-            census_sc = row["L1_speaker_count_CN"]
-            jp_sc = row["L1_speaker_count_JP"]
-            if census_sc:
-                if census_sc >= 0:
-                    speaker_count = census_sc
-                if jp_sc:
-                    speaker_count = jp_sc
-                else:
-                    # Will fall back to negative number, but that's ok
-                    speaker_count = census_sc
+                # Will fall back to negative number, but that's ok
+                speaker_count = census_sc
+        else:
+            if jp_sc:
+                speaker_count = jp_sc
             else:
-                if jp_sc:
-                    speaker_count = jp_sc
-                else:
-                    # No jp_sc, fall back to census, whatever it was
-                    speaker_count = constants.SPEAKER_COUNT_UNKNOWN
+                # No jp_sc, fall back to census, whatever it was
+                speaker_count = constants.SPEAKER_COUNT_UNKNOWN
+        return speaker_count
 
-            map_data.append((row["iso"],
-                             lat,
-                             lon,
-                             speaker_count,
-                             self.get_css_class_for_iso(row["iso"]),
-                             self.get_primary_name_for_display(row["iso"])))
-        return sorted(map_data, key=lambda x: x[0])
+    def compute_language_summary(self):
+        """Everything the table and map pages show for each language
 
-    def get_table_data(self):
-        table_data = []
-        all_isos = self.get_all_iso_codes()
-        for iso in all_isos:
+        Reads each table once rather than once per iso.
+
+        :return: summary rows sorted by iso
+        :rtype: list of LanguageSummaryRow
+        """
+        language_rows = dict(
+            (row["iso"], row) for row in
+            self._all_rows(self.LANGUAGE_TABLE))
+        relationships = collections.defaultdict(list)
+        for r_row in self._all_rows(self.RELATIONSHIP_TABLE):
+            relationships[r_row["subject_iso"]].append(
+                (r_row["source"], r_row["rel_verb"], r_row["object_iso"]))
+        alias_isos = set(self.get_all_iso_codes())
+
+        summary = []
+        for iso in sorted(alias_isos.union(language_rows)):
+            row = language_rows.get(iso, {})
             # Only interested in relationships where the other lang has a
             #  translation
             relations = [[src, rel_type, obj_iso] for
                          src, rel_type, obj_iso in
-                         self.get_relationships_by_iso(iso)
+                         sorted(relationships[iso])
                          if self.get_best_translation_state(obj_iso) > 1]
-            # This is a percentage as an int
-            ecp, _ = self.get_english_competency_by_iso(iso)
+            ecp, _ = self._english_competency_from_row(row or None)
             census_speaker_count = self.get_L1_speaker_count_by_iso(
                 iso, constants.AUS_CENSUS_2011_ABBREV)
-            cannot_read_english_count = self.get_cannot_read_english_count(iso)
-            iso_data = (iso,
-                        self.get_L1_speaker_count_by_iso(
-                            iso, constants.JOSHUA_PROJECT_SOURCE_ABBREV),
-                        census_speaker_count,
-                        self.get_best_translation_state(iso),
-                        ecp,
-                        cannot_read_english_count,
-                        relations
-                        )
-            table_data.append(iso_data)
-        return table_data
+            cannot_read_english_count = self._cannot_read_english_count(
+                ecp, census_speaker_count)
+            lat, lon = self._map_lat_lon(row)
+            summary.append(LanguageSummaryRow(
+                iso=iso,
+                display_name=self.get_primary_name_for_display(iso),
+                best_translation_state=self.get_best_translation_state(iso),
+                is_retired=self.iso_is_retired(iso),
+                css_class=self.get_css_class_for_iso(iso),
+                has_alias=iso in alias_isos,
+                has_language_row=iso in language_rows,
+                latitude=lat,
+                longitude=lon,
+                speaker_count=self._map_speaker_count(row),
+                jp_speaker_count=self.get_L1_speaker_count_by_iso(
+                    iso, constants.JOSHUA_PROJECT_SOURCE_ABBREV),
+                census_speaker_count=census_speaker_count,
+                english_competency_pess=ecp,
+                cannot_read_english_count=cannot_read_english_count,
+                translated_relations=relations,
+            ))
+        return summary
+
+    def refresh_language_summary(self):
+        """Recompute the language summary table. Run after each load."""
+        summary = self.compute_language_summary()
+        table = self.lang_db[self.LANGUAGE_SUMMARY_TABLE]
+        for column, column_type in self.LANGUAGE_SUMMARY_COLUMN_TYPES:
+            if column not in table.columns:
+                table.create_column(column, column_type)
+        self._get_generation_table()
+        rows = [dict(s._asdict(),
+                     translated_relations=json.dumps(s.translated_relations),
+                     cannot_read_english_count=None
+                     if s.cannot_read_english_count == "Unknown"
+                     else s.cannot_read_english_count)
+                for s in summary]
+        self.lang_db.begin()
+        try:
+            table.delete()
+            # Stay under sqlite's limit of 999 bound parameters
+            chunk_size = 900 // len(LanguageSummaryRow._fields)
+            for i in range(0, len(rows), chunk_size):
+                self.lang_db.executable.execute(
+                    table.table.insert().values(rows[i:i + chunk_size]))
+            instrumentation.count("rows_written", len(rows))
+            generations = self._increment_generations(
+                [self.LANGUAGE_SUMMARY_TABLE])
+            self.lang_db.commit()
+        except:
+            self.lang_db.rollback()
+            raise
+        logging.info("Refreshed language summary for %s ISOs", len(rows))
+        self._record_own_generations(generations)
+        self._caches["language_summary"] = summary
+
+    def get_language_summary(self):
+        """Summary rows from the language summary table in a single query,
+        computing them if the table hasn't been populated
+        """
+        return self._get_cached("language_summary",
+                                self._build_language_summary_cache)
+
+    def _build_language_summary_cache(self):
+        summary = []
+        if self.LANGUAGE_SUMMARY_TABLE in self.lang_db.tables:
+            summary = [
+                LanguageSummaryRow(**dict(
+                    [(f, row[f]) for f in LanguageSummaryRow._fields],
+                    translated_relations=json.loads(
+                        row["translated_relations"]),
+                    cannot_read_english_count="Unknown"
+                    if row["cannot_read_english_count"] is None
+                    else row["cannot_read_english_count"]))
+                for row in self.lang_db[self.LANGUAGE_SUMMARY_TABLE]
+                .find(order_by=["iso"])]
+        if not summary:
+            logging.warning("Language summary table is empty. "
+                            "Computing summary instead.")
+            summary = self.compute_language_summary()
+        return summary
+
+    def get_map_data(self):
+        """All the data required to plot and label a point on the map
+        but only for isos that have lat-lon data
+
+        returns a lists of tuples, each is
+        (iso, lat, lon, speaker count, css class, display name)
+        """
+        # For the sake of the javascript consumer i.e. don't use None
+        return [(s.iso,
+                 "null" if s.latitude is None else s.latitude,
+                 "null" if s.longitude is None else s.longitude,
+                 s.speaker_count,
+                 s.css_class,
+                 s.display_name)
+                for s in self.get_language_summary()
+                if s.has_language_row and s.iso not in self.MAP_EXCLUDED_ISOS]
+
+    def get_table_data(self):
+        return [(s.iso,
+                 s.jp_speaker_count,
+                 s.census_speaker_count,
+                 s.best_translation_state,
+                 s.english_competency_pess,
+                 s.cannot_read_english_count,
+                 s.translated_relations)
+                for s in self.get_language_summary() if s.has_alias]
 
     def get_search_table_data(self):
         table_data = []
@@ -647,3 +1261,28 @@ class LanguagePersistence(object):
                 *self.get_dialect_names_by_iso(iso).values()))
             table_data.append((iso, ", ".join(name_set)))
         return table_data
+
+    def get_rows_by_key(self, table_name):
+        """Every row of a table in a single query, keyed on a tuple of its
+        UPSERT_KEYS values. Empty if the table doesn't exist"""
+        if table_name not in self.lang_db.tables:
+            return {}
+        return self._existing_rows(table_name)
+
+    def get_load_state(self):
+        """What each loader stage last ran on, keyed on stage name"""
+        if self.LOAD_STATE_TABLE not in self.lang_db.tables:
+            return {}
+        return dict((row["stage"], json.loads(row["state"])) for row in
+                    self._all_rows(self.LOAD_STATE_TABLE))
+
+    def get_load_runs(self, limit=None):
+        """Reports of past loads, most recent first"""
+        if self.LOAD_RUN_TABLE not in self.lang_db.tables:
+            return []
+        table = self.lang_db[self.LOAD_RUN_TABLE].table
+        return [json.loads(row.report,
+                           object_pairs_hook=collections.OrderedDict)
+                for row in self.lang_db.executable.execute(
+                    sqlalchemy.select([table.c.report])
+                    .order_by(table.c.started.desc()).limit(limit))]
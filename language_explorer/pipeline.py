@@ -0,0 +1,350 @@
+import contextlib
+import json
+import logging
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+from language_explorer import instrumentation
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class Stage(object):
+    """One step of a load, and what it needs before it can run
+
+    :param name: unique name, used by other stages' requires
+    :param run: called as run(persister, results), or as
+     run(persister, results, chunk) for each chunk if split is given.
+     results maps the names of earlier stages to what they returned
+    :param requires: names of stages whose writes must be in the db, and
+     whose results must be available, before this stage runs
+    :param inputs: tables and external sources the stage reads
+    :param outputs: tables the stage writes
+    :param split: called as split(results) to divide the stage's work into
+     chunks that can run concurrently. The stage's result is then the list
+     of each chunk's result
+    :param direct: run on the main thread against the real persister,
+     rather than on the pool with writes recorded. For stages that read
+     their own writes
+    :param incremental: each chunk is a list of items, and what the stage
+     writes for an item depends only on the item and the stage's inputs.
+     If only the stages it requires have changed since the last load, the
+     stage runs on just the items it hasn't seen before
+    """
+    def __init__(self, name, run, requires=(), inputs=(), outputs=(),
+                 split=None, direct=False, incremental=False):
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.split = split
+        self.direct = direct
+        self.incremental = incremental
+
+    def __repr__(self):
+        return "Stage(%r)" % (self.name,)
+
+
+class RecordingPersister(object):
+    """Stands in for a LanguagePersistence, recording persist_* calls so
+    they can be replayed later and passing everything else through.
+
+    Like a batch, reads don't see the recorded writes.
+    """
+    def __init__(self, persister):
+        self._persister = persister
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("persist_"):
+            def record(*args, **kwargs):
+                # Counted against the stage when replayed
+                instrumentation.count("persisted", kind="sources")
+                self.calls.append((name, args, kwargs))
+            return record
+        return getattr(self._persister, name)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Writes are already deferred until replay
+        yield
+
+    def replay(self, persister):
+        for name, args, kwargs in self.calls:
+            getattr(persister, name)(*args, **kwargs)
+
+
+def check_stages(stages):
+    """Raise ValueError unless each stage only requires stages declared
+    before it"""
+    seen = set()
+    for stage in stages:
+        if stage.name in seen:
+            raise ValueError("Duplicate stage %s" % (stage.name,))
+        unknown = set(stage.requires).difference(seen)
+        if unknown:
+            raise ValueError("Stage %s requires %s, which are not declared "
+                             "before it" % (stage.name, sorted(unknown)))
+        seen.add(stage.name)
+
+
+def _all_chunks(stage, results):
+    return [None] if stage.split is None else stage.split(results)
+
+
+class LoadState(object):
+    """Decides which stages need to run, from what they last ran on
+
+    A stage's recorded state holds a fingerprint of each of its inputs and
+    a token for each stage it requires. A stage's token changes whenever a
+    run of it changes the db or its result, or it runs because a token it
+    requires changed. A change therefore reaches every stage that depends
+    on it, even through stages that pass it on without writing anything.
+    A stage whose inputs and required tokens are unchanged would do
+    nothing new, and can be skipped.
+
+    A split stage is also checkpointed as each of its chunks is written,
+    so that a load that fails part way through one continues from the
+    last chunk written. See checkpoint.
+    """
+    def __init__(self, persister, fingerprints, force=False):
+        self.persister = persister
+        self.fingerprints = fingerprints
+        self.force = force
+        self.previous = persister.get_load_state()
+        # Each input is fingerprinted at most once per load
+        self._input_fingerprints = {}
+        self._tokens = {}
+        # (state so far, items done, chunk results so far) per planned
+        #  stage
+        self._planned = {}
+
+    def _fingerprint_inputs(self, stage):
+        inputs = {}
+        for name in stage.inputs:
+            if name in self.fingerprints:
+                if name not in self._input_fingerprints:
+                    self._input_fingerprints[name] = self.fingerprints[name]()
+                inputs[name] = self._input_fingerprints[name]
+        return inputs
+
+    def plan(self, stage, results):
+        """The chunks that the stage needs to run, or None to skip it, in
+        which case its recorded result is put in results
+
+        Call once the stages it requires are complete.
+        """
+        previous = self.previous.get(stage.name)
+        state = {
+            "inputs": self._fingerprint_inputs(stage),
+            "requires": dict((name, self._tokens[name])
+                             for name in stage.requires),
+        }
+        done = set()
+        values = []
+        if not self.force and previous is not None and \
+                previous["inputs"] == state["inputs"]:
+            same_requires = previous["requires"] == state["requires"]
+            if previous.get("partial"):
+                if same_requires or stage.incremental:
+                    # Continue from the last checkpoint
+                    done.update(previous["items"])
+                    values.extend(previous["result"])
+                    logging.info("Resuming stage %s after %s items",
+                                 stage.name, len(done))
+            elif same_requires:
+                logging.info("Skipping stage %s, unchanged since the last "
+                             "load", stage.name)
+                results[stage.name] = previous["result"]
+                self._tokens[stage.name] = previous["token"]
+                return None
+            elif stage.incremental:
+                done.update(previous.get("items", []))
+        self._planned[stage.name] = (state, done, values)
+        chunks = _all_chunks(stage, results)
+        if done:
+            chunks = [c for c in ([item for item in chunk if item not in done]
+                                  for chunk in chunks) if c]
+            logging.info("Stage %s has %s new items", stage.name,
+                         sum(len(chunk) for chunk in chunks))
+        return chunks
+
+    def checkpoint(self, stage, chunk, value):
+        """Record that a chunk of a split stage has been written, along
+        with the writes if called within the same batch"""
+        state, done, values = self._planned[stage.name]
+        done.update(chunk)
+        values.append(value)
+        partial = dict(state, partial=True, items=sorted(done),
+                       result=values)
+        self.persister.persist_load_state(stage.name, partial)
+
+    def _data_generations(self, generations):
+        # Checkpoints don't count as changes to the db
+        return dict((table_name, generation) for table_name, generation
+                    in generations.iteritems()
+                    if table_name != self.persister.LOAD_STATE_TABLE)
+
+    def record(self, stage, result, generations):
+        """Record the state of a stage that has run
+
+        :param generations: table generations from before the stage's
+         writes
+        :return: the stage's result, including that of chunks written
+         before it was resumed
+        """
+        state, done, values = self._planned.pop(stage.name)
+        previous = self.previous.get(stage.name)
+        if stage.split is not None:
+            result = values
+            if stage.incremental:
+                state["items"] = sorted(done)
+        # As it will be when read back
+        state["result"] = json.loads(json.dumps(result))
+        changed = self._data_generations(
+            self.persister.get_table_generations()) != \
+            self._data_generations(generations) or \
+            (previous is not None and
+             state["requires"] != previous["requires"]) or \
+            (stage.split is None and previous is not None and
+             state["result"] != previous["result"])
+        if previous is None or changed or previous.get("partial"):
+            state["token"] = uuid.uuid4().hex
+        else:
+            state["token"] = previous["token"]
+        self._tokens[stage.name] = state["token"]
+        self.persister.persist_load_state(stage.name, state)
+        return state["result"]
+
+
+def _run_recorded(stage, persister, results, chunk):
+    recorder = RecordingPersister(persister)
+    start = time.time()
+    with instrumentation.measure_stage(stage.name):
+        if stage.split is None:
+            value = stage.run(recorder, results)
+        else:
+            value = stage.run(recorder, results, chunk)
+    return recorder, value, time.time() - start
+
+
+def run_stages(stages, persister, pool_size=8, fingerprints=None,
+               force=False):
+    """Run stages, each as soon as the stages it requires are complete
+
+    Stages that aren't direct run concurrently on a thread pool and their
+    writes are recorded. The recorded writes are replayed on the calling
+    thread, a batch per chunk, in the order that the stages are declared.
+    The database therefore ends up exactly as it would if the stages had
+    run one after the other in that order.
+
+    If fingerprints are given, what each stage ran on is recorded in the
+    persister's load state, and stages with nothing new to do are skipped.
+    A split stage's progress is recorded in the batch of each chunk, so a
+    stage that fails part way through is continued from there. See
+    LoadState. Stage results must then be JSON serialisable.
+
+    :param fingerprints: functions returning a fingerprint of an input,
+     such as a file hash, keyed on input name. Inputs without one, such as
+     tables, must be covered by requiring the stages that write them
+    :param force: run every stage, as if there were no load state
+    :return: each stage's result, keyed on stage name
+    :rtype: dict
+    """
+    check_stages(stages)
+    state = None if fingerprints is None \
+        else LoadState(persister, fingerprints, force)
+
+    def plan(stage):
+        if state is None:
+            return _all_chunks(stage, results)
+        return state.plan(stage, results)
+
+    pool = ThreadPool(pool_size)
+    results = {}
+    # (chunk, async result) pairs per started stage
+    started = {}
+    complete = set()
+    skipped = set()
+    pending = list(stages)
+    load_start = time.time()
+    try:
+        while pending:
+            for stage in pending:
+                if stage.direct or stage.name in started or \
+                        stage.name in skipped or \
+                        not complete.issuperset(stage.requires):
+                    continue
+                chunks = plan(stage)
+                if chunks is None:
+                    # Nothing to replay, so later stages needn't wait
+                    instrumentation.stage_skipped(stage.name)
+                    skipped.add(stage.name)
+                    complete.add(stage.name)
+                    continue
+                logging.info("Starting stage %s (%s chunks)",
+                             stage.name, len(chunks))
+                started[stage.name] = [
+                    (chunk, pool.apply_async(
+                        _run_recorded, (stage, persister, results, chunk)))
+                    for chunk in chunks]
+
+            # Every stage before this one is complete, so it can run (if
+            #  direct) or have its writes replayed
+            stage = pending.pop(0)
+            if stage.name in skipped:
+                continue
+            if stage.direct and plan(stage) is None:
+                instrumentation.stage_skipped(stage.name)
+                skipped.add(stage.name)
+                complete.add(stage.name)
+                continue
+            start = time.time()
+            generations = persister.get_table_generations()
+            if stage.direct:
+                with instrumentation.measure_stage(stage.name):
+                    results[stage.name] = stage.run(persister, results)
+                logging.info("Stage %s ran directly in %.1fs",
+                             stage.name, time.time() - start)
+            else:
+                values = []
+                run_time = 0
+                writes = 0
+                for chunk, async_result in started[stage.name]:
+                    # Each chunk is written as soon as it and those before
+                    #  it are done, so that a failure loses as little as
+                    #  possible
+                    recorder, value, elapsed = async_result.get()
+                    with instrumentation.measure_stage(stage.name), \
+                            persister.batch():
+                        recorder.replay(persister)
+                        if state is not None and stage.split is not None:
+                            state.checkpoint(stage, chunk, value)
+                    values.append(value)
+                    run_time += elapsed
+                    writes += len(recorder.calls)
+                results[stage.name] = values[0] if stage.split is None \
+                    else values
+                logging.info("Stage %s ran in %.1fs (summed over chunks), "
+                             "replayed %s writes in %.1fs",
+                             stage.name, run_time, writes,
+                             time.time() - start)
+            if state is not None:
+                results[stage.name] = state.record(
+                    stage, results[stage.name], generations)
+            complete.add(stage.name)
+    finally:
+        pool.terminate()
+    logging.info("Ran %s stages, skipping %s, in %.1fs",
+                 len(stages) - len(skipped), len(skipped),
+                 time.time() - load_start)
+    return results
+
+
+def chunked(items, chunk_size):
+    """Split items into lists of at most chunk_size"""
+    items = list(items)
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
@@ -0,0 +1,221 @@
+"""Caches rendered pages until the data they were rendered from changes.
+
+Pages are keyed on their path and the data generation they were rendered
+at, so a load makes every cached page unreachable without anything
+having to be dropped. Each page is kept both as is and gzipped, and is
+served with a strong ETag, so a client that already has it gets a 304.
+"""
+import collections
+import cPickle
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+from cStringIO import StringIO
+from flask import current_app, make_response, request
+from language_explorer.utils import LRUCache, atomic_write
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+# A rendered page. gzip_body is None if gzipping doesn't make it smaller
+CachedPage = collections.namedtuple(
+    "CachedPage", ["body", "gzip_body", "etag", "content_type"])
+
+
+def gzip_body(body):
+    """body gzipped, the same every time for the same body"""
+    buf = StringIO()
+    # mtime is part of the gzip header
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+def cache_page(response):
+    """A CachedPage of a response"""
+    body = response.get_data()
+    gzipped = gzip_body(body)
+    return CachedPage(body, gzipped if len(gzipped) < len(body) else None,
+                      hashlib.sha1(body).hexdigest(),
+                      response.headers["Content-Type"])
+
+
+def page_response(page):
+    """Respond to the current request with a cached page, gzipped if the
+    client accepts that, or with a 304 if the client already has it"""
+    gzipped = page.gzip_body is not None and \
+        request.accept_encodings["gzip"]
+    # Each encoding is a different representation, so has its own ETag
+    etag = page.etag + ("-gzip" if gzipped else "")
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(
+            page.gzip_body if gzipped else page.body,
+            content_type=page.content_type)
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+class MemoryPageStore(object):
+    """At most maxsize pages, in this process"""
+    def __init__(self, maxsize):
+        self._pages = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._pages.get(key)
+
+    def put(self, key, page):
+        with self._lock:
+            self._pages.put(key, page)
+
+
+class DiskPageStore(object):
+    """At most maxsize pages in a directory, shared by every process
+    serving from it
+
+    Pages of any other generation are deleted when a page of a new one is
+    first stored. Past maxsize, the least recently used pages are deleted.
+    """
+    def __init__(self, root, maxsize):
+        self.root = root
+        self.maxsize = maxsize
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._generation = None
+        # Pages in the directory, as of the last time it was listed, plus
+        #  those we've stored since
+        self._count = len(os.listdir(root))
+
+    def _path(self, key):
+        path, generation = key
+        return os.path.join(self.root, "%s-%s" % (
+            generation, hashlib.sha1(path.encode("utf-8")).hexdigest()))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                page = CachedPage(*cPickle.load(f))
+        except IOError:
+            return None
+        try:
+            # Its mtime is when it was last used. See _remove_least_used
+            os.utime(path, None)
+        except OSError:
+            # Removed by another process
+            pass
+        return page
+
+    def _remove(self, filenames):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self.root, filename))
+            except OSError:
+                # Removed by another process
+                pass
+
+    def _remove_least_used(self):
+        """Bring the directory back down to maxsize pages"""
+        used = []
+        for filename in os.listdir(self.root):
+            try:
+                used.append((os.path.getmtime(
+                    os.path.join(self.root, filename)), filename))
+            except OSError:
+                pass
+        used.sort()
+        excess = max(0, len(used) - self.maxsize)
+        self._remove(filename for _, filename in used[:excess])
+        self._count = len(used) - excess
+
+    def put(self, key, page):
+        _, generation = key
+        if generation != self._generation:
+            self._generation = generation
+            current, old = [], []
+            for filename in os.listdir(self.root):
+                (current if filename.startswith(generation + "-")
+                 else old).append(filename)
+            self._remove(old)
+            self._count = len(current)
+        atomic_write(self._path(key),
+                     cPickle.dumps(tuple(page), cPickle.HIGHEST_PROTOCOL))
+        self._count += 1
+        if self._count > self.maxsize:
+            self._remove_least_used()
+
+
+class ResponseCache(object):
+    """Serves views' pages from stores, rendering them only when the data
+    has changed since they were stored
+
+    :param data_generation: returns an identifier of the data pages are
+     rendered from, which changes whenever the data does
+    :param stores: looked in, in order, for a page. One found in a later
+     store is put in the earlier ones. If empty, pages aren't cached
+    :param check_interval: least seconds between calls of data_generation,
+     so that most requests don't touch the db at all
+    """
+    def __init__(self, data_generation, stores, check_interval=0):
+        self.data_generation = data_generation
+        self.stores = list(stores)
+        self.check_interval = check_interval
+        self.generation = None
+        self._checked = None
+        self._check_lock = threading.Lock()
+
+    def check_generation(self):
+        """Call data_generation, unless it was called within
+        check_interval"""
+        with self._check_lock:
+            now = time.time()
+            if self._checked is None or \
+                    now - self._checked >= self.check_interval:
+                generation = self.data_generation()
+                if generation != self.generation:
+                    logging.info("Serving pages of data generation %s",
+                                 generation)
+                    self.generation = generation
+                self._checked = now
+        return self.generation
+
+    def get_page(self, key):
+        for i, store in enumerate(self.stores):
+            page = store.get(key)
+            if page is not None:
+                for earlier_store in self.stores[:i]:
+                    earlier_store.put(key, page)
+                return page
+        return None
+
+    def cached(self, view):
+        """Decorator for views whose pages depend only on their path and
+        the data"""
+        @functools.wraps(view)
+        def cached_view(*args, **kwargs):
+            if not self.stores:
+                return view(*args, **kwargs)
+            if self.generation is None:
+                self.check_generation()
+            key = (request.path, self.generation)
+            page = self.get_page(key)
+            if page is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                page = cache_page(response)
+                for store in self.stores:
+                    store.put(key, page)
+            return page_response(page)
+        return cached_view
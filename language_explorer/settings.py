@@ -16,6 +16,23 @@ SECRET_KEY = None
 DEBUG_TB_PANELS = []
 TOOLBAR = None
 WSGI_APP = None
+# Serve pages from an in-memory copy of the language db rather than
+#  querying it. See snapshot.SnapshotLanguagePersistence
+LANGUAGE_EXPLORER_READ_SNAPSHOT = False
+# If set, the loader writes a snapshot file here and the web tier mmaps
+#  it, sharing one copy between all worker processes.
+#  See snapshot.MappedSnapshotLanguagePersistence
+LANGUAGE_EXPLORER_SNAPSHOT_FILE = None
+# Rendered pages are cached until a load changes the data. At most this many
+#  per process. See response_cache.ResponseCache
+RESPONSE_CACHE_SIZE = 512
+# If set, rendered pages are also cached in this directory, which every
+#  worker process shares. At most RESPONSE_CACHE_DIR_SIZE of them
+RESPONSE_CACHE_DIR = None
+RESPONSE_CACHE_DIR_SIZE = 10000
+# Seconds between checks of whether a load has changed the data. Until
+#  then, cached pages are served without touching the db
+RESPONSE_CACHE_CHECK_INTERVAL = 5
 
 deployment_type = get_env_variable("LANGUAGE_EXPLORER_DEPLOYMENT")
 if deployment_type == "dev":
@@ -0,0 +1,466 @@
+import array
+import collections
+import logging
+import mmap
+import os
+import struct
+import sys
+from language_explorer import constants
+from language_explorer.persistence import LanguagePersistence, \
+    CacheableAliasRow
+from language_explorer.utils import atomic_write
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class SnapshotLanguagePersistence(LanguagePersistence):
+    """Read-only LanguagePersistence answered entirely from memory
+
+    All tables are read once, up front, into structures indexed the way
+    the get_* methods look them up. The database is only queried again
+    when check_for_updates finds that a load has happened, at which point
+    the whole snapshot is rebuilt.
+    """
+    SNAPSHOT_TABLES = [
+        LanguagePersistence.ALIAS_TABLE,
+        LanguagePersistence.LANGUAGE_TABLE,
+        LanguagePersistence.CLASSIFICATION_TABLE,
+        LanguagePersistence.TRANSLATION_TABLE,
+        LanguagePersistence.RELATIONSHIP_TABLE,
+        LanguagePersistence.REFERENCE_TABLE,
+    ]
+    RETIREMENT_VERBS = frozenset([
+        constants.RELTYPE_RETIREMENT_CHANGE,
+        constants.RELTYPE_RETIREMENT_DUPLICATE,
+        constants.RELTYPE_RETIREMENT_NON_EXISTENT,
+        constants.RELTYPE_RETIREMENT_SPLIT_INTO,
+        constants.RELTYPE_RETIREMENT_MERGED_INTO,
+    ])
+
+    def __init__(self, db_url):
+        super(SnapshotLanguagePersistence, self).__init__(db_url)
+        self._load()
+
+    def _load(self):
+        generations = self._read_generations()
+        rows = dict(
+            (table_name, [dict(row) for row in
+                          self.lang_db[table_name].all()]
+             if table_name in self.lang_db.tables else [])
+            for table_name in self.SNAPSHOT_TABLES)
+
+        language_by_iso = dict(
+            (row["iso"], row) for row in rows[self.LANGUAGE_TABLE])
+
+        alias_names_by_iso = collections.defaultdict(list)
+        isos_by_alias_name = collections.defaultdict(set)
+        for row in rows[self.ALIAS_TABLE]:
+            alias_names_by_iso[row["iso"]].append(row["name"])
+            isos_by_alias_name[row["name"]].add(row["iso"])
+
+        # Stable sort, so ties keep table order as they would in the db
+        classifications_by_iso = collections.defaultdict(list)
+        for row in sorted(rows[self.CLASSIFICATION_TABLE],
+                          key=lambda r: r["level"]):
+            classifications_by_iso[row["iso"]].append(
+                (row["source"], row["name"]))
+
+        translations_by_iso = collections.defaultdict(list)
+        translation_state = {}
+        for row in rows[self.TRANSLATION_TABLE]:
+            translations_by_iso[row["iso"]].append(
+                (row["source"], row["status"], row["year"]))
+            translation_state[row["iso"]] = max(
+                int(row["status"]), translation_state.get(row["iso"]))
+
+        relationships_by_iso = collections.defaultdict(list)
+        retirement_state = {}
+        for row in rows[self.RELATIONSHIP_TABLE]:
+            relationships_by_iso[row["subject_iso"]].append(
+                (row["source"], row["rel_verb"], row["object_iso"]))
+            if row["rel_verb"] in self.RETIREMENT_VERBS:
+                retirement_state[row["subject_iso"]] = True
+        for relationships in relationships_by_iso.itervalues():
+            relationships.sort()
+
+        references = collections.defaultdict(list)
+        for row in sorted(rows[self.REFERENCE_TABLE],
+                          key=lambda r: r["ext_ref_label"]):
+            references[(row["iso"], row["ext_ref_source"])].append(
+                (row["ext_ref_id"], row["ext_ref_label"]))
+
+        self._rows = rows
+        self._language_by_iso = language_by_iso
+        self._alias_names_by_iso = dict(alias_names_by_iso)
+        self._same_name_isos = set(
+            tuple(sorted(isos)) for isos in isos_by_alias_name.itervalues()
+            if len(isos) > 1)
+        self._classifications_by_iso = dict(classifications_by_iso)
+        self._translations_by_iso = dict(translations_by_iso)
+        self._relationships_by_iso = dict(relationships_by_iso)
+        self._references = dict(references)
+        self._seen_generations = generations
+        self._caches = {
+            "alias_contents": tuple(
+                CacheableAliasRow(row["iso"], row["name"],
+                                  row["alias_type"], row["source"])
+                for row in rows[self.ALIAS_TABLE]),
+            "translation_state": translation_state,
+            "retirement_state": retirement_state,
+        }
+        # Build the remaining caches now, rather than on the first request
+        self.get_alias_index()
+        self.get_signature_index()
+        for source in (constants.JOSHUA_PROJECT_SOURCE_ABBREV,
+                       constants.AUS_CENSUS_2011_ABBREV):
+            self.get_L1_speaker_count_by_iso(None, source)
+        self.get_language_summary()
+        logging.info("Loaded snapshot of %s ISOs at generations %s",
+                     len(self._alias_names_by_iso), generations)
+
+    def check_for_updates(self):
+        """Rebuild the snapshot if any table has been written since it
+        was taken, other than those only loads read
+
+        :return: names of tables that have changed since last checked
+        :rtype: list
+        """
+        changed = self._changed_tables()
+        if set(changed).difference(self.LOAD_TABLES):
+            logging.info("Tables changed since snapshot: %s", changed)
+            self._load()
+        return changed
+
+    def _upsert(self, table_name, row):
+        raise RuntimeError("Snapshot persistence is read-only")
+
+    def refresh_language_summary(self):
+        raise RuntimeError("Snapshot persistence is read-only")
+
+    def _all_rows(self, table_name):
+        return self._rows[table_name]
+
+    def get_external_references_by_iso(self, iso, source):
+        return list(self._references.get((iso, source), []))
+
+    def get_all_iso_codes(self):
+        return sorted(self._alias_names_by_iso)
+
+    def get_classifications_by_iso(self, iso):
+        d = collections.defaultdict(list)
+        for source, name in self._classifications_by_iso.get(iso, []):
+            d[source].append(name)
+        return d
+
+    def get_translations_by_iso(self, iso):
+        d = collections.defaultdict(list)
+        for source, status, year in self._translations_by_iso.get(iso, []):
+            d[source].append((status, year))
+        return d
+
+    def get_relationships_by_iso(self, iso):
+        return list(self._relationships_by_iso.get(iso, []))
+
+    def get_english_competency_by_iso(self, iso):
+        return self._english_competency_from_row(
+            self._language_by_iso.get(iso))
+
+    def get_common_names_for_iso_list(self, iso_list):
+        common_names = set()
+        for iso in iso_list:
+            name_list = self._alias_names_by_iso.get(iso, [])
+            if not common_names:
+                common_names.update(name_list)
+            else:
+                common_names.intersection_update(name_list)
+        return list(common_names)
+
+    def get_same_name_different_iso_list(self):
+        return list(self._same_name_isos)
+
+    def get_iso_list_from_iso(self, iso):
+        return [iso] if iso in self._alias_names_by_iso else []
+
+    def get_lat_lon_from_iso(self, iso):
+        return self._lat_lon_from_row(self._language_by_iso.get(iso))
+
+    def get_tindale_lat_lon_from_iso(self, iso):
+        return self._tindale_lat_lon_from_row(self._language_by_iso.get(iso))
+
+    def get_reversible_relationships(self):
+        sources = [s for s in constants.source_abbrev_name_dict.keys()
+                   if len(s) == 2]
+        return [row for row in self._rows[self.RELATIONSHIP_TABLE]
+                if row["rel_verb"] in self.REVERSIBLE_RELATIONSHIPS and
+                row["source"] in sources]
+
+
+# Snapshot file layout, all little endian:
+#  magic, column count, then a directory entry per column giving its name,
+#  struct typecode, byte offset and length. Columns follow, 8-byte aligned.
+#  Strings are interned into a single pool and referred to by index.
+SNAPSHOT_FILE_MAGIC = "LESNAP1\n"
+SNAPSHOT_DIRECTORY_ENTRY = struct.Struct("<24scQQ")
+SNAPSHOT_HAS_ALIAS = 1
+SNAPSHOT_HAS_LANGUAGE_ROW = 2
+
+
+class _StringPool(object):
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, s):
+        if s not in self.ids:
+            self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return self.ids[s]
+
+
+def write_snapshot_file(persistence, path):
+    """Write what the mapped snapshot reader serves to a single file
+
+    The file is replaced atomically, so readers that have the old file
+    mapped keep a consistent view until they reopen it.
+    """
+    pool = _StringPool()
+    columns = collections.OrderedDict([
+        ("iso", array.array("i")),
+        ("display_name", array.array("i")),
+        ("css_class", array.array("i")),
+        ("flags", array.array("B")),
+        ("latitude", array.array("d")),
+        ("longitude", array.array("d")),
+        ("speaker_count", array.array("i")),
+        ("jp_speaker_count", array.array("i")),
+        ("census_speaker_count", array.array("i")),
+        ("alias_start", array.array("I")),
+        ("alias_name", array.array("i")),
+        ("alias_type", array.array("i")),
+        ("alias_source", array.array("i")),
+    ])
+    aliases_by_iso = collections.defaultdict(list)
+    for row in persistence.get_alias_table_contents():
+        aliases_by_iso[row.iso].append(row)
+
+    for s in persistence.get_language_summary():
+        columns["iso"].append(pool.intern(s.iso))
+        columns["display_name"].append(pool.intern(s.display_name))
+        columns["css_class"].append(pool.intern(s.css_class))
+        columns["flags"].append(
+            (SNAPSHOT_HAS_ALIAS if s.has_alias else 0) |
+            (SNAPSHOT_HAS_LANGUAGE_ROW if s.has_language_row else 0))
+        # NaN stands in for an unknown location
+        columns["latitude"].append(
+            float("nan") if s.latitude is None else s.latitude)
+        columns["longitude"].append(
+            float("nan") if s.longitude is None else s.longitude)
+        columns["speaker_count"].append(int(s.speaker_count))
+        columns["jp_speaker_count"].append(int(s.jp_speaker_count))
+        columns["census_speaker_count"].append(int(s.census_speaker_count))
+        columns["alias_start"].append(len(columns["alias_name"]))
+        for row in aliases_by_iso[s.iso]:
+            columns["alias_name"].append(pool.intern(row.name))
+            columns["alias_type"].append(pool.intern(row.alias_type))
+            columns["alias_source"].append(pool.intern(row.source))
+    columns["alias_start"].append(len(columns["alias_name"]))
+
+    encoded = [st.encode("utf-8") for st in pool.strings]
+    columns["string_offset"] = array.array("I", [0])
+    for e in encoded:
+        columns["string_offset"].append(columns["string_offset"][-1] + len(e))
+    columns["string_data"] = array.array("B", "".join(encoded))
+
+    offset = len(SNAPSHOT_FILE_MAGIC) + 4 + \
+        SNAPSHOT_DIRECTORY_ENTRY.size * len(columns)
+    directory = []
+    data = []
+    for name, column in columns.iteritems():
+        padding = -offset % 8
+        offset += padding
+        if sys.byteorder != "little":
+            column.byteswap()
+        data.append("\0" * padding + column.tostring())
+        directory.append(SNAPSHOT_DIRECTORY_ENTRY.pack(
+            name, column.typecode, offset, len(column)))
+        offset += len(column) * column.itemsize
+
+    # Readable by web workers running as other users, and removed rather
+    #  than left behind if the write fails
+    atomic_write(path, "".join(
+        [SNAPSHOT_FILE_MAGIC, struct.pack("<I", len(columns))] +
+        directory + data))
+    logging.info("Wrote snapshot of %s ISOs and %s strings to %s",
+                 len(columns["iso"]), len(pool.strings), path)
+
+
+class _MappedColumn(object):
+    """Read-only view of one array column in a mapped snapshot file"""
+    def __init__(self, buf, typecode, offset, length):
+        self._buf = buf
+        self._typecode = typecode
+        self._item = struct.Struct("<" + typecode)
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._item.unpack_from(
+            self._buf, self._offset + i * self._item.size)[0]
+
+    def slice(self, start, stop):
+        return struct.unpack_from(
+            "<%d%s" % (stop - start, self._typecode), self._buf,
+            self._offset + start * self._item.size)
+
+    def all(self):
+        return self.slice(0, self._length)
+
+
+class MappedSnapshotLanguagePersistence(LanguagePersistence):
+    """LanguagePersistence that serves ISO codes, aliases, L1 speaker
+    counts and map data from a snapshot file written by
+    write_snapshot_file
+
+    The file is mmapped rather than read, so every process serving from
+    the same file shares its pages, and nothing is built at startup.
+    Everything else is read from the database as usual.
+    """
+    MAPPED_SPEAKER_COUNT_COLUMNS = {
+        constants.JOSHUA_PROJECT_SOURCE_ABBREV: "jp_speaker_count",
+        constants.AUS_CENSUS_2011_ABBREV: "census_speaker_count",
+    }
+
+    def __init__(self, db_url, snapshot_path):
+        super(MappedSnapshotLanguagePersistence, self).__init__(db_url)
+        self.snapshot_path = snapshot_path
+        self._open_snapshot()
+
+    def _open_snapshot(self):
+        with open(self.snapshot_path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            st = os.fstat(f.fileno())
+        if buf[:len(SNAPSHOT_FILE_MAGIC)] != SNAPSHOT_FILE_MAGIC:
+            raise RuntimeError("%s is not a language explorer snapshot" %
+                               (self.snapshot_path,))
+        column_count, = struct.unpack_from(
+            "<I", buf, len(SNAPSHOT_FILE_MAGIC))
+        columns = {}
+        for i in range(column_count):
+            name, typecode, offset, length = \
+                SNAPSHOT_DIRECTORY_ENTRY.unpack_from(
+                    buf, len(SNAPSHOT_FILE_MAGIC) + 4 +
+                    i * SNAPSHOT_DIRECTORY_ENTRY.size)
+            columns[name.rstrip("\0")] = \
+                _MappedColumn(buf, typecode, offset, length)
+        self._snapshot_columns = columns
+        self._snapshot_buf = buf
+        self._snapshot_id = (st.st_ino, st.st_mtime)
+
+    def check_for_updates(self):
+        """As for LanguagePersistence, also reopening the snapshot file if
+        it has been replaced"""
+        changed = super(MappedSnapshotLanguagePersistence, self) \
+            .check_for_updates()
+        st = os.stat(self.snapshot_path)
+        if (st.st_ino, st.st_mtime) != self._snapshot_id:
+            logging.info("Reopening replaced snapshot %s",
+                         self.snapshot_path)
+            self._open_snapshot()
+        return changed
+
+    def _string(self, string_id):
+        start, stop = self._snapshot_columns["string_offset"].slice(
+            string_id, string_id + 2)
+        data_offset = self._snapshot_columns["string_data"]._offset
+        return self._snapshot_buf[
+            data_offset + start:data_offset + stop].decode("utf-8")
+
+    def _iso_position(self, iso):
+        """Index of iso in the (sorted) iso column, or None"""
+        iso_column = self._snapshot_columns["iso"]
+        lo, hi = 0, len(iso_column)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(iso_column[mid]) < iso:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(iso_column) and self._string(iso_column[lo]) == iso:
+            return lo
+        return None
+
+    def _has_flag(self, position, flag):
+        return bool(self._snapshot_columns["flags"][position] & flag)
+
+    def get_all_iso_codes(self):
+        return [self._string(iso_id) for iso_id, flags in zip(
+                self._snapshot_columns["iso"].all(),
+                self._snapshot_columns["flags"].all())
+                if flags & SNAPSHOT_HAS_ALIAS]
+
+    def get_iso_list_from_iso(self, iso):
+        position = self._iso_position(iso)
+        if position is not None and \
+                self._has_flag(position, SNAPSHOT_HAS_ALIAS):
+            return [iso]
+        return []
+
+    def _get_names_by_iso(self, iso, alias_type):
+        d = collections.defaultdict(list)
+        position = self._iso_position(iso)
+        if position is None:
+            return d
+        start, stop = self._snapshot_columns["alias_start"].slice(
+            position, position + 2)
+        for name, row_type, source in zip(
+                self._snapshot_columns["alias_name"].slice(start, stop),
+                self._snapshot_columns["alias_type"].slice(start, stop),
+                self._snapshot_columns["alias_source"].slice(start, stop)):
+            if self._string(row_type) == alias_type:
+                d[self._string(source)].append(self._string(name))
+        return d
+
+    def get_primary_name_for_display(self, iso):
+        position = self._iso_position(iso)
+        if position is None:
+            return "Cannot lookup name"
+        return self._string(
+            self._snapshot_columns["display_name"][position])
+
+    def get_L1_speaker_count_by_iso(self, iso, source):
+        if source not in self.MAPPED_SPEAKER_COUNT_COLUMNS:
+            return super(MappedSnapshotLanguagePersistence, self) \
+                .get_L1_speaker_count_by_iso(iso, source)
+        position = self._iso_position(iso)
+        if position is None:
+            return constants.SPEAKER_COUNT_UNKNOWN
+        return self._snapshot_columns[
+            self.MAPPED_SPEAKER_COUNT_COLUMNS[source]][position]
+
+    def get_map_data(self):
+        c = self._snapshot_columns
+        map_data = []
+        for iso_id, flags, lat, lon, speaker_count, css_id, name_id in zip(
+                c["iso"].all(), c["flags"].all(),
+                c["latitude"].all(), c["longitude"].all(),
+                c["speaker_count"].all(), c["css_class"].all(),
+                c["display_name"].all()):
+            iso = self._string(iso_id)
+            if not flags & SNAPSHOT_HAS_LANGUAGE_ROW or \
+                    iso in self.MAP_EXCLUDED_ISOS:
+                continue
+            # NaN is the only value that isn't equal to itself
+            map_data.append((iso,
+                             "null" if lat != lat else lat,
+                             "null" if lon != lon else lon,
+                             speaker_count,
+                             self._string(css_id),
+                             self._string(name_id)))
+        return map_data
@@ -0,0 +1,287 @@
+import logging
+import os
+import shutil
+import sqlalchemy
+from persistence import LanguagePersistence
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class PrivateLanguagePersistence(LanguagePersistence):
+    """A language db that nothing else writes to, such as one being
+    loaded from empty
+
+    What is in it is tracked in memory rather than queried before each
+    write, and indexes are only built by ensure_indexes.
+    """
+    INDEX_ON_WRITE = False
+
+    def __init__(self, db_url):
+        super(PrivateLanguagePersistence, self).__init__(db_url)
+        # Rows written, per table and then key. Read from the db on first
+        #  use, in case it isn't empty
+        self._written = {}
+
+    def _existing_rows(self, table_name):
+        if table_name not in self._written:
+            self._written[table_name] = super(
+                PrivateLanguagePersistence, self)._existing_rows(table_name)
+        return self._written[table_name]
+
+    def _upsert(self, table_name, row):
+        # Write through a batch, so the choice of insert or update is made
+        #  from what has been written rather than by a query
+        with self.batch():
+            super(PrivateLanguagePersistence, self)._upsert(table_name, row)
+
+
+class ScratchLanguagePersistence(PrivateLanguagePersistence):
+    """A private sqlite db that is thrown away afterwards, such as a dry
+    run's
+
+    Nothing in it needs to survive a crash, so commits don't wait for the
+    disk, and a stage that commits each row costs little more than one
+    writing a batch.
+    """
+    def _connect(self):
+        super(ScratchLanguagePersistence, self)._connect()
+        sqlalchemy.event.listen(self.lang_db.engine, "connect",
+                                self._skip_sync)
+        # Reopen the connections made while connecting, without the sync
+        self.lang_db.engine.dispose()
+
+    @staticmethod
+    def _skip_sync(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+        cursor.close()
+
+
+class StagingLanguagePersistence(PrivateLanguagePersistence):
+    """A copy of a language db to load into, which then replaces the live
+    db in a single step. See swap_in
+
+    A full load starts from an empty copy, and one that only updates the
+    live db from a copy of it, so that readers never see part of either.
+
+    A sqlite db is staged in a file next to the live one, and a postgres
+    db in a schema next to the live public schema. Readers of the live db
+    switch to the new one on their next check_for_updates.
+
+    A staging copy left by a load that didn't complete is discarded,
+    unless resuming, in which case loading continues into it.
+
+    Swapping postgres schemas renames the live public schema, so the
+    loader's role must own it, or be a member of the role that does, and
+    must be allowed to create schemas in the db. This is checked before
+    loading rather than left to fail at the swap.
+
+    A snapshot of the staging copy is written next to the live snapshot
+    and moved into place by swap_in, so that readers never serve it with
+    the db it wasn't written from. See get_snapshot_write_path
+    """
+    STAGING_SCHEMA = "language_explorer_staging"
+    LIVE_SCHEMA = "public"
+    # The last live schema, kept until the next swap
+    PREVIOUS_SCHEMA = "language_explorer_previous"
+
+    # Appended to the live snapshot's path to give the staged one's
+    STAGED_SNAPSHOT_SUFFIX = ".staging"
+
+    def __init__(self, db_url, resume=False, snapshot_path=None,
+                 copy_live=False):
+        """
+        :param resume: continue loading into the staging copy left by a
+         load that didn't complete, if there is one
+        :param snapshot_path: the live snapshot file, if readers serve one
+        :param copy_live: start from a copy of the live db rather than an
+         empty one, unless resuming
+        """
+        self.live_url = db_url
+        self.staging_path = self._staging_path(db_url)
+        self.resumed = resume and self.exists(db_url)
+        self.snapshot_path = snapshot_path
+        if snapshot_path is not None and not self.resumed and \
+                os.path.exists(self._staged_snapshot_path()):
+            os.remove(self._staged_snapshot_path())
+        if not self.resumed:
+            live = LanguagePersistence(db_url)
+            live_generations = live.get_table_generations()
+            load_runs = live.get_load_runs()
+            live_tables = live.lang_db.tables
+            live.lang_db.engine.dispose()
+        if self.staging_path is not None:
+            if os.path.exists(self.staging_path) and not self.resumed:
+                os.remove(self.staging_path)
+            if copy_live and not self.resumed:
+                self._copy_live_file()
+            staging_url = "sqlite:///" + self.staging_path
+        else:
+            engine = sqlalchemy.create_engine(db_url)
+            with engine.begin() as connection:
+                self._check_swap_privileges(connection)
+                if not self.resumed:
+                    self._create_staging_schema(connection)
+                    if copy_live:
+                        self._copy_live_schema(connection, live_tables)
+            engine.dispose()
+            staging_url = self._staging_schema_url(db_url)
+        super(StagingLanguagePersistence, self).__init__(staging_url)
+        if self.resumed:
+            logging.info("Resuming staged load into %s", staging_url)
+            return
+        if copy_live:
+            # Only the tables the load changes will differ from the live
+            #  db's, but readers must still reconnect to the new db
+            self._increment_generations([self.GENERATION_TABLE])
+            self._seen_generations = self._read_generations()
+            logging.info("Staging a load into a copy of %s", db_url)
+            return
+        self._seed_generations(live_generations)
+        # The history of loads outlives the db they loaded
+        with self.batch():
+            for report in load_runs:
+                self.persist_load_run(report)
+
+    @classmethod
+    def _staging_path(cls, db_url):
+        """The file to stage a sqlite db in, or None for postgres"""
+        url = sqlalchemy.engine.url.make_url(db_url)
+        if not url.drivername.startswith("sqlite"):
+            return None
+        if url.database in (None, "", ":memory:"):
+            raise ValueError("Can't stage a load into an in-memory db")
+        return url.database + ".staging"
+
+    @classmethod
+    def _staging_schema_url(cls, db_url):
+        """db_url, with every connection looking in the staging schema
+        first, so that unqualified table names are those of the staging
+        copy"""
+        return db_url + ("&" if "?" in db_url else "?") + \
+            "options=-csearch_path%3D" + cls.STAGING_SCHEMA
+
+    @classmethod
+    def _check_swap_privileges(cls, connection):
+        row = connection.execute(
+            "SELECT pg_has_role(nspowner, 'MEMBER'), "
+            "has_database_privilege(current_database(), 'CREATE') "
+            "FROM pg_namespace WHERE nspname = %s", cls.LIVE_SCHEMA).first()
+        if row is None or not all(row):
+            raise RuntimeError(
+                "Can't swap a staged load in for the %s schema. The loader's "
+                "role must own it and be able to create schemas" %
+                (cls.LIVE_SCHEMA,))
+
+    @classmethod
+    def _create_staging_schema(cls, connection):
+        connection.execute("DROP SCHEMA IF EXISTS %s CASCADE" %
+                           (cls.STAGING_SCHEMA,))
+        connection.execute("CREATE SCHEMA %s" % (cls.STAGING_SCHEMA,))
+
+    @classmethod
+    def _copy_live_schema(cls, connection, table_names):
+        """Copy each live table into the staging schema, with a sequence of
+        its own for ids, as the live one will be dropped along with the
+        live schema once it's been replaced"""
+        for table_name in table_names:
+            names = {"staging": cls.STAGING_SCHEMA, "live": cls.LIVE_SCHEMA,
+                     "table": table_name}
+            for statement in [
+                    "CREATE TABLE %(staging)s.%(table)s "
+                    "(LIKE %(live)s.%(table)s INCLUDING INDEXES)",
+                    "CREATE SEQUENCE %(staging)s.%(table)s_id_seq "
+                    "OWNED BY %(staging)s.%(table)s.id",
+                    "ALTER TABLE %(staging)s.%(table)s ALTER COLUMN id "
+                    "SET DEFAULT nextval('%(staging)s.%(table)s_id_seq')",
+                    "INSERT INTO %(staging)s.%(table)s "
+                    "SELECT * FROM %(live)s.%(table)s",
+                    "SELECT setval('%(staging)s.%(table)s_id_seq', "
+                    "COALESCE(MAX(id), 0) + 1, false) "
+                    "FROM %(staging)s.%(table)s"]:
+                connection.execute(statement % names)
+
+    def _copy_live_file(self):
+        live_path = sqlalchemy.engine.url.make_url(self.live_url).database
+        # Copied under another name first, so that a copy cut short is
+        #  never taken for a load to resume
+        copy_path = self.staging_path + ".copy"
+        shutil.copyfile(live_path, copy_path)
+        os.rename(copy_path, self.staging_path)
+
+    @classmethod
+    def _swap_schemas(cls, connection):
+        """Make the staging schema the live one, keeping the live one as
+        PREVIOUS_SCHEMA until the next swap"""
+        connection.execute("DROP SCHEMA IF EXISTS %s CASCADE" %
+                           (cls.PREVIOUS_SCHEMA,))
+        connection.execute("ALTER SCHEMA %s RENAME TO %s" %
+                           (cls.LIVE_SCHEMA, cls.PREVIOUS_SCHEMA))
+        connection.execute("ALTER SCHEMA %s RENAME TO %s" %
+                           (cls.STAGING_SCHEMA, cls.LIVE_SCHEMA))
+
+    @classmethod
+    def exists(cls, db_url):
+        """Whether there's a staging copy left by a load that didn't
+        complete"""
+        staging_path = cls._staging_path(db_url)
+        if staging_path is not None:
+            return os.path.exists(staging_path)
+        engine = sqlalchemy.create_engine(db_url)
+        try:
+            return engine.execute(
+                "SELECT 1 FROM information_schema.schemata "
+                "WHERE schema_name = %s", cls.STAGING_SCHEMA).first() \
+                is not None
+        finally:
+            engine.dispose()
+
+    def _staged_snapshot_path(self):
+        return self.snapshot_path + self.STAGED_SNAPSHOT_SUFFIX
+
+    def get_snapshot_write_path(self, path):
+        if path != self.snapshot_path:
+            raise ValueError("Staging a snapshot for %s, not %s" %
+                             (self.snapshot_path, path))
+        return self._staged_snapshot_path()
+
+    def _seed_generations(self, live_generations):
+        """Start every generation past the live db's, so that once swapped
+        in, readers see every table as changed. The generation of the
+        generation table itself counts swaps, telling readers to
+        reconnect"""
+        live_generations.setdefault(self.GENERATION_TABLE, 0)
+        table = self._get_generation_table().table
+        self.lang_db.executable.execute(
+            table.insert(),
+            [{"table_name": table_name, "generation": generation + 1}
+             for table_name, generation in live_generations.iteritems()])
+        self._seen_generations = self._read_generations()
+
+    def swap_in(self):
+        """Replace the live db with the staging copy, building its indexes
+        first, and then the live snapshot with the staged one, if it was
+        written. The staging copy is no longer usable afterwards"""
+        self.ensure_indexes()
+        self.lang_db.engine.dispose()
+        if self.staging_path is not None:
+            live_path = sqlalchemy.engine.url.make_url(self.live_url).database
+            # Atomic, and readers holding the old file open are unaffected
+            #  until they reconnect
+            os.rename(self.staging_path, live_path)
+        else:
+            engine = sqlalchemy.create_engine(self.live_url)
+            with engine.begin() as connection:
+                self._swap_schemas(connection)
+            engine.dispose()
+        logging.info("Swapped staged load in for %s", self.live_url)
+        # Only once the db it was written from is live. Readers check the
+        #  db before reopening the snapshot, so see both changes together
+        if self.snapshot_path is not None and \
+                os.path.exists(self._staged_snapshot_path()):
+            os.rename(self._staged_snapshot_path(), self.snapshot_path)
+            logging.info("Swapped staged snapshot in for %s",
+                         self.snapshot_path)
@@ -0,0 +1,350 @@
+"""Builds a static copy of the site, with no server and no crawl over
+http: each page is rendered in process, through Flask's test client, and
+its links are found and rendered in turn, as a crawl would find them.
+
+Links are given .html suffixes, the deployment prefix and the git commit
+stamp as each page is rendered, just as make_static.sh used to do with
+sed once the crawl was done.
+
+A rebuild only renders the pages that the loads since the last build
+could have changed, going by the ISOs each load recorded changing, and
+only writes the pages that differ, so the rest keep their mtimes.
+
+Usage: python -m language_explorer.static_build <output dir>
+       [--prefix /language_explorer] [--processes N] [--full]
+"""
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import re
+import subprocess
+import time
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.utils import atomic_write
+
+__author__ = 'esteele'
+
+logging.basicConfig(level=logging.DEBUG)
+
+# The pages a crawl starts from. The search page is only reached through
+#  a form
+SEED_PATHS = ["/", "/search"]
+# Site paths linked to from pages, other than static files, which are
+#  copied whole
+LINKED_PATH_RES = [
+    re.compile(r'(?:href|action)="(/(?!static/)[^"#?]*)"'),
+    # The map's languages
+    re.compile(r'url: "(language/iso/[a-z]{3})"'),
+]
+# make_static.sh's rewrites, in the order it applied them. There are no
+#  .html suffixes in the dynamic site, so adding them is safe
+HTML_SUFFIX_RES = [
+    (re.compile(r'href="(/[a-z][a-z/]*)">'), r'href="\1.html">'),
+    (re.compile(r'action="(/[a-z][a-z/]*)"'), r'action="\1.html"'),
+    (re.compile(r'url: "(language/iso/[a-z][a-z][a-z])"'),
+     r'url: "\1.html"'),
+]
+# Only urls with a leading slash, so that external urls are left alone
+PREFIXED_RES = [
+    re.compile(r'(href=")/'),
+    re.compile(r'(src=")/'),
+    re.compile(r'(action=")/'),
+    re.compile(r'(d3\.json\(")/'),
+]
+COMMIT_STAMP = ">######<"
+STATIC_DIRNAME = "static"
+# Written into the output dir, recording what it was built from and the
+#  links between its pages
+BUILD_STATE_FILENAME = ".static_build.json"
+LANGUAGE_PATH_TEMPLATE = "/language/iso/%s"
+# The language summary is rewritten whole by every load, so pages showing
+#  it depend on the tables it's derived from
+SUMMARY_TABLES = [
+    LanguagePersistence.ALIAS_TABLE,
+    LanguagePersistence.LANGUAGE_TABLE,
+    LanguagePersistence.TRANSLATION_TABLE,
+    LanguagePersistence.RELATIONSHIP_TABLE,
+]
+# Pages showing many languages, and the tables they're rendered from.
+#  Every other page is of a single language
+AGGREGATE_PAGE_TABLES = {
+    "/language/all": [LanguagePersistence.ALIAS_TABLE],
+    "/notes": [LanguagePersistence.ALIAS_TABLE,
+               LanguagePersistence.LANGUAGE_TABLE,
+               LanguagePersistence.TRANSLATION_TABLE],
+    "/table": SUMMARY_TABLES,
+    "/map": SUMMARY_TABLES,
+    "/search": [LanguagePersistence.ALIAS_TABLE],
+}
+
+
+def rewrite_page(html, prefix="", commit=None):
+    """html with .html suffixed links, prefix before each absolute url
+    and commit in place of the version stamp"""
+    for pattern, replacement in HTML_SUFFIX_RES:
+        html = pattern.sub(replacement, html)
+    if prefix:
+        for pattern in PREFIXED_RES:
+            html = pattern.sub(r"\1%s/" % (prefix,), html)
+    if commit:
+        html = html.replace(COMMIT_STAMP, ">%s<" % (commit,))
+    return html
+
+
+def linked_paths(html):
+    """Site paths of the pages html links to"""
+    paths = set()
+    for pattern in LINKED_PATH_RES:
+        for path in pattern.findall(html):
+            paths.add(path if path.startswith("/") else "/" + path)
+    return paths
+
+
+def output_filename(path):
+    """Where a crawl saving with .html extensions would put a page"""
+    if path == "/":
+        return "index.html"
+    return path.strip("/") + ".html"
+
+
+def changes_since(load_runs, built_generation, generation):
+    """ISOs changed by the loads that took the data from built_generation
+    to generation, per table
+
+    :param load_runs: most recent first, as get_load_runs returns them
+    :return: None if the data changed other than by those loads, e.g. by a
+     load that failed or that didn't record its changes
+    :rtype: dict
+    """
+    changed = collections.defaultdict(set)
+    for run in load_runs:
+        if generation == built_generation:
+            break
+        changes = run.get("changes")
+        if changes is None or changes["to_generation"] != generation:
+            return None
+        for table_name, isos in changes["isos"].iteritems():
+            for change_isos in isos.itervalues():
+                changed[table_name].update(change_isos)
+        generation = changes["from_generation"]
+    if generation != built_generation:
+        return None
+    return changed
+
+
+def pages_to_rerender(changed, links):
+    """Built pages that may differ once changed is loaded
+
+    :param changed: ISOs, per table, as changes_since returns them
+    :param links: paths each built page links to
+    """
+    paths = set(path for path, tables in AGGREGATE_PAGE_TABLES.iteritems()
+                if changed.viewkeys() & set(tables))
+    linked_from = collections.defaultdict(set)
+    for path, page_links in links.iteritems():
+        for linked_path in page_links:
+            linked_from[linked_path].add(path)
+    for iso in set().union(*changed.values()):
+        language_path = LANGUAGE_PATH_TEMPLATE % (iso,)
+        # Pages of new languages are found by following links from the
+        #  others
+        if language_path in links:
+            paths.add(language_path)
+        # Links to a language show its name
+        paths.update(linked_from[language_path])
+    return sorted(paths)
+
+
+def reachable_paths(links):
+    """Paths linked to, directly or indirectly, from SEED_PATHS"""
+    reached = set()
+    to_visit = list(SEED_PATHS)
+    while to_visit:
+        path = to_visit.pop()
+        if path not in reached and path in links:
+            reached.add(path)
+            to_visit.extend(links[path])
+    return reached
+
+
+def _write_if_changed(filename, data):
+    """Write data unless the file already holds it, so that its mtime is
+    kept. Whether it was written"""
+    try:
+        with open(filename, "rb") as f:
+            if f.read() == data:
+                return False
+    except IOError:
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    atomic_write(filename, data)
+    return True
+
+
+def _copy_if_changed(source_dir, output_dir):
+    for directory, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            with open(os.path.join(directory, filename), "rb") as f:
+                data = f.read()
+            _write_if_changed(os.path.join(
+                output_dir, os.path.relpath(directory, source_dir),
+                filename), data)
+
+
+def read_build_state(output_dir):
+    """What output_dir was last built from, or None if it wasn't"""
+    try:
+        with open(os.path.join(output_dir, BUILD_STATE_FILENAME)) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+def _prepare_worker():
+    # Pages are rendered once each, so caching them would only cost memory
+    from language_explorer import views
+    views.response_cache.stores = []
+
+
+def _forget_connections():
+    """Close the db connections that workers would otherwise inherit and
+    share. Each process opens its own as needed"""
+    from language_explorer import views
+    views.lp.lang_db.engine.dispose()
+    views.wals.session.remove()
+    views.wals.session.bind.dispose()
+
+
+def render_page(args):
+    """(path, rewritten page, paths it links to), or (path, None, None) if
+    the page isn't there"""
+    path, prefix, commit = args
+    from language_explorer import app
+    response = app.test_client().get(path)
+    if response.status_code != 200:
+        logging.warning("Not building %s, which is a %s", path,
+                        response.status_code)
+        return path, None, None
+    html = response.get_data(as_text=True)
+    return path, rewrite_page(html, prefix, commit), linked_paths(html)
+
+
+def current_commit():
+    """Abbreviated hash of the checked out git commit"""
+    return subprocess.check_output(
+        ["git", "log", "-n1", "--abbrev-commit", "--format=%h"],
+        cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+
+
+def build(output_dir, prefix="", commit=None, processes=None,
+          full=False):
+    """Render every page reachable from SEED_PATHS into output_dir, across
+    a pool of processes, and copy the static files alongside
+
+    Only pages that may have changed since output_dir was last built are
+    rendered, unless it was built with a different prefix or commit.
+    Pages that are no longer reachable are removed.
+
+    :param prefix: put before every absolute url, for a site that isn't
+     served from the root of its host
+    :param commit: shown as the site's version
+    :param full: render every page, whatever output_dir was built from
+    :return: the number of pages written
+    """
+    from language_explorer import app, views
+    start = time.time()
+    views.lp.check_for_updates()
+    generation = views.lp.get_data_generation()
+    state = None if full else read_build_state(output_dir)
+    changed = None
+    if state is not None and state["prefix"] == prefix and \
+            state["commit"] == commit:
+        changed = changes_since(views.lp.get_load_runs(),
+                                state["data_generation"], generation)
+    if changed is None:
+        logging.info("Rendering every page")
+        links = {}
+        to_render = list(SEED_PATHS)
+    else:
+        links = dict((path, set(paths))
+                     for path, paths in state["links"].iteritems())
+        to_render = pages_to_rerender(changed, links)
+        logging.info("Rendering %s pages that loads since the last build "
+                     "may have changed", len(to_render))
+    previous = set(links) if state is None else set(state["links"])
+
+    _prepare_worker()
+    _forget_connections()
+    pool = multiprocessing.Pool(processes, _prepare_worker)
+    seen = set(links).union(to_render)
+    written = 0
+    try:
+        while to_render:
+            # Linked pages are only known once the pages linking to them
+            #  are rendered, so the crawl proceeds a link deep at a time
+            logging.info("Rendering %s pages", len(to_render))
+            found = set()
+            for path, html, page_links in pool.imap_unordered(
+                    render_page,
+                    [(path, prefix, commit) for path in to_render],
+                    chunksize=8):
+                if html is None:
+                    links.pop(path, None)
+                    continue
+                links[path] = page_links
+                found.update(page_links)
+                if _write_if_changed(
+                        os.path.join(output_dir, output_filename(path)),
+                        html.encode("utf-8")):
+                    written += 1
+            to_render = sorted(found.difference(seen))
+            seen.update(to_render)
+    finally:
+        pool.terminate()
+
+    reachable = reachable_paths(links)
+    for path in previous.union(links).difference(reachable):
+        links.pop(path, None)
+        filename = os.path.join(output_dir, output_filename(path))
+        if os.path.exists(filename):
+            logging.info("Removing %s, which is no longer linked to", path)
+            os.remove(filename)
+    _copy_if_changed(os.path.join(app.root_path, STATIC_DIRNAME),
+                     os.path.join(output_dir, STATIC_DIRNAME))
+    _write_if_changed(os.path.join(output_dir, BUILD_STATE_FILENAME),
+                      json.dumps(
+                          {"prefix": prefix, "commit": commit,
+                           "data_generation": generation,
+                           "links": dict((path, sorted(paths)) for path, paths
+                                         in links.iteritems())},
+                          indent=1, sort_keys=True))
+    logging.info("Wrote %s of %s pages into %s in %.1fs", written,
+                 len(links), output_dir, time.time() - start)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a static copy of the site")
+    parser.add_argument("output_dir",
+                        help="where to build it. A copy already there is "
+                             "brought up to date")
+    parser.add_argument("--prefix", default="",
+                        help="path the site is served under, e.g. "
+                             "/language_explorer")
+    parser.add_argument("--commit",
+                        help="version to show, rather than the checked out "
+                             "git commit")
+    parser.add_argument("--processes", type=int,
+                        help="pages rendered at once. Defaults to the "
+                             "number of cpus")
+    parser.add_argument("--full", action="store_true",
+                        help="render every page, rather than only those "
+                             "loads since the last build may have changed")
+    args = parser.parse_args()
+    build(args.output_dir, args.prefix.rstrip("/"),
+          args.commit or current_commit(), args.processes, args.full)
@@ -1,6 +1,9 @@
 # Taken from https://wiki.python.org/moin/PythonDecoratorLibrary
 import collections
 import functools
+import hashlib
+import os
+import tempfile
 
 
 class memoized(object):
@@ -31,3 +34,85 @@ class memoized(object):
     def __get__(self, obj, objtype):
         """Support instance methods."""
         return functools.partial(self.__call__, obj)
+
+
+class LRUCache(object):
+    """Mapping that holds at most maxsize items, discarding the least
+    recently used item to make room for a new one
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        # Re-insert, making this the most recently used
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        if len(self._items) >= self.maxsize:
+            self._items.popitem(last=False)
+        self._items[key] = value
+
+    def clear(self):
+        self._items.clear()
+
+
+def _read_umask():
+    # Can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Read once, as reading it briefly changes it for every thread
+_UMASK = _read_umask()
+
+
+def atomic_write(path, data):
+    """Write data to the file at path, which appears complete or not at
+    all. The file gets the mode open() would give it"""
+    directory, filename = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix="." + filename[:100],
+                                     dir=directory)
+    try:
+        # mkstemp's files are only readable by their owner, which would
+        #  lock out e.g. web workers running as another user
+        os.fchmod(fd, 0666 & ~_UMASK)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def file_fingerprint(path):
+    """sha1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def directory_fingerprint(path, prefix=""):
+    """sha1 of the name, size and modification time of each file in a
+    directory whose name starts with prefix. No file is read
+    """
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(path)):
+        if name.startswith(prefix):
+            st = os.stat(os.path.join(path, name))
+            digest.update("%s %s %r\n" % (name, st.st_size, st.st_mtime))
+    return digest.hexdigest()
@@ -2,14 +2,47 @@ from language_explorer import app, settings, constants
 from language_explorer.language_sources.wals import WalsAdapter
 from language_explorer.language_sources.census_2011 import Census2011Adapter
 from language_explorer.persistence import LanguagePersistence
-from flask import render_template
-
-lp = LanguagePersistence(settings.LANGUAGE_EXPLORER_DB_URL)
+from language_explorer.response_cache import ResponseCache, \
+    MemoryPageStore, DiskPageStore
+from language_explorer.snapshot import SnapshotLanguagePersistence, \
+    MappedSnapshotLanguagePersistence
+from flask import abort, render_template
+
+if settings.LANGUAGE_EXPLORER_SNAPSHOT_FILE:
+    lp = MappedSnapshotLanguagePersistence(
+        settings.LANGUAGE_EXPLORER_DB_URL,
+        settings.LANGUAGE_EXPLORER_SNAPSHOT_FILE)
+elif settings.LANGUAGE_EXPLORER_READ_SNAPSHOT:
+    lp = SnapshotLanguagePersistence(settings.LANGUAGE_EXPLORER_DB_URL)
+else:
+    lp = LanguagePersistence(settings.LANGUAGE_EXPLORER_DB_URL)
 wals = WalsAdapter(settings.WALS_DB_URL)
 census = Census2011Adapter(settings.CENSUS_CSV_SOURCE, lp)
 
 
+def data_generation():
+    lp.check_for_updates()
+    return lp.get_data_generation()
+
+
+page_stores = []
+if settings.RESPONSE_CACHE_SIZE:
+    page_stores.append(MemoryPageStore(settings.RESPONSE_CACHE_SIZE))
+if settings.RESPONSE_CACHE_DIR:
+    page_stores.append(DiskPageStore(settings.RESPONSE_CACHE_DIR,
+                                     settings.RESPONSE_CACHE_DIR_SIZE))
+response_cache = ResponseCache(data_generation, page_stores,
+                               settings.RESPONSE_CACHE_CHECK_INTERVAL)
+
+
+@app.before_request
+def check_for_data_updates():
+    # Picks up a reload without needing a restart
+    response_cache.check_generation()
+
+
 @app.route('/')
+@response_cache.cached
 def index():
     return render_template(
         'index.html',
@@ -18,6 +51,7 @@ def index():
 
 
 @app.route('/language/all')
+@response_cache.cached
 def show_all_languages():
     iso_list = lp.get_all_iso_codes()
     return render_template(
@@ -28,6 +62,7 @@ def show_all_languages():
 
 
 @app.route('/notes')
+@response_cache.cached
 def show_notes():
     sndi_list = lp.get_same_name_different_iso_list()
     common_name_list = []
@@ -75,6 +110,7 @@ def show_notes():
 
 
 @app.route('/table')
+@response_cache.cached
 def show_table():
     td = lp.get_table_data()
     return render_template(
@@ -86,6 +122,7 @@ def show_table():
 
 
 @app.route('/map')
+@response_cache.cached
 def show_map():
     map_data = lp.get_map_data()
     #map_data = [d for d in map_data if d[0] in (
@@ -100,6 +137,7 @@ def show_map():
 
 
 @app.route('/search')
+@response_cache.cached
 def show_search_table():
     td = lp.get_search_table_data()
     return render_template(
@@ -111,7 +149,11 @@ def show_search_table():
 
 
 @app.route('/language/iso/<iso639_3_code>')
+@response_cache.cached
 def show_language(iso639_3_code):
+    if not lp.is_known_iso(iso639_3_code):
+        # Rather than an empty profile, which would be cached
+        abort(404)
     # show the profile for the language
     pn_dict = lp.get_primary_names_by_iso(iso639_3_code)
     an_dict = lp.get_alternate_names_by_iso(iso639_3_code)
@@ -1,7 +1,23 @@
+import os
+import shutil
+import tempfile
+import unittest
 from language_explorer import settings, constants
-from language_explorer.language_sources.austlang import AustlangAdapter
+from language_explorer.language_sources.austlang import AustlangAdapter, \
+    AustlangRecord
 from tests.test_baseclasses import BaseAdapterTestCase
 
+LANGUAGE_PAGE = u"""<html><body><table>
+<tr><td><a onmouseover="tip('Language identification code used at AIATSIS')"
+>AIATSIS code:</a> C8</td></tr>
+<tr><td><a onmouseover="tip('Language name used in AUSTLANG')"
+>Language name:</a> Arrernte</td></tr>
+<tr><td><a onmouseover="tip('International Organization for Standardization')"
+>ISO 639-3</a>: %s</td></tr>
+<tr><td><a onmouseover="tip('Australian Bureau of Statistics')"
+>ABS name</a>: Arrernte \u2013 Eastern</td></tr>
+</table></body></html>"""
+
 
 class TestAustlangAdapter(BaseAdapterTestCase):
     def setUp(self):
@@ -27,4 +43,51 @@ class TestAustlangAdapter(BaseAdapterTestCase):
         for austlang_id, abs_name in austlang_name_pairs:
             self.assertEqual(abs_name,
                              self.source.get_ABS_name_from_austlang_id(
-                                 austlang_id))
\ No newline at end of file
+                                 austlang_id))
+
+
+class TestAustlangRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_root = tempfile.mkdtemp()
+        self.source = AustlangAdapter(self.cache_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_root)
+
+    def _cache_page(self, austlang_id, iso_text):
+        url = self.source.ONE_LANGUAGE_URL_TEMPLATE % (austlang_id,)
+        with open(os.path.join(self.cache_root,
+                               self.source.generate_filename_from_url(url)),
+                  "w") as f:
+            f.write((LANGUAGE_PAGE % (iso_text,)).encode("utf-8"))
+
+    def test_extracts_record(self):
+        self._cache_page(145, "are, Aer")
+        self.assertEqual(
+            AustlangRecord(u"are, Aer", u"Arrernte \u2013 Eastern", u"C8",
+                           u"Arrernte"),
+            self.source.get_language_record(145))
+        self.assertEqual(["are", "aer"],
+                         self.source.get_iso_list_from_austlang_id(145))
+        self.assertEqual(u"C8",
+                         self.source.get_aiatsis_code_from_austlang_id(145))
+
+    def test_reuses_extracted_record(self):
+        self._cache_page(145, "are")
+        self._cache_page(977, "xmg")
+        record = self.source.get_language_record(145)
+        self.source.get_language_record(977)
+        # A later run reads the record rather than parsing the page
+        source = AustlangAdapter(self.cache_root)
+        source._extract_record = None
+        self.assertEqual(record, source.get_language_record(145))
+        # Corrected by id, so not part of the record
+        self.assertEqual(["xmh"],
+                         source.get_iso_list_from_austlang_id(977))
+        self.assertEqual(u"xmg", source.get_language_record(977).iso_text)
+
+        # A changed page is parsed again
+        self._cache_page(145, "aer")
+        source = AustlangAdapter(self.cache_root)
+        self.assertEqual(["aer"], source.get_iso_list_from_austlang_id(145))
@@ -1,8 +1,53 @@
+import tempfile
 import unittest
+from language_explorer.persistence import LanguagePersistence
 
 __author__ = 'esteele'
 
 
+def populate(p, speakers=20):
+    """Write a little of everything a load writes, including later writes
+    to the same rows"""
+    with p.batch():
+        p.persist_language("aaa", "Alpha", "JP")
+        p.persist_language("aaa", "Alpha", "AL")
+        p.persist_alternate("aaa", "Shared", "JP")
+        p.persist_alternate("aaa", "Alef", "JP")
+        p.persist_dialect("aaa", "Alpha North", "AL")
+        p.persist_language("bbb", "Beta", "WA")
+        p.persist_alternate("bbb", "Shared", "WA")
+        p.persist_classification("aaa", ["Family", "Genus"], "WA")
+        p.persist_translation("aaa", {"TS": 4, "YR": 1990}, "JP")
+        p.persist_translation("aaa", {"TS": 2, "YR": 1960}, "FB")
+        p.persist_relationship("bbb", [("M", "aaa")], "SI")
+        p.persist_L1_speaker_count("aaa", speakers, "JP")
+        p.persist_L1_speaker_count("aaa", 12, "CN")
+        p.persist_english_competency("aaa", 40, 60)
+        p.persist_lat_lon("aaa", -20.0, 130.0)
+        p.persist_tindale_lat_lon("bbb", -21.0, 131.0)
+        p.persist_external_reference("aaa", "C2", "Second", "AL")
+        p.persist_external_reference("aaa", "C1", "First", "AL")
+    # In and out of a batch
+    with p.batch():
+        p.persist_L1_speaker_count("aaa", 15, "CN")
+        p.persist_translation("aaa", {"TS": 5, "YR": 1995}, "JP")
+    p.persist_lat_lon("aaa", -20.5, 130.0)
+    p.persist_tindale_lat_lon("bbb", -21.5, 131.0)
+
+
+class PersistenceTestCase(unittest.TestCase):
+    """Tests of language dbs in temporary files, which unlike in-memory
+    dbs can be shared between connections and threads"""
+
+    def temp_db_url(self):
+        db_file = tempfile.NamedTemporaryFile(suffix=".db")
+        self.addCleanup(db_file.close)
+        return "sqlite:///" + db_file.name
+
+    def temp_persistence(self, cls=LanguagePersistence):
+        return cls(self.temp_db_url())
+
+
 class BaseAdapterTestCase(unittest.TestCase):
 
     def _do_test_all_iso_keys_common(self):
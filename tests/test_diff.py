@@ -0,0 +1,58 @@
+from language_explorer.diff import diff_load
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.staging import PrivateLanguagePersistence
+from tests.test_baseclasses import PersistenceTestCase, populate
+
+__author__ = 'esteele'
+
+
+class TestDiff(PersistenceTestCase):
+
+    def setUp(self):
+        self.current = self.temp_persistence()
+        self.loaded = self.temp_persistence(PrivateLanguagePersistence)
+
+    def test_same_rows(self):
+        populate(self.current)
+        populate(self.loaded)
+        diff = diff_load(self.current, self.loaded)
+        self.assertTrue(diff.is_empty())
+        self.assertEqual(7, diff.tables[LanguagePersistence.ALIAS_TABLE][
+            "unchanged"])
+        self.assertEqual({"unchanged": 4}, diff.sources["JP"])
+
+    def test_changed_rows(self):
+        populate(self.current)
+        self.current.persist_language("ccc", "Gamma", "JP")
+        populate(self.loaded, speakers=25)
+        self.loaded.persist_language("ddd", "Delta", "AL")
+        diff = diff_load(self.current, self.loaded)
+        self.assertFalse(diff.is_empty())
+
+        report = diff.as_dict()
+        self.assertEqual(
+            {"inserted": 1, "updated": 0, "deleted": 1, "unchanged": 7},
+            report["tables"][LanguagePersistence.ALIAS_TABLE])
+        self.assertEqual(
+            {"inserted": 0, "updated": 1, "deleted": 0, "unchanged": 1},
+            report["tables"][LanguagePersistence.LANGUAGE_TABLE])
+        self.assertEqual(
+            {"inserted": 0, "updated": 0, "deleted": 1, "unchanged": 4},
+            report["sources"]["JP"])
+        self.assertEqual(1, report["sources"]["AL"]["inserted"])
+
+        self.assertEqual(["aaa", "ccc", "ddd"], report["isos"].keys())
+        [speakers] = report["isos"]["aaa"]
+        self.assertEqual("updated", speakers["change"])
+        self.assertEqual([20, 25], speakers["columns"]["L1_speaker_count_JP"])
+        self.assertEqual("deleted", report["isos"]["ccc"][0]["change"])
+        self.assertIn("ddd language_alias inserted", diff.format())
+        self.assertEqual(
+            {LanguagePersistence.ALIAS_TABLE:
+             {"inserted": ["ddd"], "deleted": ["ccc"]},
+             LanguagePersistence.LANGUAGE_TABLE: {"updated": ["aaa"]}},
+            diff.changed_isos())
+
+        # Neither db is written to
+        self.assertEqual(["aaa", "bbb", "ccc"],
+                         self.current.get_all_iso_codes())
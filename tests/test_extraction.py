@@ -0,0 +1,79 @@
+# -*- coding: utf8 -*-
+import unittest
+from language_explorer.language_sources import extraction
+
+__author__ = 'esteele'
+
+TINDALE_PAGE = """<html><head><title>Ngameni</title></head><body>
+<table width="100%%"><tr><td><table class="TribeDetails">
+<tr><td>Location</td><td>Lower Diamantina River</td></tr>
+<tr><td>Co-ordinates</td><td>%s</td></tr>
+<tr><td>Area</td><td>10,000 sq. km (3,900 sq. mi.)</td></tr>
+</table></td></tr></table>
+<p>Co-ordinates<br>are approximate</p>
+</body></html>"""
+TINDALE_INDEX_PAGE = """<html><body>
+<table id="Letters"><tr><td><a href="a.htm">A</a></td></tr></table>
+<table id="TribeIndex">
+<tr><td><a href="ngameni.htm">Ngameni</a></td>
+<td><a href="ngarla.htm">Ngarla</a> (<a href="koko-.htm">Koko-</a>)</td>
+</tr></table>
+<a href="about.htm">About</a>
+</body></html>"""
+FIND_A_BIBLE_PAGE = """<html><body><form>
+<div id="ctl00_Content"><h1>Arrernte, Western</h1>
+<span id="ctl00_Content_TranslationDescription">%s</span>
+<span id="ctl00_Content_Footnote">See also Arrernte, Eastern</span>
+</div></form></body></html>"""
+FIND_A_BIBLE_NO_RECORD_PAGE = """<html><body><form>
+<div id="ctl00_Content"><h1>Unknown</h1></div></form></body></html>"""
+
+
+class TestExtraction(unittest.TestCase):
+
+    def _assert_same_as_reference(self, extract, reference, pages):
+        for page in pages:
+            self.assertEqual(reference(page), extract(page))
+
+    def test_tindale_coordinates(self):
+        pages = [TINDALE_PAGE % (coordinates,) for coordinates in [
+            "139°5'E x 26°50'S", "134°20´E x 12°30´S", "139°15'Ex23°45'S",
+            "132°5'E x <b>ll°15'S</b>", "131&deg;40'E x l5&deg;55'S"]]
+        self._assert_same_as_reference(
+            extraction.extract_tindale_coordinates,
+            extraction.reference_tindale_coordinates, pages)
+        self.assertEqual(u"139\xb05'E x 26\xb050'S",
+                         extraction.extract_tindale_coordinates(pages[0]))
+
+    def test_tindale_index_hrefs(self):
+        self._assert_same_as_reference(
+            extraction.extract_tindale_index_hrefs,
+            extraction.reference_tindale_index_hrefs, [TINDALE_INDEX_PAGE])
+        self.assertEqual(
+            ["ngameni.htm", "ngarla.htm", "koko-.htm"],
+            extraction.extract_tindale_index_hrefs(TINDALE_INDEX_PAGE))
+
+    def test_find_a_bible_translation(self):
+        description = "The New Testament is known to have been completed " \
+                      "in this language in 1956."
+        pages = [FIND_A_BIBLE_PAGE % (description,),
+                 FIND_A_BIBLE_PAGE % ("",),
+                 FIND_A_BIBLE_NO_RECORD_PAGE]
+        self._assert_same_as_reference(
+            extraction.extract_find_a_bible_translation,
+            extraction.reference_find_a_bible_translation, pages)
+        self.assertEqual(
+            description,
+            extraction.extract_find_a_bible_translation(pages[0]))
+        self.assertIsNone(
+            extraction.extract_find_a_bible_translation(pages[2]))
+
+    def test_extract_all(self):
+        pages = [TINDALE_PAGE % ("%s°E x 20°S" % (n,),)
+                 for n in range(extraction.MIN_POOLED_PAGES + 10)]
+        expected = [extraction.reference_tindale_coordinates(page)
+                    for page in pages]
+        self.assertEqual(expected, extraction.extract_all(
+            extraction.extract_tindale_coordinates, pages, processes=2))
+        self.assertEqual(expected, extraction.extract_all(
+            extraction.extract_tindale_coordinates, pages, processes=1))
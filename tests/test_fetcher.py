@@ -0,0 +1,129 @@
+import BaseHTTPServer
+import SocketServer
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from language_explorer.fetcher import PooledFetcher, FetchError
+from language_explorer.language_sources.base import CachingWebLanguageSource
+
+__author__ = 'esteele'
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves /page/<n>, /slow/<n>, /flaky/<failures> and /broken, counting
+    requests per path"""
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           StandInHandler)
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s/" % (self.server_address[1],)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            count = server.requests[self.path]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+        try:
+            kind, _, arg = self.path[1:].partition("/")
+            if kind == "slow":
+                time.sleep(0.1)
+            if kind == "broken" or \
+                    (kind == "flaky" and count <= int(arg)):
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = "Body of %s" % (self.path,)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInSource(CachingWebLanguageSource):
+    SOURCE_NAME = "SI"
+
+
+class TestPooledFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.cache_root = tempfile.mkdtemp()
+        self.fetcher = PooledFetcher(workers=8, per_host=3, min_interval=0,
+                                     retries=2, backoff=0.01, timeout=5)
+        self.source = StandInSource(self.cache_root, self.fetcher)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_root)
+
+    def test_prefetch(self):
+        urls = [self.server.url + "page/%s" % (n,) for n in range(20)]
+        self.source.prefetch(urls + urls[:5])
+        self.assertEqual(20, sum(self.server.requests.values()))
+        # Read from the cache
+        self.assertEqual(u"Body of /page/3",
+                         self.source.get_text_from_url(urls[3]))
+        self.source.prefetch(urls)
+        self.assertEqual(20, sum(self.server.requests.values()))
+        # Nothing but the cached pages
+        self.assertEqual(20, len(os.listdir(self.cache_root)))
+
+    def test_per_host_concurrency(self):
+        self.source.prefetch([self.server.url + "slow/%s" % (n,)
+                              for n in range(12)])
+        self.assertEqual(3, self.server.max_in_flight)
+
+    def test_rate_limit(self):
+        self.fetcher.min_interval = 0.05
+        start = time.time()
+        self.source.prefetch([self.server.url + "page/%s" % (n,)
+                              for n in range(5)])
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_retries(self):
+        url = self.server.url + "flaky/2"
+        self.assertEqual(u"Body of /flaky/2",
+                         self.source.get_text_from_url(url))
+        self.assertEqual(3, self.server.requests["/flaky/2"])
+
+    def test_gives_up(self):
+        url = self.server.url + "broken"
+        self.assertRaises(FetchError, self.source.prefetch,
+                          [url, self.server.url + "page/1"])
+        # Retried, then neither cached nor left partly written
+        self.assertEqual(3, self.server.requests["/broken"])
+        self.assertEqual([self.source.generate_filename_from_url(
+            self.server.url + "page/1")], os.listdir(self.cache_root))
+
+    def test_connection_error(self):
+        # Nothing listens on port 1
+        self.assertRaises(FetchError, self.fetcher.fetch,
+                          "http://127.0.0.1:1/page/1")
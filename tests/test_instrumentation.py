@@ -0,0 +1,103 @@
+import os
+import tempfile
+from language_explorer import instrumentation
+from language_explorer.instrumentation import RunReport, recording, \
+    format_history
+from language_explorer.language_sources.base import \
+    AbstractLanguageSource, CachingWebLanguageSource
+from language_explorer.pipeline import Stage, run_stages, chunked
+from tests.test_baseclasses import PersistenceTestCase
+
+__author__ = 'esteele'
+
+
+class FakeSource(AbstractLanguageSource):
+    SOURCE_NAME = "FK"
+
+    def get_primary_name_for_iso(self, iso):
+        return "Name %s" % (iso,)
+
+    def persist_languages(self, persister, isos):
+        for iso in isos:
+            self.persist_language(persister, iso)
+
+
+class FakeWebSource(CachingWebLanguageSource):
+    SOURCE_NAME = "FW"
+
+
+class TestInstrumentation(PersistenceTestCase):
+
+    def setUp(self):
+        self.p = self.temp_persistence()
+
+    def test_counts_stages_and_sources(self):
+        source = FakeSource()
+
+        def direct(persister, results):
+            source.persist_language(persister, "ddd")
+            source.persist_language(persister, "ddd")
+
+        stages = [
+            Stage("languages",
+                  lambda persister, results, isos:
+                  source.persist_languages(persister, isos),
+                  split=lambda results: chunked(["aaa", "bbb", "ccc"], 2)),
+            Stage("direct", direct, requires=["languages"], direct=True),
+        ]
+        with recording(RunReport()) as report:
+            run_stages(stages, self.p)
+        report = report.as_dict()
+
+        self.assertEqual(["languages", "direct"], report["stages"].keys())
+        languages = report["stages"]["languages"]
+        self.assertEqual(3, languages["rows_written"])
+        self.assertEqual(3, languages["persisted"])
+        self.assertGreater(languages["statements"], 0)
+        self.assertGreater(languages["wall_time"], 0)
+        # The second write changes nothing
+        self.assertEqual(1, report["stages"]["direct"]["rows_written"])
+        self.assertEqual(2, report["stages"]["direct"]["persisted"])
+        self.assertEqual(["FK"], report["sources"].keys())
+        self.assertEqual(5, report["sources"]["FK"]["persisted"])
+        self.assertEqual(1, report["sources"]["FK"]["rows_written"])
+        self.assertGreater(report["max_rss_kb"], 0)
+
+        # Nothing is counted unless recording
+        self.p.persist_language("eee", "Epsilon", "JP")
+        self.assertEqual(1, report["stages"]["direct"]["rows_written"])
+
+    def test_counts_web_cache_use(self):
+        cache_root = tempfile.mkdtemp()
+        source = FakeWebSource(cache_root)
+        url = "http://example.com/cached"
+        with open(os.path.join(cache_root,
+                               source.generate_filename_from_url(url)),
+                  "w") as f:
+            f.write("cached")
+        with recording(RunReport()) as report:
+            with instrumentation.measure_source(source.SOURCE_NAME):
+                self.assertEqual("cached", source.get_text_from_url(url))
+                source.get_text_from_url(url)
+        counters = report.as_dict()["sources"]["FW"]
+        self.assertEqual(2, counters["cache_hits"])
+        self.assertEqual(0, counters["cache_misses"])
+
+    def test_history(self):
+        self.assertEqual([], self.p.get_load_runs())
+        for started, wall_time in [("2015-01-01T00:00:00", 10.0),
+                                   ("2015-02-01T00:00:00", 20.0)]:
+            with recording(RunReport()) as report:
+                with instrumentation.measure_stage("stage"):
+                    pass
+            report = report.as_dict()
+            report["started"] = started
+            report["wall_time"] = wall_time
+            self.p.persist_load_run(report)
+        runs = self.p.get_load_runs()
+        self.assertEqual(["2015-02-01T00:00:00", "2015-01-01T00:00:00"],
+                         [r["started"] for r in runs])
+        self.assertEqual(1, len(self.p.get_load_runs(1)))
+        lines = format_history(runs).splitlines()
+        self.assertEqual(["total", "10.0", "20.0"], lines[1].split())
+        self.assertEqual("stage stage", lines[2][:11])
@@ -63,3 +63,21 @@ class TestJPHarvestAdapter(BaseAdapterTestCase):
             # bdy has no translation date
         ]
         self._do_test_get_translation_info(iso_translation_pairs)
+
+
+class TestPrefetchingJPHarvestAdapter(TestJPHarvestAdapter):
+
+    def setUp(self):
+        self.source = JPHarvestAdapter(settings.JPHARVEST_DB_URL,
+                                       prefetch=True)
+
+    def test_same_as_per_iso_queries(self):
+        per_iso_source = JPHarvestAdapter(settings.JPHARVEST_DB_URL)
+        # Includes ISOs that are prefetched, not Australian and unknown
+        for iso in ["aly", "amx", "bdy", "eng", "zzz"]:
+            for method in ["get_primary_name_for_iso",
+                           "get_alternate_names_for_iso",
+                           "get_L1_speaker_count_for_iso",
+                           "get_translation_info_for_iso"]:
+                self.assertEquals(getattr(per_iso_source, method)(iso),
+                                  getattr(self.source, method)(iso))
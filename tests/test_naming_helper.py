@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import csv
+import os
+import random
 from language_explorer import naming_helper
 from language_explorer import data_massaging
 from language_explorer.persistence import CacheableAliasRow
 import unittest
 
+CENSUS_LANGUAGE_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "data", "census_2011_LANP.csv")
+
 
 class NamingHelperTestCase(unittest.TestCase):
     def setUp(self):
@@ -120,3 +126,57 @@ class NamingHelperTestCase(unittest.TestCase):
         t = (CacheableAliasRow("gbd", "Guradjara", "_", "_"),)
         self.assertEquals(self.nh.summarise_list_as_dict(t)["grtyrA"],
                           set([]))
+
+    def test_signature_matches_reference(self):
+        with open(CENSUS_LANGUAGE_CSV) as f:
+            names = [row[1] for row in csv.reader(f) if len(row) > 2]
+        # Strings built from the letters the mappings care about, to
+        #  exercise interactions between rules
+        r = random.Random(0)
+        names.extend("".join(r.choice("aeiouyjdtnhkpgmbrw' -")
+                             for _ in range(r.randint(1, 12)))
+                     for _ in range(20000))
+        self.assertEqual(
+            [naming_helper.NamingHelper.reference_signature(n)
+             for n in names],
+            self.nh.signatures(names))
+        # Cached results are the same as freshly computed ones
+        self.assertEqual(
+            [naming_helper.NamingHelper.reference_signature(n)
+             for n in names],
+            [self.nh.signature(n) for n in names])
+
+    def test_levenshtein(self):
+        self.assertEqual(0, naming_helper.levenshtein("lywrA", "lywrA"))
+        self.assertEqual(1, naming_helper.levenshtein("lywr", "lywrA"))
+        self.assertEqual(2, naming_helper.levenshtein("ngrA", "nrgA"))
+        self.assertEqual(5, naming_helper.levenshtein("", "mtbrA"))
+
+    def test_bk_tree_matches_brute_force(self):
+        r = random.Random(0)
+        words = ["".join(r.choice("bgmnrtwy") for _ in range(r.randint(1, 7)))
+                 for _ in range(500)]
+        tree = naming_helper.BKTree(words)
+        for query in words[:50]:
+            for max_distance in (0, 1, 2):
+                self.assertEqual(
+                    sorted(set((naming_helper.levenshtein(query, w), w)
+                               for w in words
+                               if naming_helper.levenshtein(query, w) <=
+                               max_distance)),
+                    tree.search(query, max_distance))
+
+    def test_find_isos_fuzzy(self):
+        index = naming_helper.SignatureIndex(
+            [CacheableAliasRow("aly", "Alyawarra", "_", "_"),
+             CacheableAliasRow("aly", "Alyawarr", "_", "_"),
+             CacheableAliasRow("nck", "Nakkara", "_", "_")])
+        self.assertEqual([("aly", 0)],
+                         index.find_isos_fuzzy("Iliaura", 0))
+        # Added after the tree is built
+        index.add("dwm", "Mudbura")
+        self.assertEqual([("dwm", 1)],
+                         index.find_isos_fuzzy("Mudbur", 1))
+        # Ties ordered by iso
+        self.assertEqual([("aly", 0), ("dwm", 3), ("nck", 3)],
+                         index.find_isos_fuzzy("Alyawarra", 3))
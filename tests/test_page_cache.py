@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from language_explorer import constants
+from language_explorer.language_sources.findabible import FindABibleAdapter
+from language_explorer.page_cache import DirectoryPageStore, \
+    PackedPageStore, migrate, open_page_store
+
+__author__ = 'esteele'
+
+
+class TestPackedPageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_back(self):
+        store = PackedPageStore(self.root)
+        store.write("a", "Page a")
+        store.write("b", "Page b" * 1000)
+        store.write("a", "Page a, again")
+        self.assertEqual("Page a, again", store.read("a"))
+        fingerprint = store.fingerprint()
+        store.close()
+
+        store = PackedPageStore(self.root)
+        self.assertEqual(["a", "b"], store.keys())
+        self.assertEqual("Page b" * 1000, store.read("b"))
+        self.assertEqual("Page a, again", store.read("a"))
+        self.assertEqual(fingerprint, store.fingerprint())
+        self.assertNotIn("c", store)
+        store.close()
+        # Compressed
+        self.assertLess(os.path.getsize(store.pack_path), 1000)
+
+    def test_recovery(self):
+        store = PackedPageStore(self.root)
+        store.write("a", "Page a")
+        store.write("b", "Page b")
+        store.close()
+        # The index is missing b, and c was cut off part way through
+        with open(store.index_path) as f:
+            lines = f.readlines()
+        with open(store.index_path, "w") as f:
+            f.write(lines[0] + lines[1][:5])
+        pack_size = os.path.getsize(store.pack_path)
+        with open(store.pack_path, "ab") as f:
+            f.write(PackedPageStore.RECORD_HEADER.pack(
+                PackedPageStore.RECORD_MAGIC, 1, "x" * 20, 100) + "c")
+
+        store = PackedPageStore(self.root)
+        self.assertEqual(["a", "b"], store.keys())
+        self.assertEqual("Page b", store.read("b"))
+        self.assertEqual(pack_size, os.path.getsize(store.pack_path))
+        store.write("c", "Page c")
+        store.close()
+        store = PackedPageStore(self.root)
+        self.assertEqual("Page c", store.read("c"))
+        store.close()
+
+        # Or recovered entirely from the pack
+        os.remove(store.index_path)
+        store = PackedPageStore(self.root)
+        self.assertEqual(["a", "b", "c"], store.keys())
+        self.assertEqual("Page a", store.read("a"))
+        store.close()
+
+    def test_shared_between_processes(self):
+        # Each store has its own lock on the pack, as in separate processes
+        first = PackedPageStore(self.root)
+        first.write("a", "Page a")
+        second = PackedPageStore(self.root)
+        second.write("b", "Page b")
+        first.write("c", "Page c")
+
+        # Opening while a page is part way through being written waits
+        #  for it, rather than discarding it as cut off
+        opened = []
+        with first._process_lock():
+            first._pack.write(PackedPageStore.RECORD_HEADER.pack(
+                PackedPageStore.RECORD_MAGIC, 1, "x" * 20, 100) + "d")
+            first._pack.flush()
+            opener = threading.Thread(
+                target=lambda: opened.append(PackedPageStore(self.root)))
+            opener.start()
+            opener.join(0.2)
+            self.assertEqual([], opened)
+            first._pack.write("x" * 100)
+            first._pack.flush()
+        opener.join()
+        third, = opened
+        self.assertEqual(["a", "b", "c", "d"], third.keys())
+        self.assertEqual("Page b", third.read("b"))
+        for store in (first, second, third):
+            store.close()
+
+    def test_page_file_mode(self):
+        DirectoryPageStore(self.root).write("a", "Page a")
+        umask = os.umask(0)
+        os.umask(umask)
+        # As any other new file would be, not only readable by its owner
+        self.assertEqual(0666 & ~umask, os.stat(
+            os.path.join(self.root, "a")).st_mode & 0777)
+
+    def test_migrate(self):
+        directory = DirectoryPageStore(self.root)
+        pages = dict(("http~##example_org#%s" % (n,), "Page %s" % (n,))
+                     for n in range(5))
+        for key, page in pages.iteritems():
+            directory.write(key, page)
+        fingerprints = dict((key, directory.page_fingerprint(key))
+                            for key in pages)
+        # Not pages
+        os.mkdir(os.path.join(self.root, "records"))
+        open(os.path.join(self.root, ".partial"), "w").close()
+
+        self.assertEqual(5, migrate(self.root))
+        # Already packed
+        self.assertEqual(0, migrate(self.root, remove=True))
+        open_page_store(self.root).close()
+        self.assertEqual(sorted([PackedPageStore.PACK_FILENAME,
+                                 PackedPageStore.INDEX_FILENAME, "records",
+                                 ".partial"]), sorted(os.listdir(self.root)))
+        store = PackedPageStore(self.root)
+        self.assertEqual(sorted(pages), store.keys())
+        for key, page in pages.iteritems():
+            self.assertEqual(page, store.read(key))
+            self.assertEqual(fingerprints[key], store.page_fingerprint(key))
+        store.close()
+
+    def test_source_reads_pack(self):
+        source = FindABibleAdapter(self.root)
+        self.assertIsInstance(source.page_store, DirectoryPageStore)
+        source.page_store.write(source.generate_filename_from_url(
+            source.ONE_LANGUAGE_URL_TEMPLATE % ("are",)),
+            "<span id='TranslationDescription'>The Bible is known to have "
+            "been completed in this language in 2007</span>")
+        migrate(self.root, remove=True)
+
+        source = FindABibleAdapter(os.path.join(self.root, "."))
+        self.assertIsInstance(source.page_store, PackedPageStore)
+        self.assertIs(source.page_store, open_page_store(self.root))
+        self.assertEqual(
+            {constants.TRANSLATION_STATE_STATE_KEY:
+             constants.TRANSLATION_STATE_WHOLE_BIBLE,
+             constants.TRANSLATION_STATE_YEAR_KEY: 2007},
+            source.get_translation_info_for_iso("are"))
@@ -1,11 +1,11 @@
-import unittest
 from language_explorer.persistence import LanguagePersistence
 from language_explorer import settings
+from tests.test_baseclasses import PersistenceTestCase
 
 __author__ = 'esteele'
 
 
-class TestPersistence(unittest.TestCase):
+class TestPersistence(PersistenceTestCase):
 
     def setUp(self):
         self.p = LanguagePersistence(settings.LANGUAGE_EXPLORER_DB_URL)
@@ -48,3 +48,177 @@ class TestPersistence(unittest.TestCase):
              ]
         for name, iso_list in name_iso_list:
             self.assertEqual(iso_list, self.p.get_iso_list_from_name(name))
+
+    def test_signature_index_follows_writes(self):
+        p = LanguagePersistence("sqlite:///:memory:")
+        p.persist_language("aly", "Alyawarra", "JP")
+        self.assertEqual(["aly"], p.get_iso_list_from_name("Iliaura"))
+        signature_index = p.get_signature_index()
+        p.persist_alternate("dwm", "Mudbura", "WA")
+        with p.batch():
+            p.persist_language("nck", "Nakkara", "AL")
+            # Has a NO_ISO signature override
+            p.persist_language("gbd", "Guradjara", "AL")
+        # Updated in place, rather than rebuilt
+        self.assertIs(signature_index, p.get_signature_index())
+        self.assertEqual(["dwm"], p.get_iso_list_from_name("Mootburra"))
+        self.assertEqual([("dwm", 1)], p.find_isos_fuzzy("Mudbur", 1))
+        self.assertEqual(["nck"], p.get_iso_list_from_name("Na-kara"))
+        self.assertEqual(["gbd"], p.get_iso_list_from_name("Guradjara"))
+        self.assertEqual([], p.get_iso_list_from_name("Guratjara"))
+        rebuilt_index = p._build_signature_index()
+        self.assertEqual(rebuilt_index.isos_by_name,
+                         signature_index.isos_by_name)
+        self.assertEqual(rebuilt_index.isos_by_signature,
+                         signature_index.isos_by_signature)
+
+    def test_backfill_signatures(self):
+        p = LanguagePersistence("sqlite:///:memory:")
+        # As written before aliases had signatures
+        p.lang_db[LanguagePersistence.ALIAS_TABLE].insert_many([
+            dict(iso="aly", alias_type="p", name="Alyawarra", source="JP"),
+            dict(iso="nck", alias_type="p", name="Nakkara", source="JP")])
+        p.persist_alternate("nck", "Nagara", "AL")
+        self.assertEqual(2, p.backfill_signatures())
+        self.assertEqual(0, p.backfill_signatures())
+        self.assertEqual(
+            {"Alyawarra": "lywrA", "Nakkara": "ngrA", "Nagara": "ngrA"},
+            dict((row["name"], row["signature"]) for row in
+                 p.lang_db[LanguagePersistence.ALIAS_TABLE].all()))
+        self.assertEqual(["nck"], p.get_iso_list_from_name("Na-kara"))
+
+    def test_alias_index_lookups(self):
+        p = LanguagePersistence("sqlite:///:memory:")
+        p.persist_language("aaa", "Zed", "JP")
+        p.persist_language("aaa", "Alpha", "AL")
+        p.persist_alternate("aaa", "Bee", "WA")
+        p.persist_alternate("aaa", "Ant", "WA")
+        p.persist_dialect("bbb", "Dee", "JP")
+        self.assertEqual({"JP": ["Zed"], "AL": ["Alpha"]},
+                         p.get_primary_names_by_iso("aaa"))
+        self.assertEqual({"WA": ["Ant", "Bee"]},
+                         p.get_alternate_names_by_iso("aaa"))
+        self.assertEqual({"JP": ["Dee"]}, p.get_dialect_names_by_iso("bbb"))
+        self.assertEqual({}, p.get_dialect_names_by_iso("aaa"))
+        self.assertEqual("Zed", p.get_primary_name_for_display("aaa"))
+        # Writes must be visible to subsequent lookups
+        p.persist_alternate("aaa", "Aardvark", "WA")
+        self.assertEqual({"WA": ["Aardvark", "Ant", "Bee"]},
+                         p.get_alternate_names_by_iso("aaa"))
+
+    def test_batch_writes(self):
+        p = LanguagePersistence("sqlite:///:memory:")
+        p.persist_L1_speaker_count("aaa", 10, "JP")
+        with p.batch():
+            p.persist_language("aaa", "Alpha", "JP")
+            p.persist_language("aaa", "Alpha", "JP")  # duplicate
+            p.persist_L1_speaker_count("aaa", 20, "JP")  # update
+            p.persist_L1_speaker_count("bbb", 30, "CN")  # insert
+            # Buffered writes aren't visible until the batch exits
+            self.assertEqual({}, p.get_primary_names_by_iso("aaa"))
+        self.assertEqual({"JP": ["Alpha"]}, p.get_primary_names_by_iso("aaa"))
+        self.assertEqual(20, p.get_L1_speaker_count_by_iso("aaa", "JP"))
+        self.assertEqual(30, p.get_L1_speaker_count_by_iso("bbb", "CN"))
+
+    def test_batch_discarded_on_error(self):
+        p = LanguagePersistence("sqlite:///:memory:")
+        with self.assertRaises(ValueError):
+            with p.batch():
+                p.persist_language("aaa", "Alpha", "JP")
+                raise ValueError()
+        self.assertEqual([], p.get_all_iso_codes())
+
+    def test_language_summary_round_trip(self):
+        db_url = self.temp_db_url()
+        p = LanguagePersistence(db_url)
+        p.persist_language("aaa", "Alpha", "JP")
+        p.persist_L1_speaker_count("aaa", 20, "JP")
+        p.persist_lat_lon("aaa", -20.0, 130.0)
+        p.persist_L1_speaker_count("bbb", 5, "CN")
+        p.persist_translation("aaa", {"TS": 4, "YR": 1990}, "JP")
+        p.persist_relationship("bbb", [("M", "aaa")], "SI")
+        computed_map_data = p.get_map_data()
+        computed_table_data = p.get_table_data()
+        p.refresh_language_summary()
+        # Read the stored summary
+        p2 = LanguagePersistence(db_url)
+        self.assertEqual(computed_map_data, p2.get_map_data())
+        self.assertEqual(computed_table_data, p2.get_table_data())
+        # bbb has a language row, but no names
+        self.assertEqual(["aaa", "bbb"], [r[0] for r in p2.get_map_data()])
+        self.assertEqual(["aaa"], [r[0] for r in p2.get_table_data()])
+
+    def test_check_for_updates(self):
+        db_url = self.temp_db_url()
+        writer = LanguagePersistence(db_url)
+        writer.persist_language("aaa", "Alpha", "JP")
+        writer.persist_translation("aaa", {"TS": 4, "YR": 1990}, "JP")
+        reader = LanguagePersistence(db_url)
+        self.assertEqual({"JP": ["Alpha"]},
+                         reader.get_primary_names_by_iso("aaa"))
+        self.assertEqual(4, reader.get_best_translation_state("aaa"))
+        self.assertEqual([], reader.check_for_updates())
+
+        writer.persist_language("aaa", "Aleph", "AL")
+        # Cached until the reader checks
+        self.assertEqual({"JP": ["Alpha"]},
+                         reader.get_primary_names_by_iso("aaa"))
+        self.assertEqual([LanguagePersistence.ALIAS_TABLE],
+                         reader.check_for_updates())
+        self.assertEqual({"JP": ["Alpha"], "AL": ["Aleph"]},
+                         reader.get_primary_names_by_iso("aaa"))
+        # Only caches derived from the alias table were dropped
+        self.assertIn("translation_state", reader._caches)
+
+    def test_data_generation(self):
+        db_url = self.temp_db_url()
+        writer = LanguagePersistence(db_url)
+        writer.persist_language("aaa", "Alpha", "JP")
+        reader = LanguagePersistence(db_url)
+        generation = reader.get_data_generation()
+
+        # Loader bookkeeping doesn't count
+        writer.persist_load_state("iso_list", {"result": []})
+        reader.check_for_updates()
+        self.assertEqual(generation, reader.get_data_generation())
+
+        writer.persist_language("aaa", "Aleph", "AL")
+        # Not until the reader checks
+        self.assertEqual(generation, reader.get_data_generation())
+        reader.check_for_updates()
+        self.assertNotEqual(generation, reader.get_data_generation())
+        self.assertEqual(writer.get_data_generation(),
+                         reader.get_data_generation())
+
+    def test_changed_isos(self):
+        p = self.temp_persistence()
+        p.persist_language("aaa", "Alpha", "JP")
+        p.persist_L1_speaker_count("aaa", 20, "JP")
+        self.assertEqual(
+            {LanguagePersistence.ALIAS_TABLE: {"inserted": ["aaa"]},
+             LanguagePersistence.LANGUAGE_TABLE: {"inserted": ["aaa"]}},
+            p.take_changed_isos())
+
+        with p.batch():
+            p.persist_L1_speaker_count("aaa", 25, "JP")
+            p.persist_L1_speaker_count("bbb", 5, "JP")
+            p.persist_relationship("bbb", [("M", "aaa")], "SI")
+            # Unchanged
+            p.persist_language("aaa", "Alpha", "JP")
+        p.persist_load_state("iso_list", {"result": []})
+        self.assertEqual(
+            {LanguagePersistence.LANGUAGE_TABLE:
+             {"inserted": ["bbb"], "updated": ["aaa"]},
+             LanguagePersistence.RELATIONSHIP_TABLE:
+             {"inserted": ["bbb"]}},
+            p.take_changed_isos())
+        self.assertEqual({}, p.take_changed_isos())
+
+    def test_is_known_iso(self):
+        p = self.temp_persistence()
+        self.assertFalse(p.is_known_iso("aaa"))
+        p.persist_relationship("bbb", [("M", "aaa")], "SI")
+        p.persist_L1_speaker_count("ccc", 5, "JP")
+        for iso in ["aaa", "bbb", "ccc"]:
+            self.assertTrue(p.is_known_iso(iso))
+        self.assertFalse(p.is_known_iso("zzz"))
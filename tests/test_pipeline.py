@@ -0,0 +1,214 @@
+import time
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.pipeline import Stage, run_stages, check_stages, \
+    chunked
+from tests.test_baseclasses import PersistenceTestCase
+
+__author__ = 'esteele'
+
+
+def _alias_rows(p):
+    return [(row["id"], row["iso"], row["name"], row["source"]) for row in
+            p.lang_db[LanguagePersistence.ALIAS_TABLE].all()]
+
+
+class TestPipeline(PersistenceTestCase):
+
+    def _stages(self):
+        def slow_names(persister, results, isos):
+            # Finish after the stages declared later
+            time.sleep(0.2)
+            for iso in isos:
+                persister.persist_language(iso, "Name %s" % (iso,), "JP")
+
+        def other_names(persister, results):
+            persister.persist_language("zzz", "Last", "WA")
+
+        def count_isos(persister, results):
+            return len(persister.get_all_iso_codes())
+
+        def direct(persister, results):
+            persister.persist_language("yyy", "Direct", "TI")
+            return len(persister.get_all_iso_codes())
+
+        return [
+            Stage("isos", lambda persister, results: ["aaa", "bbb", "ccc"]),
+            Stage("names", slow_names, requires=["isos"],
+                  split=lambda results: chunked(results["isos"], 2)),
+            Stage("other_names", other_names),
+            Stage("count", count_isos, requires=["names", "other_names"]),
+            Stage("direct", direct, requires=["count"], direct=True),
+        ]
+
+    def test_matches_sequential_run(self):
+        p = self.temp_persistence()
+        results = run_stages(self._stages(), p)
+        self.assertEqual(["aaa", "bbb", "ccc"], results["isos"])
+        self.assertEqual([None, None], results["names"])
+        self.assertEqual(4, results["count"])
+        self.assertEqual(5, results["direct"])
+
+        sequential_p = self.temp_persistence()
+        sequential_results = {}
+        for stage in self._stages():
+            if stage.split:
+                sequential_results[stage.name] = [
+                    stage.run(sequential_p, sequential_results, chunk)
+                    for chunk in stage.split(sequential_results)]
+            else:
+                sequential_results[stage.name] = stage.run(
+                    sequential_p, sequential_results)
+        self.assertEqual(sequential_results, results)
+        self.assertEqual(_alias_rows(sequential_p), _alias_rows(p))
+
+    def test_stage_error(self):
+        def fail(persister, results):
+            raise ValueError("Stage failed")
+        p = self.temp_persistence()
+        stages = self._stages()
+        stages.insert(2, Stage("fail", fail))
+        self.assertRaises(ValueError, run_stages, stages, p)
+        # Stages before the failure were written
+        self.assertEqual(["aaa", "bbb", "ccc"], p.get_all_iso_codes())
+
+    def test_requires_declared_stages(self):
+        stages = self._stages()
+        stages.reverse()
+        self.assertRaises(ValueError, check_stages, stages)
+
+
+class TestLoadState(PersistenceTestCase):
+
+    def setUp(self):
+        self.p = self.temp_persistence()
+        self.source = {"isos": ["aaa", "bbb", "ccc"], "isos_version": 1,
+                       "names_version": 1, "other": "Last", "fail": False,
+                       "fail_iso": None}
+        self.calls = []
+
+    def _stages(self):
+        def isos(persister, results):
+            self.calls.append("isos")
+            return list(self.source["isos"])
+
+        def names(persister, results, isos):
+            self.calls.append(("names", isos))
+            if self.source["fail_iso"] in isos:
+                raise ValueError("Chunk failed")
+            for iso in isos:
+                persister.persist_language(iso, "Name %s" % (iso,), "JP")
+
+        def other(persister, results):
+            self.calls.append("other")
+            if self.source["fail"]:
+                raise ValueError("Stage failed")
+            persister.persist_language("zzz", self.source["other"], "WA")
+
+        def count(persister, results):
+            self.calls.append("count")
+            return len(persister.get_all_iso_codes())
+
+        return [
+            Stage("isos", isos, inputs=["isos"]),
+            Stage("names", names, requires=["isos"], inputs=["names"],
+                  split=lambda results: chunked(results["isos"], 2),
+                  incremental=True),
+            Stage("other", other, inputs=["other"]),
+            Stage("count", count, requires=["names", "other"], direct=True),
+        ]
+
+    def _run(self, force=False):
+        fingerprints = dict(
+            (name, lambda name=name: self.source[name + "_version"])
+            for name in ["isos", "names"])
+        fingerprints["other"] = lambda: self.source["other"]
+        self.calls = []
+        results = run_stages(self._stages(), self.p,
+                             fingerprints=fingerprints, force=force)
+        return results, sorted(self.calls)
+
+    def test_skips_unchanged_stages(self):
+        results, calls = self._run()
+        self.assertEqual(["count", "isos", "other",
+                          ("names", ["aaa", "bbb"]), ("names", ["ccc"])],
+                         calls)
+        self.assertEqual(4, results["count"])
+        self.assertEqual((results, []), self._run())
+
+        # Rerun with the same result, so later stages have nothing new
+        self.source["isos_version"] = 2
+        self.assertEqual(["isos"], self._run()[1])
+
+        self.source["other"] = "Omega"
+        self.assertEqual(["count", "other"], self._run()[1])
+        self.assertIn("Omega", self.p.get_primary_names_by_iso("zzz")["WA"])
+
+        results, calls = self._run(force=True)
+        self.assertEqual(["count", "isos", "other",
+                          ("names", ["aaa", "bbb"]), ("names", ["ccc"])],
+                         calls)
+
+    def test_changes_pass_through_stages(self):
+        # c only requires b, which reads what a wrote but writes nothing
+        def a(persister, results):
+            self.calls.append("a")
+            persister.persist_L1_speaker_count(
+                "aaa", self.source["isos_version"], "JP")
+
+        def b(persister, results):
+            self.calls.append("b")
+
+        def c(persister, results):
+            self.calls.append("c")
+            return persister.get_L1_speaker_count_by_iso("aaa", "JP")
+
+        stages = [Stage("a", a, inputs=["isos"]),
+                  Stage("b", b, requires=["a"]),
+                  Stage("c", c, requires=["b"], direct=True)]
+        fingerprints = {"isos": lambda: self.source["isos_version"]}
+        run_stages(stages, self.p, fingerprints=fingerprints)
+        self.source["isos_version"] = 2
+        self.calls = []
+        results = run_stages(stages, self.p, fingerprints=fingerprints)
+        self.assertEqual(["a", "b", "c"], sorted(self.calls))
+        self.assertEqual(2, results["c"])
+        self.calls = []
+        run_stages(stages, self.p, fingerprints=fingerprints)
+        self.assertEqual([], self.calls)
+
+    def test_runs_on_new_items(self):
+        self._run()
+        self.source["isos"].append("ddd")
+        self.source["isos_version"] = 2
+        results, calls = self._run()
+        self.assertEqual(["count", "isos", ("names", ["ddd"])], calls)
+        self.assertEqual(5, results["count"])
+        self.assertEqual(["aaa", "bbb", "ccc", "ddd", "zzz"],
+                         self.p.get_all_iso_codes())
+
+        # A change to the stage's own input means running on every item
+        self.source["names_version"] = 2
+        self.assertEqual([("names", ["aaa", "bbb"]),
+                          ("names", ["ccc", "ddd"])], self._run()[1])
+
+    def test_reruns_after_failure(self):
+        self.source["fail"] = True
+        self.assertRaises(ValueError, self._run)
+        self.source["fail"] = False
+        results, calls = self._run()
+        self.assertEqual(["count", "other"], calls)
+        self.assertEqual(4, results["count"])
+
+    def test_resumes_within_stage(self):
+        self.source["fail_iso"] = "ccc"
+        self.assertRaises(ValueError, self._run)
+        # The chunk before the failure was written
+        self.assertEqual(["aaa", "bbb"], self.p.get_all_iso_codes())
+        self.source["fail_iso"] = None
+        results, calls = self._run()
+        self.assertEqual(["count", "other", ("names", ["ccc"])], calls)
+        self.assertEqual([None, None], results["names"])
+        self.assertEqual(4, results["count"])
+        self.assertEqual(["aaa", "bbb", "ccc"],
+                         self.p.get_load_state()["names"]["items"])
+        self.assertEqual([], self._run()[1])
@@ -0,0 +1,156 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from flask import Flask, abort
+from language_explorer.response_cache import ResponseCache, \
+    MemoryPageStore, DiskPageStore, CachedPage
+
+__author__ = 'esteele'
+
+
+def _make_app(cache):
+    """An app whose pages count how often they've been rendered"""
+    app = Flask(__name__)
+    app.renders = 0
+
+    @app.route("/language/iso/<iso>")
+    @cache.cached
+    def show_language(iso):
+        if iso == "zzz":
+            abort(404)
+        app.renders += 1
+        return "<p>%s</p>" % (iso,) * 100
+    return app
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.generation = "g1"
+        self.generation_checks = 0
+        self.cache = ResponseCache(self._data_generation,
+                                   [MemoryPageStore(10)])
+        self.app = _make_app(self.cache)
+        self.client = self.app.test_client()
+
+    def _data_generation(self):
+        self.generation_checks += 1
+        return self.generation
+
+    def test_rendered_once_per_generation(self):
+        first = self.client.get("/language/iso/aaa")
+        self.assertEqual(200, first.status_code)
+        second = self.client.get("/language/iso/aaa")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.client.get("/language/iso/bbb")
+        self.assertEqual(2, self.app.renders)
+
+        self.generation = "g2"
+        self.cache.check_generation()
+        third = self.client.get("/language/iso/aaa")
+        self.assertEqual(first.data, third.data)
+        self.assertEqual(3, self.app.renders)
+
+        # Not found pages aren't cached
+        for _ in range(2):
+            self.assertEqual(
+                404, self.client.get("/language/iso/zzz").status_code)
+
+    def test_not_modified(self):
+        etag = self.client.get("/language/iso/aaa").headers["ETag"]
+        response = self.client.get("/language/iso/aaa",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual("", response.data)
+        self.assertEqual(etag, response.headers["ETag"])
+        response = self.client.get("/language/iso/aaa",
+                                   headers={"If-None-Match": '"other"'})
+        self.assertEqual(200, response.status_code)
+
+    def test_gzip(self):
+        plain = self.client.get("/language/iso/aaa")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        zipped = self.client.get("/language/iso/aaa",
+                                 headers={"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", zipped.headers["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", zipped.headers["Vary"])
+        self.assertLess(len(zipped.data), len(plain.data))
+        self.assertEqual(plain.data, gzip.GzipFile(
+            fileobj=StringIO(zipped.data)).read())
+        # A different representation, so a different ETag
+        self.assertNotEqual(plain.headers["ETag"], zipped.headers["ETag"])
+        self.assertEqual(304, self.client.get(
+            "/language/iso/aaa",
+            headers={"Accept-Encoding": "gzip",
+                     "If-None-Match": zipped.headers["ETag"]}).status_code)
+
+    def test_check_interval(self):
+        self.cache.check_interval = 60
+        for _ in range(3):
+            self.cache.check_generation()
+        self.assertEqual(1, self.generation_checks)
+        self.cache.check_interval = 0
+        self.cache.check_generation()
+        self.assertEqual(2, self.generation_checks)
+
+    def test_no_stores(self):
+        self.cache.stores = []
+        self.client.get("/language/iso/aaa")
+        self.client.get("/language/iso/aaa")
+        self.assertEqual(2, self.app.renders)
+
+
+class TestDiskPageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_shared_between_processes(self):
+        generation = ["g1"]
+        apps = []
+        for _ in range(2):
+            # Each with its own memory store, as a worker process would be
+            cache = ResponseCache(lambda: generation[0],
+                                  [MemoryPageStore(10),
+                                   DiskPageStore(self.root, 10)])
+            apps.append(_make_app(cache))
+        first = apps[0].test_client().get("/language/iso/aaa")
+        second = apps[1].test_client().get("/language/iso/aaa")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual([1, 0], [app.renders for app in apps])
+
+    def test_old_generations_removed(self):
+        store = DiskPageStore(self.root, 10)
+        page = CachedPage("<p>aaa</p>", None, "0a1b", "text/html")
+        store.put((u"/a", "g1"), page)
+        store.put((u"/b", "g1"), page)
+        self.assertEqual(page, store.get((u"/a", "g1")))
+        store.put((u"/a", "g2"), page)
+        self.assertIsNone(store.get((u"/b", "g1")))
+        self.assertEqual(page, store.get((u"/a", "g2")))
+
+    def test_size_limited(self):
+        store = DiskPageStore(self.root, 3)
+        page = CachedPage("<p>aaa</p>", None, "0a1b", "text/html")
+        for path in [u"/a", u"/b", u"/c"]:
+            store.put((path, "g1"), page)
+        # The least recently used is removed first
+        os.utime(store._path((u"/a", "g1")), (0, 0))
+        os.utime(store._path((u"/b", "g1")), (1, 1))
+        store.get((u"/a", "g1"))
+        store.put((u"/d", "g1"), page)
+        self.assertEqual(3, len(os.listdir(self.root)))
+        self.assertIsNone(store.get((u"/b", "g1")))
+        self.assertEqual(page, store.get((u"/a", "g1")))
+        # Counted afresh by a new store on the same directory
+        store = DiskPageStore(self.root, 3)
+        store.put((u"/e", "g1"), page)
+        self.assertEqual(3, len(os.listdir(self.root)))
@@ -0,0 +1,128 @@
+import os
+import tempfile
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.snapshot import SnapshotLanguagePersistence, \
+    MappedSnapshotLanguagePersistence, write_snapshot_file
+from tests.test_baseclasses import PersistenceTestCase, populate
+
+__author__ = 'esteele'
+
+
+class TestSnapshotPersistence(PersistenceTestCase):
+
+    def setUp(self):
+        self.db_url = self.temp_db_url()
+        self.p = LanguagePersistence(self.db_url)
+        populate(self.p)
+
+    def test_matches_db(self):
+        s = SnapshotLanguagePersistence(self.db_url)
+        for iso in ["aaa", "bbb", "zzz"]:
+            for method in ["get_primary_names_by_iso",
+                           "get_alternate_names_by_iso",
+                           "get_dialect_names_by_iso",
+                           "get_classifications_by_iso",
+                           "get_translations_by_iso",
+                           "get_relationships_by_iso",
+                           "get_english_competency_by_iso",
+                           "get_primary_name_for_display",
+                           "get_iso_list_from_iso",
+                           "get_lat_lon_from_iso",
+                           "get_tindale_lat_lon_from_iso",
+                           "get_best_translation_state",
+                           "iso_is_retired",
+                           "get_cannot_read_english_count",
+                           "format_iso"]:
+                self.assertEqual(getattr(self.p, method)(iso),
+                                 getattr(s, method)(iso), (method, iso))
+            self.assertEqual(self.p.get_L1_speaker_count_by_iso(iso, "JP"),
+                             s.get_L1_speaker_count_by_iso(iso, "JP"))
+            self.assertEqual(
+                self.p.get_external_references_by_iso(iso, "AL"),
+                s.get_external_references_by_iso(iso, "AL"))
+        for method in ["get_all_iso_codes",
+                       "get_same_name_different_iso_list",
+                       "get_table_data",
+                       "get_map_data",
+                       "get_search_table_data"]:
+            self.assertEqual(getattr(self.p, method)(),
+                             getattr(s, method)(), method)
+        self.assertEqual(
+            self.p.get_common_names_for_iso_list(["aaa", "bbb"]),
+            s.get_common_names_for_iso_list(["aaa", "bbb"]))
+
+    def test_read_only(self):
+        s = SnapshotLanguagePersistence(self.db_url)
+        self.assertRaises(RuntimeError, s.persist_language,
+                          "ccc", "Gamma", "JP")
+
+    def test_reloads_after_update(self):
+        s = SnapshotLanguagePersistence(self.db_url)
+        self.assertEqual([], s.check_for_updates())
+        self.p.persist_language("ccc", "Gamma", "JP")
+        self.assertEqual(["aaa", "bbb"], s.get_all_iso_codes())
+        self.assertEqual([LanguagePersistence.ALIAS_TABLE],
+                         s.check_for_updates())
+        self.assertEqual(["aaa", "bbb", "ccc"], s.get_all_iso_codes())
+
+    def test_load_bookkeeping_doesnt_reload(self):
+        s = SnapshotLanguagePersistence(self.db_url)
+        loads = []
+        s._load = lambda: loads.append(True)
+        self.p.persist_load_state("iso_list", {"result": []})
+        self.p.persist_load_run({"started": "2014-01-01T00:00:00",
+                                 "wall_time": 1.0})
+        self.assertEqual(sorted(LanguagePersistence.LOAD_TABLES),
+                         sorted(s.check_for_updates()))
+        self.assertEqual([], loads)
+
+
+class TestMappedSnapshotPersistence(PersistenceTestCase):
+
+    def setUp(self):
+        self.db_url = self.temp_db_url()
+        self.p = LanguagePersistence(self.db_url)
+        populate(self.p)
+
+    def test_matches_db(self):
+        snapshot_file = tempfile.NamedTemporaryFile(suffix=".snapshot")
+        write_snapshot_file(self.p, snapshot_file.name)
+        s = MappedSnapshotLanguagePersistence(self.db_url, snapshot_file.name)
+        for iso in ["aaa", "bbb", "zzz"]:
+            for method in ["get_primary_names_by_iso",
+                           "get_alternate_names_by_iso",
+                           "get_dialect_names_by_iso",
+                           "get_primary_name_for_display",
+                           "get_iso_list_from_iso"]:
+                self.assertEqual(getattr(self.p, method)(iso),
+                                 getattr(s, method)(iso), (method, iso))
+            for source in ["JP", "CN"]:
+                self.assertEqual(
+                    self.p.get_L1_speaker_count_by_iso(iso, source),
+                    s.get_L1_speaker_count_by_iso(iso, source))
+        self.assertEqual(self.p.get_all_iso_codes(), s.get_all_iso_codes())
+        self.assertEqual(self.p.get_map_data(), s.get_map_data())
+
+    def test_reloads_after_update(self):
+        snapshot_file = tempfile.NamedTemporaryFile(suffix=".snapshot")
+        write_snapshot_file(self.p, snapshot_file.name)
+        s = MappedSnapshotLanguagePersistence(self.db_url, snapshot_file.name)
+        self.p.persist_language("ccc", "Gamma", "JP")
+        s.check_for_updates()
+        self.assertEqual(["aaa", "bbb"], s.get_all_iso_codes())
+        write_snapshot_file(self.p, snapshot_file.name)
+        s.check_for_updates()
+        self.assertEqual(["aaa", "bbb", "ccc"], s.get_all_iso_codes())
+
+    def test_file_mode(self):
+        snapshot_dir = tempfile.mkdtemp()
+        snapshot_path = os.path.join(snapshot_dir, "snapshot")
+        self.addCleanup(os.rmdir, snapshot_dir)
+        self.addCleanup(os.remove, snapshot_path)
+        write_snapshot_file(self.p, snapshot_path)
+        umask = os.umask(0)
+        os.umask(umask)
+        # Readable by web workers running as other users
+        self.assertEqual(0666 & ~umask,
+                         os.stat(snapshot_path).st_mode & 0777)
+        self.assertEqual(["snapshot"], os.listdir(snapshot_dir))
@@ -0,0 +1,242 @@
+import os
+import tempfile
+import unittest
+from language_explorer.persistence import LanguagePersistence
+from language_explorer.pipeline import Stage, run_stages
+from language_explorer.snapshot import SnapshotLanguagePersistence, \
+    MappedSnapshotLanguagePersistence, write_snapshot_file
+from language_explorer.staging import StagingLanguagePersistence, \
+    ScratchLanguagePersistence
+from tests.test_baseclasses import PersistenceTestCase, populate
+
+__author__ = 'esteele'
+
+
+def _contents(p):
+    return dict(
+        (table_name, sorted(sorted((k, v) for k, v in row.iteritems()
+                                   if k != "id")
+                            for row in p.lang_db[table_name].all()))
+        for table_name in p.UPSERT_KEYS if table_name in p.lang_db.tables)
+
+
+class TestStagingPersistence(PersistenceTestCase):
+
+    def setUp(self):
+        self.db_url = self.temp_db_url()
+        self.p = LanguagePersistence(self.db_url)
+        self.p.persist_language("zzz", "Zeta", "JP")
+
+    def test_matches_live_writes(self):
+        expected = self.temp_persistence()
+        populate(expected)
+        staging = StagingLanguagePersistence(self.db_url)
+        populate(staging)
+        self.assertEqual(_contents(expected), _contents(staging))
+        # The live db is untouched until swapped
+        self.assertEqual(["zzz"], self.p.get_all_iso_codes())
+
+    def test_swap_in(self):
+        reader = LanguagePersistence(self.db_url)
+        snapshot_reader = SnapshotLanguagePersistence(self.db_url)
+        self.assertEqual({"JP": ["Zeta"]},
+                         reader.get_primary_names_by_iso("zzz"))
+        live_generations = self.p.get_table_generations()
+
+        staging = StagingLanguagePersistence(self.db_url)
+        populate(staging)
+        staging.swap_in()
+        self.assertFalse(os.path.exists(staging.staging_path))
+
+        # Cached until the readers check
+        self.assertEqual({"JP": ["Zeta"]},
+                         reader.get_primary_names_by_iso("zzz"))
+        self.assertIn(LanguagePersistence.ALIAS_TABLE,
+                      reader.check_for_updates())
+        self.assertEqual({}, reader.get_primary_names_by_iso("zzz"))
+        self.assertEqual(["aaa", "bbb"], reader.get_all_iso_codes())
+        self.assertEqual(15, reader.get_L1_speaker_count_by_iso("aaa", "CN"))
+        self.assertTrue(snapshot_reader.check_for_updates())
+        self.assertEqual(["aaa", "bbb"], snapshot_reader.get_all_iso_codes())
+
+        # Generations only ever increase
+        generations = reader.get_table_generations()
+        for table_name, generation in live_generations.iteritems():
+            self.assertGreater(generations[table_name], generation)
+
+    def test_swap_in_snapshot(self):
+        populate(self.p)
+        snapshot_file = tempfile.NamedTemporaryFile(suffix=".snapshot")
+        snapshot_path = snapshot_file.name
+        write_snapshot_file(self.p, snapshot_path)
+        reader = MappedSnapshotLanguagePersistence(self.db_url,
+                                                   snapshot_path)
+
+        staging = StagingLanguagePersistence(self.db_url,
+                                             snapshot_path=snapshot_path)
+        populate(staging)
+        write_snapshot_file(staging,
+                            staging.get_snapshot_write_path(snapshot_path))
+        # Not served until the db it was written from is
+        reader.check_for_updates()
+        self.assertEqual(["aaa", "bbb", "zzz"], reader.get_all_iso_codes())
+        staging.swap_in()
+        self.assertFalse(os.path.exists(
+            staging.get_snapshot_write_path(snapshot_path)))
+        reader.check_for_updates()
+        self.assertEqual(["aaa", "bbb"], reader.get_all_iso_codes())
+
+    def test_incremental_load(self):
+        populate(self.p)
+        self.p.persist_load_state("names", {"result": None})
+        reader = LanguagePersistence(self.db_url)
+        seen = []
+
+        def names(persister, results):
+            persister.persist_language("ccc", "Gamma", "JP")
+
+        def speakers(persister, results):
+            reader.check_for_updates()
+            seen.append((reader.get_all_iso_codes(),
+                         reader.get_L1_speaker_count_by_iso("aaa", "JP")))
+            persister.persist_L1_speaker_count("aaa", 30, "JP")
+
+        staging = StagingLanguagePersistence(self.db_url, copy_live=True)
+        self.assertEqual(self.p.get_load_state(), staging.get_load_state())
+        run_stages([Stage("names", names),
+                    Stage("speakers", speakers, requires=["names"],
+                          direct=True)], staging)
+        # Part way through, and once written, readers see the previous load
+        reader.check_for_updates()
+        for isos, speaker_count in seen + [
+                (reader.get_all_iso_codes(),
+                 reader.get_L1_speaker_count_by_iso("aaa", "JP"))]:
+            self.assertEqual(["aaa", "bbb", "zzz"], isos)
+            self.assertEqual(20, speaker_count)
+        self.assertEqual(
+            {LanguagePersistence.ALIAS_TABLE: {"inserted": ["ccc"]},
+             LanguagePersistence.LANGUAGE_TABLE: {"updated": ["aaa"]}},
+            staging.take_changed_isos())
+
+        staging.swap_in()
+        # Only the tables the load changed are read afresh
+        self.assertEqual(
+            sorted([LanguagePersistence.GENERATION_TABLE,
+                    LanguagePersistence.ALIAS_TABLE,
+                    LanguagePersistence.LANGUAGE_TABLE]),
+            sorted(reader.check_for_updates()))
+        self.assertEqual(["aaa", "bbb", "ccc", "zzz"],
+                         reader.get_all_iso_codes())
+        self.assertEqual(30, reader.get_L1_speaker_count_by_iso("aaa", "JP"))
+
+    def test_discards_incomplete_load(self):
+        staging = StagingLanguagePersistence(self.db_url)
+        staging.persist_language("aaa", "Alpha", "JP")
+        staging = StagingLanguagePersistence(self.db_url)
+        self.assertEqual([], staging.get_all_iso_codes())
+
+    def test_resume(self):
+        self.assertFalse(StagingLanguagePersistence.exists(self.db_url))
+        staging = StagingLanguagePersistence(self.db_url)
+        staging.persist_language("aaa", "Alpha", "JP")
+        self.assertTrue(StagingLanguagePersistence.exists(self.db_url))
+
+        staging = StagingLanguagePersistence(self.db_url, resume=True)
+        self.assertTrue(staging.resumed)
+        # Writing what was already written changes nothing
+        staging.persist_language("aaa", "Alpha", "JP")
+        staging.persist_language("bbb", "Beta", "JP")
+        self.assertEqual(1, len(list(staging.lang_db[
+            LanguagePersistence.ALIAS_TABLE].find(iso="aaa"))))
+        staging.swap_in()
+        self.p.check_for_updates()
+        self.assertEqual(["aaa", "bbb"], self.p.get_all_iso_codes())
+
+    def test_in_memory_db(self):
+        self.assertRaises(ValueError, StagingLanguagePersistence, "sqlite://")
+
+
+class _RecordingConnection(object):
+    """Records the statements executed on it, returning row for each"""
+    def __init__(self, row=None):
+        self.row = row
+        self.statements = []
+
+    def execute(self, statement, *params):
+        self.statements.append((statement,) + params)
+        return self
+
+    def first(self):
+        return self.row
+
+
+class TestPostgresStaging(unittest.TestCase):
+
+    def test_staging_schema_url(self):
+        self.assertEqual(
+            "postgresql://esteele@/language_explorer?options=-csearch_path"
+            "%3Dlanguage_explorer_staging",
+            StagingLanguagePersistence._staging_schema_url(
+                "postgresql://esteele@/language_explorer"))
+        self.assertEqual(
+            "postgresql://esteele@/language_explorer?sslmode=require"
+            "&options=-csearch_path%3Dlanguage_explorer_staging",
+            StagingLanguagePersistence._staging_schema_url(
+                "postgresql://esteele@/language_explorer?sslmode=require"))
+        self.assertIsNone(StagingLanguagePersistence._staging_path(
+            "postgresql://esteele@/language_explorer"))
+
+    def test_schema_statements(self):
+        connection = _RecordingConnection()
+        StagingLanguagePersistence._create_staging_schema(connection)
+        StagingLanguagePersistence._swap_schemas(connection)
+        self.assertEqual(
+            [("DROP SCHEMA IF EXISTS language_explorer_staging CASCADE",),
+             ("CREATE SCHEMA language_explorer_staging",),
+             ("DROP SCHEMA IF EXISTS language_explorer_previous CASCADE",),
+             ("ALTER SCHEMA public RENAME TO language_explorer_previous",),
+             ("ALTER SCHEMA language_explorer_staging RENAME TO public",)],
+            connection.statements)
+
+    def test_copy_statements(self):
+        connection = _RecordingConnection()
+        StagingLanguagePersistence._copy_live_schema(connection,
+                                                     ["language"])
+        self.assertEqual(
+            [("CREATE TABLE language_explorer_staging.language "
+              "(LIKE public.language INCLUDING INDEXES)",),
+             ("CREATE SEQUENCE language_explorer_staging.language_id_seq "
+              "OWNED BY language_explorer_staging.language.id",),
+             ("ALTER TABLE language_explorer_staging.language ALTER COLUMN "
+              "id SET DEFAULT "
+              "nextval('language_explorer_staging.language_id_seq')",),
+             ("INSERT INTO language_explorer_staging.language "
+              "SELECT * FROM public.language",),
+             ("SELECT setval('language_explorer_staging.language_id_seq', "
+              "COALESCE(MAX(id), 0) + 1, false) "
+              "FROM language_explorer_staging.language",)],
+            connection.statements)
+
+    def test_swap_privileges(self):
+        connection = _RecordingConnection((True, True))
+        StagingLanguagePersistence._check_swap_privileges(connection)
+        [(statement, schema)] = connection.statements
+        self.assertIn("pg_namespace", statement)
+        self.assertEqual("public", schema)
+        for row in [(False, True), (True, False), None]:
+            self.assertRaises(
+                RuntimeError,
+                StagingLanguagePersistence._check_swap_privileges,
+                _RecordingConnection(row))
+
+
+class TestScratchPersistence(PersistenceTestCase):
+
+    def test_matches_live_writes(self):
+        expected = self.temp_persistence()
+        populate(expected)
+        scratch = self.temp_persistence(ScratchLanguagePersistence)
+        populate(scratch)
+        self.assertEqual(_contents(expected), _contents(scratch))
+        self.assertEqual(
+            0, scratch.lang_db.query("PRAGMA synchronous").next().values()[0])
@@ -0,0 +1,90 @@
+import unittest
+from language_explorer import static_build
+from language_explorer.persistence import LanguagePersistence
+
+__author__ = 'esteele'
+
+PAGE = """<html><head>
+<link rel="stylesheet" href="/static/style.css">
+<script src="/static/d3.min.js"></script></head><body>
+<a href="/">Home</a> <a href="/language/all">All</a>
+<a href="/language/iso/aer">Arrernte</a>
+<a href="http://www.ethnologue.com/">Ethnologue</a>
+<form action="/search" method="get"></form>
+<script>d3.json("/static/languages.json");
+var places = [{url: "language/iso/are", name: "Arrernte"}];</script>
+<p class="version">>######<</p></body></html>"""
+
+
+class TestStaticBuild(unittest.TestCase):
+
+    def test_rewrite_page(self):
+        html = static_build.rewrite_page(PAGE, "/language_explorer", "abc1234")
+        self.assertIn('href="/language_explorer/language/all.html"', html)
+        self.assertIn('href="/language_explorer/language/iso/aer.html"', html)
+        self.assertIn('action="/language_explorer/search.html"', html)
+        self.assertIn('url: "language/iso/are.html"', html)
+        self.assertIn('src="/language_explorer/static/d3.min.js"', html)
+        self.assertIn('d3.json("/language_explorer/static/languages.json")',
+                      html)
+        self.assertIn('href="http://www.ethnologue.com/"', html)
+        self.assertIn(">abc1234<", html)
+        # The root is served as index.html
+        self.assertIn('href="/language_explorer/"', html)
+
+    def test_rewrite_page_unprefixed(self):
+        html = static_build.rewrite_page(PAGE)
+        self.assertIn('href="/language/all.html"', html)
+        self.assertIn('href="/static/style.css"', html)
+        self.assertIn(static_build.COMMIT_STAMP, html)
+
+    def test_linked_paths(self):
+        self.assertEqual(
+            set(["/", "/language/all", "/language/iso/aer", "/search",
+                 "/language/iso/are"]),
+            static_build.linked_paths(PAGE))
+
+    def test_output_filename(self):
+        self.assertEqual("index.html", static_build.output_filename("/"))
+        self.assertEqual("language/iso/aer.html",
+                         static_build.output_filename("/language/iso/aer"))
+
+    def test_changes_since(self):
+        runs = [
+            {"changes": {"from_generation": "g2", "to_generation": "g3",
+                         "isos": {"language": {"updated": ["aaa"]}}}},
+            {"changes": {"from_generation": "g1", "to_generation": "g2",
+                         "isos": {"language": {"inserted": ["bbb"]},
+                                  "language_alias": {"deleted": ["ccc"]}}}},
+            # From before changes were recorded
+            {},
+        ]
+        self.assertEqual(
+            {"language": set(["aaa", "bbb"]), "language_alias": set(["ccc"])},
+            static_build.changes_since(runs, "g1", "g3"))
+        self.assertEqual({}, static_build.changes_since(runs, "g3", "g3"))
+        # Changed other than by a recorded load
+        self.assertIsNone(static_build.changes_since(runs, "g1", "g4"))
+        self.assertIsNone(static_build.changes_since(runs, "g0", "g3"))
+
+    def test_pages_to_rerender(self):
+        links = {"/": ["/language/all"],
+                 "/language/all": ["/language/iso/aaa", "/language/iso/bbb",
+                                   "/language/iso/ccc"],
+                 "/language/iso/aaa": [], "/language/iso/bbb": [],
+                 "/language/iso/ccc": ["/language/iso/aaa"]}
+        self.assertEqual(
+            ["/language/all", "/language/iso/aaa", "/language/iso/ccc",
+             "/map", "/notes", "/table"],
+            static_build.pages_to_rerender(
+                {LanguagePersistence.LANGUAGE_TABLE: set(["aaa", "ddd"])},
+                links))
+        # Pages linking to a changed language show its name
+        self.assertEqual(
+            ["/language/all", "/language/iso/bbb"],
+            static_build.pages_to_rerender(
+                {LanguagePersistence.REFERENCE_TABLE: set(["bbb"])}, links))
+        self.assertEqual(set(links), static_build.reachable_paths(links))
+        links["/language/all"] = ["/language/iso/aaa"]
+        self.assertEqual(set(["/", "/language/all", "/language/iso/aaa"]),
+                         static_build.reachable_paths(links))
@@ -1,5 +1,6 @@
 from language_explorer import settings
-from language_explorer.language_sources.wals import WalsAdapter
+from language_explorer.language_sources.wals import WalsAdapter, \
+    split_iso_codes
 from tests.test_baseclasses import BaseAdapterTestCase
 import unittest
 
@@ -52,6 +53,17 @@ class TestWalsAdapter(BaseAdapterTestCase):
             self.assertEquals(wals_list,
                               self.source.get_wals_keys_for_iso(iso))
 
+    def test_no_partial_iso_matches(self):
+        # Part of "aer, are", which a substring match would find
+        self.assertEquals([], self.source.get_wals_keys_for_iso("r, a"))
+        self.assertEquals(None, self.source.get_primary_name_for_iso("ae"))
+
+    def test_split_iso_codes(self):
+        self.assertEquals(["aer", "are"], split_iso_codes("aer, are"))
+        self.assertEquals(["kij"], split_iso_codes("kij"))
+        self.assertEquals([], split_iso_codes(""))
+        self.assertEquals([], split_iso_codes(None))
+
     def test_classification_retrieval(self):
         # Not implemented
         self.assertEquals([], self.source.get_classification("dummy"))